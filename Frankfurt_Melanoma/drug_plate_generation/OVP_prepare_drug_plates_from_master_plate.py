@@ -1,7 +1,16 @@
 from opentrons import protocol_api
-import pandas as pd
+import sys
 from sys import platform
 
+# make the shared apx_opentrons package importable, locally and on the OT-2
+if platform == "win32":
+    sys.path.append(r"C:\Users\OT-Operator\Documents\OT-2_protocols\APx_opentrons_resources")
+elif platform == "linux":
+    sys.path.append("/data/user_storage/apricot_data")
+
+from apx_opentrons.metadata_resolver import load_plate_metadata
+from apx_opentrons.run_log import close_run_log, instrument
+
 # metadata
 metadata = {
     "protocolName": "OVP Prepare Drug Plates from Master Plate",
@@ -17,6 +26,9 @@ requirements = {"robotType": "OT-2", "apiLevel": "2.16"}
 # protocol run function
 def run(protocol: protocol_api.ProtocolContext):
 
+    # time every command into a run log on the robot
+    protocol = instrument(protocol, metadata["protocolName"])
+
     # load labware
     # TO-DO: change labware to match actual labware used
     tips = protocol.load_labware("opentrons_96_filtertiprack_20ul", 7)
@@ -36,19 +48,12 @@ def run(protocol: protocol_api.ProtocolContext):
                                  description="drugs to be transferred")
 
     # load some metadata we need later
-    if platform == "win32":
-        # load the drug layout on drug master plate
-        drug_plate_layout = pd.read_csv(r"C:\Users\OT-Operator\Documents\OT-2_protocols\APx_opentrons_resources\Frankfurt_Melanoma\metadata\drug_plate_metadata_v1.0.csv")
-        #drug_plate_layout = pd.read_csv(
-        #    r"K:\projects\OV_Precision\documents\plate_layout\drug_plate_metadata_v1.1.csv")
-    elif platform == "linux":
-        # load the drug layout on drug master plate
-        drug_plate_layout = pd.read_csv("/data/user_storage/apricot_data/Frankfurt_Melanoma/drug_plate_metadata_v1.0.csv")
+    drug_plate_layout = load_plate_metadata("Frankfurt_Melanoma", "drug_plate_metadata", "1.0")
 
 
     # load drugs into 96-well plate
-    for i, well in drug_plate_layout.iterrows():
-        well = drug_master_plate[well.row + str(well.col)]
+    for well in drug_plate_layout.wells:
+        well = drug_master_plate[well]
         well.load_liquid(liquid=drugs, volume=1000)
 
     # initialize pipette
@@ -63,7 +68,7 @@ def run(protocol: protocol_api.ProtocolContext):
     right_pipette.well_bottom_clearance.aspirate = 0.5
     right_pipette.well_bottom_clearance.dispense = 0.5
 
-    for col in drug_plate_layout["col"].unique():
+    for col in drug_plate_layout.columns():
         # pick up a column of tips
         left_pipette.pick_up_tip()
         # get source and destination wells
@@ -110,4 +115,7 @@ def run(protocol: protocol_api.ProtocolContext):
         # drop the tips with remaining 2 ul into trash
         left_pipette.drop_tip()
 
+    # close the run log
+    close_run_log(protocol)
+
 
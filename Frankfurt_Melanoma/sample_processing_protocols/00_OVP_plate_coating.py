@@ -1,73 +1,18 @@
 from opentrons import protocol_api
-from opentrons.protocol_api import Well
-import pandas as pd
+import sys
 from sys import platform
-from typing import Optional
-import numpy as np
 import itertools
 
-# helper function to distribute with more flexibility
-def distribute(volume: int,
-               source: Well,
-               dest: list[Well],
-               pipette,
-               protocol: protocol_api.ProtocolContext,
-               aspirate_delay: float = 0,
-               dispense_delay: float = 0,
-               residual_volume: int = 0,
-               residual_dispense_height_from_bottom: Optional[int] = None,
-               touch_tip_radius: Optional[float] = None,
-               touch_tip_v_offset: Optional[float] = None,
-               touch_tip: bool = False,
-               residual_dispense_location: Optional[Well] = None,
-               n_mix: Optional[int] = None,
-               aspirate_rate: float = 1.0,
-               dispense_rate: float = 1.0,):
-    
-    # based on the volume, calculate how often can be pipetted
-    n_pipetting_steps = np.floor((300 - residual_volume)/volume) # TO-DO: max volume of pipette
-    
-    # chunk up the destinations
-    chunked_dest = np.array_split(dest, np.ceil(len(dest)/n_pipetting_steps))
-
-    for sub_list in chunked_dest:
-        pipette.pick_up_tip()
-
-        # mix if required
-        if n_mix is not None:
-            pipette.mix(
-                repetitions=n_mix,
-                volume=len(sub_list)*volume + residual_volume, 
-                location=source,
-                rate=aspirate_rate
-                )     
-        # iterate over destination sublists and aspirate
-        pipette.aspirate(
-            volume=len(sub_list)*volume + residual_volume, 
-            location=source,
-            rate=aspirate_rate
-        )
-
-        # short delay
-        protocol.delay(seconds=aspirate_delay)
-        # iterate over each destination and dispense 5 ul
-        for destination in sub_list:
-            pipette.dispense(
-                volume=volume,
-                location=destination,
-                rate=dispense_rate
-            )
-            # short delay
-            protocol.delay(seconds=dispense_delay)
-
-            if touch_tip:
-                pipette.touch_tip(radius=touch_tip_radius,
-                                  v_offset=touch_tip_v_offset)
-
-        if residual_dispense_location is not None:
-            pipette.dispense(location=residual_dispense_location.bottom(z=residual_dispense_height_from_bottom))
-        # drop tip
-        pipette.drop_tip()
+# make the shared apx_opentrons package importable, locally and on the OT-2
+if platform == "win32":
+    sys.path.append(r"C:\Users\OT-Operator\Documents\OT-2_protocols\APx_opentrons_resources")
+elif platform == "linux":
+    sys.path.append("/data/user_storage/apricot_data")
+
+from apx_opentrons.liquid_handling import distribute
+from apx_opentrons.metadata_resolver import load_plate_metadata
+from apx_opentrons.run_log import close_run_log, instrument
+from apx_opentrons.volume_tracking import VolumeTracker
 
 # metadata
 metadata = {
@@ -110,6 +55,10 @@ def add_parameters(parameters: protocol_api.Parameters):
 # protocol run function
 def run(protocol: protocol_api.ProtocolContext):
 
+    # time every command into a run log on the robot
+    protocol = instrument(protocol, metadata["protocolName"])
+    volumes = VolumeTracker()
+
     # load labware
     # TO-DO: change labware to match actual labware used
     tips = protocol.load_labware("opentrons_96_tiprack_300ul", 1)
@@ -126,31 +75,23 @@ def run(protocol: protocol_api.ProtocolContext):
                                            description="coating solution")
 
     # load some metadata we need later
-    if platform == "win32":
-        # load the drug layout on drug master plate and final 384-well plate
-        drug_plate_metadata = pd.read_csv(r"C:\Users\OT-Operator\Documents\OT-2_protocols\APx_opentrons_resources\OVP\metadata\drug_plate_metadata_v1.3.csv")
-        cell_plate_metadata = pd.read_csv(r"C:\Users\OT-Operator\Documents\OT-2_protocols\APx_opentrons_resources\OVP\metadata\plate_metadata_v1.2.csv")
-
-    elif platform == "linux":
-        # load the drug layout on drug master plate and final 384-well plate
-        drug_plate_metadata = pd.read_csv("/data/user_storage/apricot_data/drug_plate_metadata_v1.3.csv")
-        cell_plate_metadata = pd.read_csv("/data/user_storage/apricot_data/plate_metadata_v1.2.csv")
+    drug_plate_metadata = load_plate_metadata("OVP", "drug_plate_metadata", "1.3")
+    cell_plate_metadata = load_plate_metadata("OVP", "plate_metadata", "1.2")
 
     # process one or two patient samples
     if protocol.params.process_full_plate == False:
-        cell_plate_metadata = cell_plate_metadata.loc[
-            cell_plate_metadata["sample"] != "patient_2"]
+        cell_plate_metadata = cell_plate_metadata.exclude("sample", "patient_2")
     
     # include or exclude experimental drugs
     if protocol.params.exclude_experimental_drugs:
-        cell_plate_metadata = cell_plate_metadata.loc[cell_plate_metadata.drug_panel == "standard"]
+        cell_plate_metadata = cell_plate_metadata.select("drug_panel", "standard")
 
-    for i, well in cell_plate_metadata.iterrows():
-        well = cell_plate[well.row + str(well.col)]
-        well.load_liquid(liquid=sample, volume=40)
+    for well in cell_plate_metadata.wells:
+        well = cell_plate[well]
+        volumes.load_liquid(well, sample, 40)
 
     # load media into reservoir
-    reservoir['A1'].load_liquid(liquid=coating_solution, volume=4000)
+    volumes.load_liquid(reservoir['A1'], coating_solution, 4000)
 
     # initialize pipette
     pipette = protocol.load_instrument("p300_multi_gen2", "left",
@@ -160,7 +101,7 @@ def run(protocol: protocol_api.ProtocolContext):
     pipette.well_bottom_clearance.aspirate = 1.0
     pipette.well_bottom_clearance.dispense = 1.0
 
-    dest_wells = [[row + str(col) for col in cell_plate_metadata.col.unique()] for row in ["A", "B"]]
+    dest_wells = [[row + str(col) for col in cell_plate_metadata.columns()] for row in ["A", "B"]]
     dest_wells = list(itertools.chain.from_iterable(dest_wells))
     destinations = [cell_plate[well] for well in dest_wells]
 
@@ -176,6 +117,7 @@ def run(protocol: protocol_api.ProtocolContext):
         residual_volume=20,
         pipette=pipette,
         protocol=protocol,
+        volumes=volumes,
         residual_dispense_location=reservoir[source_well],
         residual_dispense_height_from_bottom=1,
         touch_tip=True,
@@ -184,4 +126,7 @@ def run(protocol: protocol_api.ProtocolContext):
 )
     
 
+    volumes.report(protocol)
 
+    # close the run log
+    close_run_log(protocol)
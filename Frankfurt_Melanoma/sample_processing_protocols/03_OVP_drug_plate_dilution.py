@@ -1,7 +1,16 @@
 from opentrons import protocol_api
-import pandas as pd
+import sys
 from sys import platform
 
+# make the shared apx_opentrons package importable, locally and on the OT-2
+if platform == "win32":
+    sys.path.append(r"C:\Users\OT-Operator\Documents\OT-2_protocols\APx_opentrons_resources")
+elif platform == "linux":
+    sys.path.append("/data/user_storage/apricot_data")
+
+from apx_opentrons.metadata_resolver import load_plate_metadata
+from apx_opentrons.run_log import close_run_log, instrument
+
 # metadata
 metadata = {
     "protocolName": "Frankfurt Melanoma Drug Plate Dilution",
@@ -48,6 +57,9 @@ def add_parameters(parameters: protocol_api.Parameters):
 # protocol run function
 def run(protocol: protocol_api.ProtocolContext):
 
+    # time every command into a run log on the robot
+    protocol = instrument(protocol, metadata["protocolName"])
+
     # load labware
     # TO-DO: change labware to match actual labware used
     tips_1 = protocol.load_labware("opentrons_96_tiprack_300ul", 1)
@@ -66,24 +78,18 @@ def run(protocol: protocol_api.ProtocolContext):
                                  description="drugs to be transferred")
 
     # load some metadata we need later
-    if platform == "win32":
-        # load the drug layout on drug master plate
-        drug_plate_metadata_ovarian = pd.read_csv(r"C:\Users\OT-Operator\Documents\OT-2_protocols\APx_opentrons_resources\Frankfurt_Melanoma\metadata\drug_plate_metadata_ovarian_v1.3.csv")
-        drug_plate_metadata_melanoma = pd.read_csv(r"C:\Users\OT-Operator\Documents\OT-2_protocols\APx_opentrons_resources\Frankfurt_Melanoma\metadata\drug_plate_metadata_v1.0.csv")
-    elif platform == "linux":
-        # load the drug layout on drug master plate
-        drug_plate_metadata_ovarian = pd.read_csv("/data/user_storage/apricot_data/Frankfurt_Melanoma/drug_plate_metadata_ovarian_v1.3.csv")
-        drug_plate_metadata_melanoma = pd.read_csv("/data/user_storage/apricot_data/Frankfurt_Melanoma/drug_plate_metadata_v1.0.csv")
+    drug_plate_metadata_ovarian = load_plate_metadata("Frankfurt_Melanoma", "drug_plate_metadata_ovarian", "1.3")
+    drug_plate_metadata_melanoma = load_plate_metadata("Frankfurt_Melanoma", "drug_plate_metadata", "1.0")
 
 
     # load drugs into 96-well plate
-    for i, well in drug_plate_metadata_ovarian.iterrows():
-        well = drug_plate_ovarian[well.row + str(well.col)]
+    for well in drug_plate_metadata_ovarian.wells:
+        well = drug_plate_ovarian[well]
         well.load_liquid(liquid=drugs, volume=5)
 
     # load drugs into 96-well plate
-    for i, well in drug_plate_metadata_melanoma.iterrows():
-        well = drug_plate_melanoma[well.row + str(well.col)]
+    for well in drug_plate_metadata_melanoma.wells:
+        well = drug_plate_melanoma[well]
         well.load_liquid(liquid=drugs, volume=5)
 
     # load media into reservoir
@@ -102,7 +108,7 @@ def run(protocol: protocol_api.ProtocolContext):
 
     # dilute ovarian drug plate
 
-    dest_wells = ["A" + str(col) for col in drug_plate_metadata_ovarian.col.unique()]
+    dest_wells = ["A" + str(col) for col in drug_plate_metadata_ovarian.columns()]
     destinations = [drug_plate_ovarian[well] for well in dest_wells]
 
     source_well = "A1"
@@ -121,7 +127,7 @@ def run(protocol: protocol_api.ProtocolContext):
 
     # dilute melanoma drug plate
 
-    dest_wells = ["A" + str(col) for col in drug_plate_metadata_melanoma.col.unique()]
+    dest_wells = ["A" + str(col) for col in drug_plate_metadata_melanoma.columns()]
     destinations = [drug_plate_melanoma[well] for well in dest_wells]
 
     source_well = "A3"
@@ -138,3 +144,6 @@ def run(protocol: protocol_api.ProtocolContext):
                             mix_after=(3, 200),
                             new_tip='always')
 
+    # close the run log
+    close_run_log(protocol)
+
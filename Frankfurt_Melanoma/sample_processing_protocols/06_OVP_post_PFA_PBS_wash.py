@@ -1,139 +1,18 @@
 from opentrons import protocol_api
-from opentrons.protocol_api import Well
-import pandas as pd
+import sys
 from sys import platform
-from typing import Optional
-import numpy as np
 import itertools
 
-# helper function to distribute with more flexibility
-def distribute(volume: int,
-               source: Well,
-               dest: list[Well],
-               pipette,
-               protocol: protocol_api.ProtocolContext,
-               aspirate_delay: float = 0,
-               dispense_delay: float = 0,
-               residual_volume: int = 0,
-               residual_dispense_height_from_bottom: Optional[int] = None,
-               touch_tip_radius: Optional[float] = None,
-               touch_tip_v_offset: Optional[float] = None,
-               touch_tip: bool = False,
-               residual_dispense_location: Optional[Well] = None,
-               n_mix: Optional[int] = None,
-               aspirate_rate: float = 1.0,
-               dispense_rate: float = 1.0,
-               reuse_tips=False,
-               ignore_tips=False):
-    
-    # based on the volume, calculate how often can be pipetted
-    n_pipetting_steps = np.floor((300 - residual_volume)/volume) # TO-DO: max volume of pipette
-    
-    # chunk up the destinations
-    chunked_dest = np.array_split(dest, np.ceil(len(dest)/n_pipetting_steps))
-
-    for i, sub_list in enumerate(chunked_dest):
-        if ignore_tips == False:
-            if reuse_tips == False:
-                pipette.pick_up_tip()
-            if (reuse_tips == True) & (i == 0):
-                pipette.pick_up_tip()
-
-        # mix if required
-        if n_mix is not None:
-            pipette.mix(
-                repetitions=n_mix,
-                volume=len(sub_list)*volume + residual_volume, 
-                location=source,
-                rate=aspirate_rate
-                )     
-        # iterate over destination sublists and aspirate
-        pipette.aspirate(
-            volume=len(sub_list)*volume + residual_volume, 
-            location=source,
-            rate=aspirate_rate
-        )
-
-        # short delay
-        protocol.delay(seconds=aspirate_delay)
-        # iterate over each destination and dispense 5 ul
-        for destination in sub_list:
-            pipette.dispense(
-                volume=volume,
-                location=destination,
-                rate=dispense_rate
-            )
-            # short delay
-            protocol.delay(seconds=dispense_delay)
-
-            if touch_tip:
-                pipette.touch_tip(radius=touch_tip_radius,
-                                  v_offset=touch_tip_v_offset)
-
-        if residual_dispense_location is not None:
-            pipette.dispense(location=residual_dispense_location.bottom(z=residual_dispense_height_from_bottom))
-        # drop tip
-        if ignore_tips == False:
-            if (reuse_tips == False) or (i == (len(chunked_dest) -1)):
-                pipette.drop_tip()
-
-# helper function to consolidate with more flexibility
-def consolidate(volume: int,
-               source: list[Well],
-               dest: Well,
-               pipette,
-               protocol: protocol_api.ProtocolContext,
-               aspirate_delay: float = 0,
-               dispense_delay: float = 0,
-               touch_tip_radius: Optional[float] = None,
-               touch_tip_v_offset: Optional[float] = None,
-               touch_tip: bool = False,
-               aspirate_rate: float = 1.0,
-               dispense_rate: float = 1.0,
-               reuse_tips=False,
-               ignore_tips=False):
-    
-    # based on the volume, calculate how often can be pipetted
-    n_pipetting_steps = np.floor((300)/volume) # TO-DO: max volume of pipette
-    
-    # chunk up the destinations
-    chunked_dest = np.array_split(source, np.ceil(len(source)/n_pipetting_steps))
-
-    for i, sub_list in enumerate(chunked_dest):
-        if ignore_tips == False:
-            if reuse_tips == False:
-                pipette.pick_up_tip()
-            if (reuse_tips == True) & (i == 0):
-                pipette.pick_up_tip() 
+# make the shared apx_opentrons package importable, locally and on the OT-2
+if platform == "win32":
+    sys.path.append(r"C:\Users\OT-Operator\Documents\OT-2_protocols\APx_opentrons_resources")
+elif platform == "linux":
+    sys.path.append("/data/user_storage/apricot_data")
 
-        # iterate over each destination and dispense 5 ul
-        for source in sub_list:
-            pipette.aspirate(
-                volume=volume,
-                location=source,
-                rate=aspirate_rate
-            )
-            # short delay
-            protocol.delay(seconds=dispense_delay)
-
-        # iterate over destination sublists and aspirate
-        pipette.dispense(
-            volume=len(sub_list)*volume, 
-            location=dest,
-            rate=dispense_rate
-        )
-
-        if touch_tip:
-                pipette.touch_tip(radius=touch_tip_radius,
-                                  v_offset=touch_tip_v_offset) 
-
-        # short delay
-        protocol.delay(seconds=aspirate_delay)
-
-        # drop tip
-        if ignore_tips == False:
-            if (reuse_tips == False) or (i == (len(chunked_dest) -1)):
-                pipette.drop_tip()
+from apx_opentrons.liquid_handling import consolidate, wash
+from apx_opentrons.metadata_resolver import load_plate_metadata
+from apx_opentrons.run_log import close_run_log, instrument
+from apx_opentrons.volume_tracking import VolumeTracker
 
 # metadata
 metadata = {
@@ -185,6 +64,10 @@ def add_parameters(parameters: protocol_api.Parameters):
 # protocol run function
 def run(protocol: protocol_api.ProtocolContext):
 
+    # time every command into a run log on the robot
+    protocol = instrument(protocol, metadata["protocolName"])
+    volumes = VolumeTracker()
+
     # load labware
     # TO-DO: change labware to match actual labware used
     tips = protocol.load_labware("opentrons_96_tiprack_300ul", 1)
@@ -201,30 +84,23 @@ def run(protocol: protocol_api.ProtocolContext):
                                     description="waste PBS collection")
 
     # load some metadata we need later
-    if platform == "win32":
-        # load the drug layout on drug master plate and final 384-well plate
-        cell_plate_metadata = pd.read_csv(r"C:\Users\OT-Operator\Documents\OT-2_protocols\APx_opentrons_resources\OVP\metadata\plate_metadata_v1.2.csv")
-
-    elif platform == "linux":
-        # load the drug layout on drug master plate and final 384-well plate
-        cell_plate_metadata = pd.read_csv("/data/user_storage/apricot_data/plate_metadata_v1.2.csv")
+    cell_plate_metadata = load_plate_metadata("OVP", "plate_metadata", "1.2")
 
     # process one or two patient samples
     if protocol.params.process_full_plate == False:
-        cell_plate_metadata = cell_plate_metadata.loc[
-            cell_plate_metadata["sample"] != "patient_2"]
+        cell_plate_metadata = cell_plate_metadata.exclude("sample", "patient_2")
     
     # include or exclude experimental drugs
     if protocol.params.exclude_experimental_drugs:
-        cell_plate_metadata = cell_plate_metadata.loc[cell_plate_metadata.drug_panel == "standard"]
+        cell_plate_metadata = cell_plate_metadata.select("drug_panel", "standard")
 
-    for i, well in cell_plate_metadata.iterrows():
-        well = cell_plate[well.row + str(well.col)]
-        well.load_liquid(liquid=sample, volume=90)
+    for well in cell_plate_metadata.wells:
+        well = cell_plate[well]
+        volumes.load_liquid(well, sample, 90)
 
     # load media into reservoir
-    reservoir['A1'].load_liquid(liquid=PBS, volume=50000)
-    trash['A1'].load_liquid(liquid=waste_PBS, volume=100000)
+    volumes.load_liquid(reservoir['A1'], PBS, 50000)
+    volumes.load_liquid(trash['A1'], waste_PBS, 100000)
 
     # initialize pipette
     pipette = protocol.load_instrument("p300_multi_gen2", "left",
@@ -234,7 +110,7 @@ def run(protocol: protocol_api.ProtocolContext):
     pipette.well_bottom_clearance.aspirate = 3
     pipette.well_bottom_clearance.dispense = 3.5
 
-    dest_wells = [[row + str(col) for col in cell_plate_metadata.col.unique()] for row in ["A", "B"]]
+    dest_wells = [[row + str(col) for col in cell_plate_metadata.columns()] for row in ["A", "B"]]
     dest_wells = list(itertools.chain.from_iterable(dest_wells))
     destinations = [cell_plate[well] for well in dest_wells]
 
@@ -251,46 +127,31 @@ def run(protocol: protocol_api.ProtocolContext):
         aspirate_rate=0.2,
         pipette=pipette,
         protocol=protocol,
+        volumes=volumes,
         touch_tip=False,
         ignore_tips=True,
         )
     
-    for i in range(0, protocol.params.n_wash):
-        distribute(
-            volume=60,
-            source=reservoir[source_well],
-            dest=destinations,
-            aspirate_delay=0,
-            dispense_delay=0,
-            dispense_rate=0.2,
-            residual_volume=20,
-            pipette=pipette,
-            protocol=protocol,
-            residual_dispense_location=reservoir[source_well],
-            residual_dispense_height_from_bottom=3.5,
-            touch_tip=False,
-            ignore_tips=True,
-            )
-        
-        if i == (protocol.params.n_wash - 1):
-            consolidate_volume = 50
-        else:
-            consolidate_volume = 60
-        
-        consolidate(
-            volume=consolidate_volume,
-            source=destinations,
-            dest=trash[source_well],
-            aspirate_delay=0,
-            dispense_delay=0,
-            aspirate_rate=0.2,
-            pipette=pipette,
-            protocol=protocol,
-            touch_tip=False,
-            ignore_tips=True,
-            )
-        
+    wash(
+        volume=60,
+        source=reservoir[source_well],
+        wells=destinations,
+        waste=trash[source_well],
+        n_cycles=protocol.params.n_wash,
+        final_remove_volume=50,
+        fill_rate=0.2,
+        remove_rate=0.2,
+        residual_volume=20,
+        pipette=pipette,
+        protocol=protocol,
+        volumes=volumes,
+        ignore_tips=True,
+        )
+
     pipette.drop_tip()
     
 
+    volumes.report(protocol)
 
+    # close the run log
+    close_run_log(protocol)
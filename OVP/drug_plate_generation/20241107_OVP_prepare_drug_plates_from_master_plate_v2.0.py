@@ -1,7 +1,22 @@
 from opentrons import protocol_api
-import pandas as pd
+import sys
 from sys import platform
 
+# make the shared apx_opentrons package importable, locally and on the OT-2
+if platform == "win32":
+    sys.path.append(r"C:\Users\OT-Operator\Documents\OT-2_protocols\APx_opentrons_resources")
+elif platform == "linux":
+    sys.path.append("/data/user_storage/apricot_data")
+
+from apx_opentrons.drug_plate_campaign import (DRUG_VOLUME, RESIDUAL_VOLUME, format_campaign,
+                                               format_summary, plan_campaign, plan_column,
+                                               summarize_campaign)
+from apx_opentrons.liquid_handling import pipette_limits
+from apx_opentrons.metadata_resolver import load_plate_metadata
+from apx_opentrons.run_log import close_run_log, instrument
+from apx_opentrons.timing import TimingModel
+from apx_opentrons.volume_tracking import DEAD_VOLUMES
+
 # metadata
 metadata = {
     "protocolName": "OVP Prepare Drug Plates from Master Plate",
@@ -12,23 +27,45 @@ metadata = {
     }
 
 # requirements
-requirements = {"robotType": "OT-2", "apiLevel": "2.16"}
+requirements = {"robotType": "OT-2", "apiLevel": "2.18"}
+
+# columns of the 20 ul tip rack in slot 7
+TIP_COLUMNS = 12
+
+def add_parameters(parameters: protocol_api.Parameters):
+
+    parameters.add_int(
+    variable_name="n_plates",
+    display_name="Number of drug plates",
+    description="How many drug plates should be prepared from the master plate?",
+    minimum=1,
+    maximum=60,
+    default=6,
+    )
+
+    parameters.add_int(
+    variable_name="plates_per_load",
+    display_name="Drug plates per deck load",
+    description="Drug plates on the deck at once (slots 1-6, then 9-11), swapped between loads.",
+    minimum=1,
+    maximum=9,
+    default=6,
+    )
 
 # protocol run function
 def run(protocol: protocol_api.ProtocolContext):
 
+    # time every command into a run log on the robot
+    protocol = instrument(protocol, metadata["protocolName"])
+
     # load labware
     # TO-DO: change labware to match actual labware used
     tips = protocol.load_labware("opentrons_96_filtertiprack_20ul", 7)
     drug_master_plate = protocol.load_labware("greinermasterblock_96_wellplate_2000ul", 8)
-    drug_plates = [protocol.load_labware("greinermasterblock_96_wellplate_2000ul", i)
-                   for i in range(1, 7)]
 
     # for local testing
     #drug_master_plate = protocol.load_labware(
     #    "nest_96_wellplate_200ul_flat", 8)
-    #drug_plates = [protocol.load_labware("nest_96_wellplate_200ul_flat", i)
-    #               for i in range(1, 7)]
 
 
     # optional: set liquids
@@ -36,19 +73,12 @@ def run(protocol: protocol_api.ProtocolContext):
                                  description="drugs to be transferred")
 
     # load some metadata we need later
-    if platform == "win32":
-        # load the drug layout on drug master plate
-        drug_plate_layout = pd.read_csv(r"C:\Users\OT-Operator\Documents\OT-2_protocols\APx_opentrons_resources\OVP\metadata\drug_plate_metadata_v2.0.csv")
-        #drug_plate_layout = pd.read_csv(
-        #    r"K:\projects\OV_Precision\documents\plate_layout\drug_plate_metadata_v1.1.csv")
-    elif platform == "linux":
-        # load the drug layout on drug master plate
-        drug_plate_layout = pd.read_csv("/data/user_storage/apricot_data/OVP/drug_plate_metadata_v2.0.csv")
+    drug_plate_layout = load_plate_metadata("OVP", "drug_plate_metadata", "2.0")
 
 
     # load drugs into 96-well plate
-    for i, well in drug_plate_layout.iterrows():
-        well = drug_master_plate[well.row + str(well.col)]
+    for well in drug_plate_layout.wells:
+        well = drug_master_plate[well]
         well.load_liquid(liquid=drugs, volume=1000)
 
     # initialize pipette
@@ -63,54 +93,59 @@ def run(protocol: protocol_api.ProtocolContext):
     right_pipette.well_bottom_clearance.aspirate = 0.5
     right_pipette.well_bottom_clearance.dispense = 0.5
 
-    # antibody drugs in columns 6 and 12 (manually pipetted)
-    drug_plate_layout = drug_plate_layout.loc[~drug_plate_layout["col"].isin([6, 12])]
-
-    for col in drug_plate_layout["col"].unique():
-        # pick up a column of tips
-        left_pipette.pick_up_tip()
-        # get source and destination wells
-        source_well = "A" + str(col)
-        destination_well = source_well
-
-        # pre-wet
-        left_pipette.aspirate(volume=20,
-                            location=drug_master_plate[source_well],
-                            rate=0.5)
-        left_pipette.dispense(volume=20,
-                              location=drug_master_plate[source_well],
-                              rate=0.5)
-
-        # aspirate 20 ul from source to distribute
-        left_pipette.aspirate(volume=20,
-                            location=drug_master_plate[source_well],
-                            rate=0.5)
-        # short delay to allow viscous liquid to settle
-        protocol.delay(seconds=1.0)
-        # tip touch with low radius and -25 mm offset from top of well
-        left_pipette.touch_tip(radius=0.4,
-                                v_offset=-25)
-
-        for drug_plate in drug_plates:
-            left_pipette.dispense(volume=3,
-                                  location=drug_plate[destination_well],
-                                  rate=0.5)
-            # short delay to allow viscous liquid to settle
-            protocol.delay(seconds=1.0)
-            # tip touch with low radius and -25 mm offset from top of well
-            left_pipette.touch_tip(radius=0.4,
-                                    v_offset=-25)
-            
-        # some weird behaviour with blow_out: when blowing out into the liquid, the next round
-        # does not aspirate enough. Possibly because of an airbubble that gets deposited.
-        # It's fine however if the blowout does not go into the liquid. For now,
-        # we skip the blowout.
-        
-        #left_pipette.blow_out(location=drug_master_plate['A1'])
-        #left_pipette.touch_tip(radius=0.5,
-        #                            v_offset=-25)
-                              
-        # drop the tips with remaining 2 ul into trash
-        left_pipette.drop_tip()
+    # split the drug plates into deck loads, each 20 ul aspiration serves
+    # as many plates as it holds
+    limits = pipette_limits(left_pipette)
+    loads = plan_campaign(protocol.params.n_plates, protocol.params.plates_per_load,
+                          DRUG_VOLUME, limits, RESIDUAL_VOLUME)
+    for line in format_campaign(loads, DRUG_VOLUME, limits, RESIDUAL_VOLUME):
+        protocol.comment(line)
 
+    plate_slots = sorted({slot for load in loads for slot in load.slots})
+    drug_plates = {slot: protocol.load_labware("greinermasterblock_96_wellplate_2000ul", slot)
+                   for slot in plate_slots}
+    #drug_plates = {slot: protocol.load_labware("nest_96_wellplate_200ul_flat", slot)
+    #               for slot in plate_slots}
 
+    # antibody drugs in columns 6 and 12 (manually pipetted)
+    drug_plate_layout = drug_plate_layout.exclude("col", 6, 12)
+    columns = drug_plate_layout.columns()
+
+    summary = summarize_campaign(drug_plate_layout, protocol.params.n_plates,
+                                 protocol.params.plates_per_load, limits, DRUG_VOLUME,
+                                 RESIDUAL_VOLUME, DEAD_VOLUMES.get(drug_master_plate.load_name, 0),
+                                 TimingModel.for_pipette(left_pipette), version="2.0")
+    for line in format_summary(summary):
+        protocol.comment(line)
+
+    tip_columns_left = TIP_COLUMNS
+    for load in loads:
+        if load.number > 1:
+            message = (f"Replace the drug plates in slots "
+                       f"{', '.join(str(slot) for slot in load.slots)} with {load.label}")
+            if tip_columns_left < len(columns):
+                message += " and the tip rack in slot 7"
+            protocol.pause(msg=message + ".")
+            if tip_columns_left < len(columns):
+                left_pipette.reset_tipracks()
+                tip_columns_left = TIP_COLUMNS
+
+        for col in columns:
+            # same column on the master plate and the drug plates
+            well = "A" + str(col)
+            plan = plan_column(
+                volume=DRUG_VOLUME,
+                source=drug_master_plate[well],
+                dest=[[drug_plates[slot][well] for slot in slots]
+                      for slots in load.aspirations(DRUG_VOLUME, limits, RESIDUAL_VOLUME)],
+                limits=limits,
+                residual_volume=RESIDUAL_VOLUME,
+                # tip touch with low radius and -25 mm offset from top of well
+                touch_tip_radius=0.4,
+                touch_tip_v_offset=-25,
+                )
+            plan.execute(left_pipette, protocol)
+            tip_columns_left -= 1
+
+    # close the run log
+    close_run_log(protocol)
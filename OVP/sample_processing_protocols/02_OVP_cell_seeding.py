@@ -1,90 +1,19 @@
 from opentrons import protocol_api
-from opentrons.protocol_api import Well
-import pandas as pd
+import sys
 from sys import platform
-from typing import Optional
-import numpy as np
 import itertools
-import string
-
-# helper function to distribute with more flexibility
-def distribute(volume: int,
-               source: Well,
-               dest: list[Well],
-               pipette,
-               protocol: protocol_api.ProtocolContext,
-               aspirate_delay: float = 0,
-               dispense_delay: float = 0,
-               residual_volume: int = 0,
-               residual_dispense_height_from_bottom: Optional[int] = None,
-               touch_tip_radius: Optional[float] = None,
-               touch_tip_v_offset: Optional[float] = None,
-               touch_tip: bool = False,
-               residual_dispense_location: Optional[Well] = None,
-               n_mix: Optional[int] = None,
-               aspirate_rate: float = 1.0,
-               dispense_rate: float = 1.0,
-               reuse_tips=False,
-               ignore_tips=False,
-               pre_wet_tips=False,):
-    
-    # based on the volume, calculate how often can be pipetted
-    n_pipetting_steps = np.floor((300 - residual_volume)/volume) # TO-DO: max volume of pipette
-    
-    # chunk up the destinations
-    chunked_dest = np.array_split(dest, np.ceil(len(dest)/n_pipetting_steps))
-
-    for i, sub_list in enumerate(chunked_dest):
-        if ignore_tips == False:
-            if reuse_tips == False:
-                pipette.pick_up_tip()
-            if (reuse_tips == True) & (i == 0):
-                pipette.pick_up_tip()
-
-        # pre-wet tip if required:
-        if pre_wet_tips:
-            pipette.aspirate(volume=300,
-                             location=source)
-            pipette.dispense(volume=300,
-                             location=source)
-
-        # mix if required
-        if n_mix is not None:
-            pipette.mix(
-                repetitions=n_mix,
-                volume=len(sub_list)*volume + residual_volume, 
-                location=source,
-                rate=aspirate_rate
-                )     
-        # iterate over destination sublists and aspirate
-        pipette.aspirate(
-            volume=len(sub_list)*volume + residual_volume, 
-            location=source,
-            rate=aspirate_rate
-        )
 
-        # short delay
-        protocol.delay(seconds=aspirate_delay)
-        # iterate over each destination and dispense 5 ul
-        for destination in sub_list:
-            pipette.dispense(
-                volume=volume,
-                location=destination,
-                rate=dispense_rate
-            )
-            # short delay
-            protocol.delay(seconds=dispense_delay)
-
-            if touch_tip:
-                pipette.touch_tip(radius=touch_tip_radius,
-                                  v_offset=touch_tip_v_offset)
-        if i != len(chunked_dest):
-            if residual_dispense_location is not None:
-                pipette.dispense(location=residual_dispense_location.bottom(z=residual_dispense_height_from_bottom))
-        # drop tip
-        if ignore_tips == False:
-            if (reuse_tips == False) or (i == (len(chunked_dest) -1)):
-                pipette.drop_tip()
+# make the shared apx_opentrons package importable, locally and on the OT-2
+if platform == "win32":
+    sys.path.append(r"C:\Users\OT-Operator\Documents\OT-2_protocols\APx_opentrons_resources")
+elif platform == "linux":
+    sys.path.append("/data/user_storage/apricot_data")
+
+from apx_opentrons.liquid_handling import distribute
+from apx_opentrons.metadata_resolver import load_plate_metadata
+from apx_opentrons.plate_geometry import multichannel_targets
+from apx_opentrons.run_log import close_run_log, instrument
+from apx_opentrons.volume_tracking import VolumeTracker
 
 # metadata
 metadata = {
@@ -167,6 +96,10 @@ def add_parameters(parameters: protocol_api.Parameters):
 # protocol run function
 def run(protocol: protocol_api.ProtocolContext):
 
+    # time every command into a run log on the robot
+    protocol = instrument(protocol, metadata["protocolName"])
+    volumes = VolumeTracker()
+
     protocol.pause(msg='IMPORTANT: Have the first and last row of tips been removed from the p300 tip box? If no, remove them before resuming the protocol.')
 
     # load labware
@@ -187,27 +120,20 @@ def run(protocol: protocol_api.ProtocolContext):
                                     description="RPMI medium to fill wells adjacent to sample wells")
 
     # load some metadata we need later
-    if platform == "win32":
-        # load the drug layout on drug master plate and final 384-well plate
-        cell_plate_metadata = pd.read_csv(r"C:\Users\OT-Operator\Documents\OT-2_protocols\APx_opentrons_resources\OVP\metadata\plate_metadata_v2.0.csv")
-
-    elif platform == "linux":
-        # load the drug layout on drug master plate and final 384-well plate
-        cell_plate_metadata = pd.read_csv("/data/user_storage/apricot_data/OVP/plate_metadata_v2.0.csv")
+    cell_plate_metadata = load_plate_metadata("OVP", "plate_metadata", "2.0")
 
     # process one or two patient samples
     if protocol.params.process_full_plate == False:
-        cell_plate_metadata = cell_plate_metadata.loc[
-            cell_plate_metadata["experimental_unit"] != "patient_2_with_OVCAR3"]
+        cell_plate_metadata = cell_plate_metadata.exclude("experimental_unit", "patient_2_with_OVCAR3")
 
     # load media into reservoir
-    reservoir['A' + str(protocol.params.sample_1_col)].load_liquid(liquid=patient_1, volume=6000)
-    reservoir['A' + str(protocol.params.cell_line_col)].load_liquid(liquid=ovcar3, volume=2000)
-    reservoir['A' + str(protocol.params.rpmi_col)].load_liquid(liquid=rpmi, volume=5000)
+    volumes.load_liquid(reservoir['A' + str(protocol.params.sample_1_col)], patient_1, 6000)
+    volumes.load_liquid(reservoir['A' + str(protocol.params.cell_line_col)], ovcar3, 2000)
+    volumes.load_liquid(reservoir['A' + str(protocol.params.rpmi_col)], rpmi, 5000)
 
     # if second patient sample is provided, include it:
     if protocol.params.process_full_plate:
-        reservoir['A' + str(protocol.params.sample_2_col)].load_liquid(liquid=patient_2, volume=6000)
+        volumes.load_liquid(reservoir['A' + str(protocol.params.sample_2_col)], patient_2, 6000)
 
     # initialize pipette
     pipette = protocol.load_instrument("p300_multi_gen2", 
@@ -224,18 +150,11 @@ def run(protocol: protocol_api.ProtocolContext):
     pipette_20ul.well_bottom_clearance.aspirate = 1
     pipette_20ul.well_bottom_clearance.dispense = 2
 
-    for sample_type in cell_plate_metadata["sample_name"].unique():
+    for sample_type in cell_plate_metadata.values("sample_name"):
 
-        current_metadata = cell_plate_metadata.loc[cell_plate_metadata["sample_name"] == sample_type]
+        current_metadata = cell_plate_metadata.select("sample_name", sample_type)
 
-        dest_wells = []
-
-        start_row_map = {"A": "C", "B": "D"}
-
-        for col in current_metadata.col.unique():
-            for row in ["A", "B"]:
-                if start_row_map[row] + f"{col:02d}" in current_metadata["well"].values:
-                    dest_wells.append(row + str(col))
+        dest_wells = multichannel_targets(current_metadata.wells)
 
         destinations = [cell_plate[well] for well in dest_wells]
 
@@ -258,6 +177,7 @@ def run(protocol: protocol_api.ProtocolContext):
             n_mix=3,
             pipette=pipette,
             protocol=protocol,
+            volumes=volumes,
             residual_dispense_location=reservoir[source_well],
             residual_dispense_height_from_bottom=3.5,
             touch_tip=True,
@@ -298,6 +218,7 @@ def run(protocol: protocol_api.ProtocolContext):
         residual_volume=20,
         pipette=pipette,
         protocol=protocol,
+        volumes=volumes,
         touch_tip=True,
         touch_tip_radius=0.4,
         touch_tip_v_offset=-5,
@@ -308,31 +229,30 @@ def run(protocol: protocol_api.ProtocolContext):
 
     pipette_20ul.pick_up_tip()
 
-    for dest in destinations_rows:
-
-        for i in range(0, 2):
-    
-            pipette_20ul.aspirate(
-                volume=20,
-                location=reservoir[source_well],
-                rate=5.0,
-            )
-
-            pipette_20ul.dispense(
-                volume=20,
-                location=dest,
-                rate=5.0,
-            )
-
-            protocol.delay(seconds=0.25)
+    # pipette rows, 40 ul per well in two full 20 ul aspirations
+    distribute(
+        volume=20,
+        source=reservoir[source_well],
+        dest=[dest for dest in destinations_rows for i in range(0, 2)],
+        aspirate_rate=5.0,
+        dispense_rate=5.0,
+        dispense_delay=0.25,
+        pipette=pipette_20ul,
+        protocol=protocol,
+        volumes=volumes,
+        touch_tip=True,
+        touch_tip_radius=0.4,
+        touch_tip_v_offset=-5,
+        ignore_tips=True
+        )
 
-            pipette_20ul.touch_tip(radius=0.4,
-                                v_offset=-5)
-    
     pipette_20ul.drop_tip()
 
 
     
     
 
+    volumes.report(protocol)
 
+    # close the run log
+    close_run_log(protocol)
@@ -1,7 +1,16 @@
 from opentrons import protocol_api
-import pandas as pd
-from sys import platform
 import re
+import sys
+from sys import platform
+
+# make the shared apx_opentrons package importable, locally and on the OT-2
+if platform == "win32":
+    sys.path.append(r"C:\Users\OT-Operator\Documents\OT-2_protocols\APx_opentrons_resources")
+elif platform == "linux":
+    sys.path.append("/data/user_storage/apricot_data")
+
+from apx_opentrons.metadata_resolver import load_plate_metadata
+from apx_opentrons.run_log import close_run_log, instrument
 
 def atoi(text):
     return int(text) if text.isdigit() else text
@@ -42,6 +51,9 @@ def add_parameters(parameters: protocol_api.Parameters):
 # protocol run function
 def run(protocol: protocol_api.ProtocolContext):
 
+    # time every command into a run log on the robot
+    protocol = instrument(protocol, metadata["protocolName"])
+
     protocol.pause(msg='IMPORTANT: Make sure that 3 ul Durvalumab has been added to well A12 of the drug plate. If not, add it now.')
 
     # load labware
@@ -60,17 +72,12 @@ def run(protocol: protocol_api.ProtocolContext):
                                  description="drugs to be transferred")
 
     # load some metadata we need later
-    if platform == "win32":
-        # load the drug layout on drug master plate
-        drug_plate_metadata = pd.read_csv(r"C:\Users\OT-Operator\Documents\OT-2_protocols\APx_opentrons_resources\OVP\metadata\drug_plate_metadata_v2.0.csv")
-    elif platform == "linux":
-        # load the drug layout on drug master plate
-        drug_plate_metadata = pd.read_csv("/data/user_storage/apricot_data/OVP/drug_plate_metadata_v2.0.csv")
+    drug_plate_metadata = load_plate_metadata("OVP", "drug_plate_metadata", "2.0")
 
 
     # load drugs into 96-well plate
-    for i, well in drug_plate_metadata.iterrows():
-        well = drug_plate[well.row + str(well.col)]
+    for well in drug_plate_metadata.wells:
+        well = drug_plate[well]
         well.load_liquid(liquid=drugs, volume=3)
 
     # load media into reservoir
@@ -86,7 +93,7 @@ def run(protocol: protocol_api.ProtocolContext):
     pipette.well_bottom_clearance.aspirate = 1.5
     pipette.well_bottom_clearance.dispense = 1.5
 
-    dest_wells = ["A" + str(col) for col in drug_plate_metadata.col.unique()]
+    dest_wells = ["A" + str(col) for col in drug_plate_metadata.columns()]
     dest_wells.sort(key=natural_keys)
     destinations = [drug_plate[well] for well in dest_wells]
 
@@ -112,3 +119,6 @@ def run(protocol: protocol_api.ProtocolContext):
                      mix_after=(3, 200),
                      new_tip='always')
 
+    # close the run log
+    close_run_log(protocol)
+
@@ -1,72 +1,18 @@
 from opentrons import protocol_api
-from opentrons.protocol_api import Well
-import pandas as pd
+import sys
 from sys import platform
-from typing import Optional
-import numpy as np
-
-# helper function to distribute with more flexibility
-def distribute(volume: int,
-               source: Well,
-               dest: list[Well],
-               pipette,
-               protocol: protocol_api.ProtocolContext,
-               aspirate_delay: float = 0,
-               dispense_delay: float = 0,
-               residual_volume: int = 0,
-               residual_dispense_height_from_bottom: Optional[int] = None,
-               touch_tip_radius: Optional[float] = None,
-               touch_tip_v_offset: Optional[float] = None,
-               touch_tip: bool = False,
-               residual_dispense_location: Optional[Well] = None,
-               n_mix: Optional[int] = None,
-               aspirate_rate: float = 1.0,
-               dispense_rate: float = 1.0,):
-    
-    # based on the volume, calculate how often can be pipetted
-    n_pipetting_steps = np.floor((20 - residual_volume)/volume) # TO-DO: max volume of pipette
-    
-    # chunk up the destinations
-    chunked_dest = np.array_split(dest, np.ceil(len(dest)/n_pipetting_steps))
-
-    for sub_list in chunked_dest:
-        pipette.pick_up_tip()
-
-        # mix if required
-        if n_mix is not None:
-            pipette.mix(
-                repetitions=n_mix,
-                volume=len(sub_list)*volume + residual_volume, 
-                location=source,
-                rate=aspirate_rate
-                )     
-        # iterate over destination sublists and aspirate
-        pipette.aspirate(
-            volume=len(sub_list)*volume + residual_volume, 
-            location=source,
-            rate=aspirate_rate
-        )
 
-        # short delay
-        protocol.delay(seconds=aspirate_delay)
-        # iterate over each destination and dispense 5 ul
-        for destination in sub_list:
-            pipette.dispense(
-                volume=volume,
-                location=destination,
-                rate=dispense_rate
-            )
-            # short delay
-            protocol.delay(seconds=dispense_delay)
-
-            if touch_tip:
-                pipette.touch_tip(radius=touch_tip_radius,
-                                  v_offset=touch_tip_v_offset)
-
-        if residual_dispense_location is not None:
-            pipette.dispense(location=residual_dispense_location.bottom(z=residual_dispense_height_from_bottom))
-        # drop tip
-        pipette.drop_tip()
+# make the shared apx_opentrons package importable, locally and on the OT-2
+if platform == "win32":
+    sys.path.append(r"C:\Users\OT-Operator\Documents\OT-2_protocols\APx_opentrons_resources")
+elif platform == "linux":
+    sys.path.append("/data/user_storage/apricot_data")
+
+from apx_opentrons.drug_transfer import drug_transfers, plan_premixes, transfer_drugs
+from apx_opentrons.liquid_handling import pipette_limits
+from apx_opentrons.metadata_resolver import load_plate_metadata
+from apx_opentrons.run_log import close_run_log, instrument
+from apx_opentrons.volume_tracking import DEAD_VOLUMES
 
 # metadata
 metadata = {
@@ -93,6 +39,27 @@ def add_parameters(parameters: protocol_api.Parameters):
     default="right"
     )
 
+    parameters.add_bool(
+    variable_name="reuse_tips",
+    display_name="Reuse tips per drug",
+    description="Keep the tip of a drug for drug-free wells, dispensing from the well top. Off: new tip each time.",
+    default=False,
+    )
+
+    parameters.add_bool(
+    variable_name="use_multi_channel",
+    display_name="Use p20 8-channel",
+    description="Turn on if a p20 8-channel is on the other mount (tips in slot 2).",
+    default=False,
+    )
+
+    parameters.add_bool(
+    variable_name="premix_combinations",
+    display_name="Premix combinations",
+    description="Mix both 2000x drugs of a combination in a spare drug plate well, then add 5 ul of the mix.",
+    default=False,
+    )
+
     parameters.add_bool(
     variable_name="process_full_plate",
     display_name="Process two patient samples",
@@ -103,6 +70,9 @@ def add_parameters(parameters: protocol_api.Parameters):
 # protocol run function
 def run(protocol: protocol_api.ProtocolContext):
 
+    # time every command into a run log on the robot
+    protocol = instrument(protocol, metadata["protocolName"])
+
     # load labware
     # TO-DO: change labware to match actual labware used
     tips = protocol.load_labware("opentrons_96_filtertiprack_20ul", 1)
@@ -120,136 +90,83 @@ def run(protocol: protocol_api.ProtocolContext):
                                  description="drugs to be transferred")
 
     # load some metadata we need later
-    if platform == "win32":
-        # load the drug layout on drug master plate and final 384-well plate
-        drug_plate_metadata = pd.read_csv(r"C:\Users\OT-Operator\Documents\OT-2_protocols\APx_opentrons_resources\OVP\metadata\drug_plate_metadata_v2.0.csv")
-        cell_plate_metadata = pd.read_csv(r"C:\Users\OT-Operator\Documents\OT-2_protocols\APx_opentrons_resources\OVP\metadata\plate_metadata_v2.0.csv")
-    elif platform == "linux":
-        # load the drug layout on drug master plate and final 384-well plate
-        drug_plate_metadata = pd.read_csv("/data/user_storage/apricot_data/OVP/drug_plate_metadata_v2.0.csv")
-        cell_plate_metadata = pd.read_csv("/data/user_storage/apricot_data/OVP/plate_metadata_v2.0.csv")
+    drug_plate_metadata = load_plate_metadata("OVP", "drug_plate_metadata", "2.0")
+    cell_plate_metadata = load_plate_metadata("OVP", "plate_metadata", "2.0")
 
     # process one or two patient samples
     if protocol.params.process_full_plate == False:
-        cell_plate_metadata = cell_plate_metadata.loc[
-            (cell_plate_metadata["experimental_unit"] != "patient_2_with_OVCAR3") & 
-            (cell_plate_metadata["experimental_unit"] != "elution_control")]
+        cell_plate_metadata = cell_plate_metadata.exclude("experimental_unit", "patient_2_with_OVCAR3", "elution_control")
     else:
-        cell_plate_metadata = cell_plate_metadata.loc[
-            (cell_plate_metadata["experimental_unit"] != "elution_control")]
+        cell_plate_metadata = cell_plate_metadata.exclude("experimental_unit", "elution_control")
 
     # load drugs into 96-well plate
-    for i, well in drug_plate_metadata.iterrows():
-        well = drug_plate[well.row + str(well.col)]
+    for well in drug_plate_metadata.wells:
+        well = drug_plate[well]
         well.load_liquid(liquid=drugs, volume=1000)
 
-    for i, well in cell_plate_metadata.iterrows():
-        well = cell_plate[well.row + str(well.col)]
+    for well in cell_plate_metadata.wells:
+        well = cell_plate[well]
         well.load_liquid(liquid=sample, volume=45)
 
     # initialize pipette
-    pipette = protocol.load_instrument("p20_single_gen2", "right",
+    pipette = protocol.load_instrument("p20_single_gen2", protocol.params.pipette_position,
                                             tip_racks=[tips])
 
     # set well clearance of pipettes
     pipette.well_bottom_clearance.aspirate = 1.0
     pipette.well_bottom_clearance.dispense = 2.5
 
-    # get unique names of drugs and whether they are combinations
-    drug_list = cell_plate_metadata[["condition", "combination"]]
-    drug_list = drug_list.drop_duplicates()
-
-    single_drugs = drug_list.loc[drug_list.combination == False]
-    combination_drugs = drug_list.loc[drug_list.combination == True]
-
-    # distribute single drugs
-    for i, drug in single_drugs.iterrows():
-        print(f"drug is {drug}")
-        # get source well
-        source = drug_plate_metadata.loc[
-            drug_plate_metadata.condition == drug.condition]
-        source = source.loc[source["sample"].isin(["1000x", "1000x_ab_drugs"])]
-
-        # assemble name of source well (opentrons take A1 instead of A01)
-        source_well = source.row.values[0] + str(source.col.values[0])
-        print(f"source well: {source_well}")
-
-        # collect destination wells
-        dest_wells = cell_plate_metadata.loc[
-            cell_plate_metadata.condition == drug.condition]
-        # put together names for destination wells
-        dest_wells = [well.row + str(well.col) for i, well
-                      in dest_wells.iterrows()]
-        
-        destinations = [cell_plate[well] for well in dest_wells]
-        print(f"Distributing {drug.condition} from well {source_well} "
-              f"to wells {dest_wells} on 384-well cell plate")
-
-        distribute(
-            volume=5,
-            source=drug_plate[source_well],
-            dest=destinations,
-            dispense_delay=0.5,
-            pipette=pipette,
-            residual_volume=5,
-            protocol=protocol,
-        )
-
-
-    # distribute combination drugs
-    for i, drug in combination_drugs.iterrows():
-        # get source wells
-        drug_1 = drug.condition.split(" + ")[0]
-        drug_2 = drug.condition.split(" + ")[1]
-
-        source_1 = drug_plate_metadata.loc[
-            drug_plate_metadata.condition == drug_1]
-        source_1 = source_1.loc[source_1["sample"].isin(["2000x", "2000x_ab_drugs"])]
-
-        source_2 = drug_plate_metadata.loc[
-            drug_plate_metadata.condition == drug_2]
-        source_2 = source_2.loc[source_2["sample"].isin(["2000x", "2000x_ab_drugs"])]
-
-        # assemble name of source well (opentrons take A1 instead of A01)
-        source_well_1 = source_1.row.values[0] + str(
-            source_1.col.values[0])
-        source_well_2 = source_2.row.values[0] + str(
-            source_2.col.values[0])
-
-        # collect destination wells
-        dest_wells = cell_plate_metadata.loc[
-            cell_plate_metadata.condition == drug.condition]
-        # put together names for destination wells
-        dest_wells = [well.row + str(well.col) for i, well
-                      in dest_wells.iterrows()]
-
-        destinations = [cell_plate[well] for well in dest_wells]
-        
-        # iterate over destination sublists and aspirate
-        distribute(
-            volume=2.5,
-            source=drug_plate[source_well_1],
-            dest=destinations,
-            dispense_delay=0.5,
-            pipette=pipette,
-            residual_volume=5,
-            protocol=protocol,
-        )
+    # optional 8-channel on the other mount for wells that line up with
+    # the drug plate columns
+    multi_pipette = None
+    if protocol.params.use_multi_channel:
+        multi_tips = protocol.load_labware("opentrons_96_filtertiprack_20ul", 2)
+        multi_mount = "left" if protocol.params.pipette_position == "right" else "right"
+        multi_pipette = protocol.load_instrument("p20_multi_gen2", multi_mount,
+                                                 tip_racks=[multi_tips])
+        multi_pipette.well_bottom_clearance.aspirate = 1.0
+        multi_pipette.well_bottom_clearance.dispense = 2.5
+
+    # schedule all single drugs and combinations together to save tips,
+    # single drugs come from the 1000x and combinations from the 2000x wells
+    transfers = drug_transfers(
+        cell_plate_metadata,
+        {"drug_plate": drug_plate_metadata},
+        single_volume=5,
+        combination_volume=2.5,
+    )
 
-        distribute(
-            volume=2.5,
-            source=drug_plate[source_well_2],
-            dest=destinations,
-            dispense_delay=0.5,
-            pipette=pipette,
+    # optionally mix the partners of every combination in a spare drug
+    # plate well, the volumes are planned for the transfer below and
+    # checked against the wells (1000 ul of every drug loaded)
+    premixes = []
+    if protocol.params.premix_combinations:
+        premixes, transfers = plan_premixes(
+            transfers,
+            {"drug_plate": drug_plate_metadata},
+            limits=pipette_limits(pipette),
+            volume=5,
             residual_volume=5,
-            protocol=protocol,
+            reuse_tips=protocol.params.reuse_tips,
+            capacity=drug_plate["A1"].max_volume,
+            dead_volume=DEAD_VOLUMES.get(drug_plate.load_name, 0),
+            source_volume=1000,
         )
 
-    
-
-
-
-
-
+    transfer_drugs(
+        transfers,
+        drug_plates={"drug_plate": drug_plate},
+        cell_plate=cell_plate,
+        pipette=pipette,
+        protocol=protocol,
+        reuse_tips=protocol.params.reuse_tips,
+        multi_pipette=multi_pipette,
+        premixes=premixes,
+        residual_volume=5,
+        dispense_delay=0.5,
+        # the layout is randomized, so the order of the wells does not matter
+        optimize_route=True,
+    )
 
+    # close the run log
+    close_run_log(protocol)
@@ -1,89 +1,18 @@
 from opentrons import protocol_api
-from opentrons.protocol_api import Well
-import pandas as pd
+import sys
 from sys import platform
-from typing import Optional
-import numpy as np
-import itertools
-
-# helper function to distribute with more flexibility
-def distribute(volume: int,
-               source: Well,
-               dest: list[Well],
-               pipette,
-               protocol: protocol_api.ProtocolContext,
-               aspirate_delay: float = 0,
-               dispense_delay: float = 0,
-               residual_volume: int = 0,
-               residual_dispense_height_from_bottom: Optional[int] = None,
-               touch_tip_radius: Optional[float] = None,
-               touch_tip_v_offset: Optional[float] = None,
-               touch_tip: bool = False,
-               residual_dispense_location: Optional[Well] = None,
-               n_mix: Optional[int] = None,
-               aspirate_rate: float = 1.0,
-               dispense_rate: float = 1.0,
-               reuse_tips=False,
-               ignore_tips=False,
-               pre_wet_tips=False,):
-    
-    # based on the volume, calculate how often can be pipetted
-    n_pipetting_steps = np.floor((300 - residual_volume)/volume) # TO-DO: max volume of pipette
-    
-    # chunk up the destinations
-    chunked_dest = np.array_split(dest, np.ceil(len(dest)/n_pipetting_steps))
-
-    for i, sub_list in enumerate(chunked_dest):
-        if ignore_tips == False:
-            if reuse_tips == False:
-                pipette.pick_up_tip()
-            if (reuse_tips == True) & (i == 0):
-                pipette.pick_up_tip()
-
-        # pre-wet tip if required:
-        if pre_wet_tips:
-            pipette.aspirate(volume=300,
-                             location=source)
-            pipette.dispense(volume=300,
-                             location=source)
-
-        # mix if required
-        if n_mix is not None:
-            pipette.mix(
-                repetitions=n_mix,
-                volume=len(sub_list)*volume + residual_volume, 
-                location=source,
-                rate=aspirate_rate
-                )     
-        # iterate over destination sublists and aspirate
-        pipette.aspirate(
-            volume=len(sub_list)*volume + residual_volume, 
-            location=source,
-            rate=aspirate_rate
-        )
 
-        # short delay
-        protocol.delay(seconds=aspirate_delay)
-        # iterate over each destination and dispense 5 ul
-        for destination in sub_list:
-            pipette.dispense(
-                volume=volume,
-                location=destination,
-                rate=dispense_rate
-            )
-            # short delay
-            protocol.delay(seconds=dispense_delay)
-
-            if touch_tip:
-                pipette.touch_tip(radius=touch_tip_radius,
-                                  v_offset=touch_tip_v_offset)
-
-        if residual_dispense_location is not None:
-            pipette.dispense(location=residual_dispense_location.bottom(z=residual_dispense_height_from_bottom))
-        # drop tip
-        if ignore_tips == False:
-            if (reuse_tips == False) or (i == (len(chunked_dest) -1)):
-                pipette.drop_tip()
+# make the shared apx_opentrons package importable, locally and on the OT-2
+if platform == "win32":
+    sys.path.append(r"C:\Users\OT-Operator\Documents\OT-2_protocols\APx_opentrons_resources")
+elif platform == "linux":
+    sys.path.append("/data/user_storage/apricot_data")
+
+from apx_opentrons.liquid_handling import distribute
+from apx_opentrons.metadata_resolver import load_plate_metadata
+from apx_opentrons.plate_geometry import multichannel_targets
+from apx_opentrons.run_log import close_run_log, instrument
+from apx_opentrons.volume_tracking import VolumeTracker
 
 # metadata
 metadata = {
@@ -119,6 +48,10 @@ def add_parameters(parameters: protocol_api.Parameters):
 # protocol run function
 def run(protocol: protocol_api.ProtocolContext):
 
+    # time every command into a run log on the robot
+    protocol = instrument(protocol, metadata["protocolName"])
+    volumes = VolumeTracker()
+
     protocol.pause(msg='IMPORTANT: Has the cell plate been aspirated to 40 ul on the washer-dispenser? If no, do so before resuming the protocol.')
 
     # load labware
@@ -134,31 +67,24 @@ def run(protocol: protocol_api.ProtocolContext):
                                  description="fixation solution")
 
     # load some metadata we need later
-    if platform == "win32":
-        # load the drug layout on drug master plate and final 384-well plate
-        cell_plate_metadata = pd.read_csv(r"C:\Users\OT-Operator\Documents\OT-2_protocols\APx_opentrons_resources\OVP\metadata\plate_metadata_v2.0.csv")
-
-    elif platform == "linux":
-        # load the drug layout on drug master plate and final 384-well plate
-        cell_plate_metadata = pd.read_csv("/data/user_storage/apricot_data/OVP/plate_metadata_v2.0.csv")
+    cell_plate_metadata = load_plate_metadata("OVP", "plate_metadata", "2.0")
 
     # process one or two patient samples
     if protocol.params.process_full_plate == False:
-        cell_plate_metadata = cell_plate_metadata.loc[
-            cell_plate_metadata["experimental_unit"] != "patient_2_with_OVCAR3"]
+        cell_plate_metadata = cell_plate_metadata.exclude("experimental_unit", "patient_2_with_OVCAR3")
         
 
-    for i, well in cell_plate_metadata.iterrows():
-        well = cell_plate[well.row + str(well.col)]
-        well.load_liquid(liquid=sample, volume=40)
+    for well in cell_plate_metadata.wells:
+        well = cell_plate[well]
+        volumes.load_liquid(well, sample, 40)
 
     # load media into reservoir
-    reservoir['A1'].load_liquid(liquid=PFA, volume=8000)
+    volumes.load_liquid(reservoir['A1'], PFA, 8000)
 
 
     # fill another column of the reservoir if whole plate is processed
     if protocol.params.process_full_plate:
-        reservoir['A2'].load_liquid(liquid=PFA, volume=8000)
+        volumes.load_liquid(reservoir['A2'], PFA, 8000)
 
 
     # initialize pipette
@@ -169,22 +95,16 @@ def run(protocol: protocol_api.ProtocolContext):
     pipette.well_bottom_clearance.aspirate = 1
     pipette.well_bottom_clearance.dispense = 4
 
-    dest_wells = []
-
-    start_row_map = {"A": "C", "B": "D"}
-
-    for col in cell_plate_metadata.col.unique():
-        for row in ["A", "B"]:
-            if start_row_map[row] + f"{col:02d}" in cell_plate_metadata["well"].values:
-                dest_wells.append(row + str(col))
+    dest_wells = multichannel_targets(cell_plate_metadata.wells)
 
     destinations = [cell_plate[well] for well in dest_wells]
 
-    source_well = "A1"
+    # full plates continue from A2 when A1 runs low
+    source_wells = ["A1", "A2"] if protocol.params.process_full_plate else ["A1"]
 
     distribute(
         volume=40,
-        source=reservoir[source_well],
+        source=[reservoir[well] for well in source_wells],
         dest=destinations,
         aspirate_delay=1.0,
         dispense_delay=1.0,
@@ -192,15 +112,20 @@ def run(protocol: protocol_api.ProtocolContext):
         residual_volume=20,
         pipette=pipette,
         protocol=protocol,
+        volumes=volumes,
         touch_tip=True,
         touch_tip_radius=0.4,
         touch_tip_v_offset=-5,
         reuse_tips=True,
         pre_wet_tips=True,
-        residual_dispense_location=reservoir[source_well],
+        residual_dispense_location=reservoir[source_wells[0]],
         residual_dispense_height_from_bottom=2.5,
+        chunking="min-trips",
         )
         
     
 
+    volumes.report(protocol)
 
+    # close the run log
+    close_run_log(protocol)
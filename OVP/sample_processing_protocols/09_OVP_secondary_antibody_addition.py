@@ -1,74 +1,19 @@
 from opentrons import protocol_api
-import pandas as pd
+import sys
 from sys import platform
-import numpy as np
-from opentrons.protocol_api import Well
-from typing import Optional
-import itertools
-
-# helper function to distribute with more flexibility
-def distribute(volume: int,
-               source: Well,
-               dest: list[Well],
-               pipette,
-               protocol: protocol_api.ProtocolContext,
-               aspirate_delay: float = 0,
-               dispense_delay: float = 0,
-               residual_volume: int = 0,
-               residual_dispense_height_from_bottom: Optional[int] = None,
-               touch_tip_radius: Optional[float] = None,
-               touch_tip_v_offset: Optional[float] = None,
-               touch_tip: bool = False,
-               residual_dispense_location: Optional[Well] = None,
-               n_mix: Optional[int] = None,
-               aspirate_rate: float = 1.0,
-               dispense_rate: float = 1.0,):
-    
-    # based on the volume, calculate how often can be pipetted
-    n_pipetting_steps = np.floor((300 - residual_volume)/volume) # TO-DO: max volume of pipette
-    
-    # chunk up the destinations
-    chunked_dest = np.array_split(dest, np.ceil(len(dest)/n_pipetting_steps))
 
-    for sub_list in chunked_dest:
-        pipette.pick_up_tip()
+# make the shared apx_opentrons package importable, locally and on the OT-2
+if platform == "win32":
+    sys.path.append(r"C:\Users\OT-Operator\Documents\OT-2_protocols\APx_opentrons_resources")
+elif platform == "linux":
+    sys.path.append("/data/user_storage/apricot_data")
+
+from apx_opentrons.liquid_handling import distribute
+from apx_opentrons.metadata_resolver import load_plate_metadata
+from apx_opentrons.plate_geometry import multichannel_targets
+from apx_opentrons.run_log import close_run_log, instrument
+from apx_opentrons.volume_tracking import VolumeTracker
 
-        # mix if required
-        if n_mix is not None:
-            pipette.mix(
-                repetitions=n_mix,
-                volume=len(sub_list)*volume + residual_volume, 
-                location=source,
-                rate=aspirate_rate
-                )     
-        # iterate over destination sublists and aspirate
-        pipette.aspirate(
-            volume=len(sub_list)*volume + residual_volume, 
-            location=source,
-            rate=aspirate_rate
-        )
-
-        # short delay
-        protocol.delay(seconds=aspirate_delay)
-        # iterate over each destination and dispense 5 ul
-        for destination in sub_list:
-            pipette.dispense(
-                volume=volume,
-                location=destination,
-                rate=dispense_rate
-            )
-            # short delay
-            protocol.delay(seconds=dispense_delay)
-
-            if touch_tip:
-                pipette.touch_tip(radius=touch_tip_radius,
-                                  v_offset=touch_tip_v_offset)
-
-        if residual_dispense_location is not None:
-            pipette.dispense(location=residual_dispense_location.bottom(
-                z=residual_dispense_height_from_bottom))
-        # drop tip
-        pipette.drop_tip()
 # metadata
 metadata = {
     "protocolName": "OVP Secondary Antibody Addition",
@@ -137,6 +82,10 @@ def add_parameters(parameters: protocol_api.Parameters):
 # protocol run function
 def run(protocol: protocol_api.ProtocolContext):
 
+    # time every command into a run log on the robot
+    protocol = instrument(protocol, metadata["protocolName"])
+    volumes = VolumeTracker()
+
     protocol.pause(msg='IMPORTANT: Has the cell plate been aspirated to 30 ul on the washer-dispenser? If no, do so before resuming the protocol.')
 
     # load labware
@@ -157,33 +106,25 @@ def run(protocol: protocol_api.ProtocolContext):
                                  description="primary antibodies")
 
     # load some metadata we need later
-    if platform == "win32":
-        # load the drug layout on drug master plate and final 384-well plate
-        cell_plate_metadata_orig = pd.read_csv(r"C:\Users\OT-Operator\Documents\OT-2_protocols\APx_opentrons_resources\OVP\metadata\plate_metadata_v2.0.csv")
-    elif platform == "linux":
-        # load the drug layout on drug master plate and final 384-well plate
-        cell_plate_metadata_orig = pd.read_csv("/data/user_storage/apricot_data/OVP/plate_metadata_v2.0.csv")
-
-        # process one or two patient samples
+    cell_plate_metadata_orig = load_plate_metadata("OVP", "plate_metadata", "2.0")
+
+    # process one or two patient samples
     if protocol.params.process_full_plate == False:
-        cell_plate_metadata = cell_plate_metadata_orig.loc[
-            (cell_plate_metadata_orig["experimental_unit"] != "patient_2_with_OVCAR3") & 
-            (cell_plate_metadata_orig["experimental_unit"] != "elution_control")]
+        cell_plate_metadata = cell_plate_metadata_orig.exclude("experimental_unit", "patient_2_with_OVCAR3", "elution_control")
     else:
-        cell_plate_metadata = cell_plate_metadata_orig.loc[
-            (cell_plate_metadata_orig["experimental_unit"] != "elution_control")]
+        cell_plate_metadata = cell_plate_metadata_orig.exclude("experimental_unit", "elution_control")
 
     # load antibodies into 96-well plate
     for well in antibody_plate.columns()[(protocol.params.antibody_source_column - 1)][1:-1]:
         if protocol.params.process_full_plate == False:
-            well.load_liquid(liquid=antibodies, volume=700)
+            volumes.load_liquid(well, antibodies, 700)
         else:
-            well.load_liquid(liquid=antibodies, volume=1300)
+            volumes.load_liquid(well, antibodies, 1300)
 
     # load samples
-    for i, well in cell_plate_metadata.iterrows():
-        well = cell_plate[well.row + str(well.col)]
-        well.load_liquid(liquid=sample, volume=30)
+    for well in cell_plate_metadata.wells:
+        well = cell_plate[well]
+        volumes.load_liquid(well, sample, 30)
 
     # initialize pipette
     pipette = protocol.load_instrument("p300_multi_gen2",
@@ -199,14 +140,7 @@ def run(protocol: protocol_api.ProtocolContext):
     pipette.well_bottom_clearance.dispense = 3.0
 
     source_well = 'A' + str(protocol.params.antibody_source_column)
-    dest_wells = []
-
-    start_row_map = {"A": "C", "B": "D"}
-
-    for col in cell_plate_metadata.col.unique():
-        for row in ["A", "B"]:
-            if start_row_map[row] + f"{col:02d}" in cell_plate_metadata["well"].values:
-                dest_wells.append(row + str(col))
+    dest_wells = multichannel_targets(cell_plate_metadata.wells)
 
     destinations = [cell_plate[well] for well in dest_wells]
 
@@ -220,6 +154,7 @@ def run(protocol: protocol_api.ProtocolContext):
         residual_volume=20,
         pipette=pipette,
         protocol=protocol,
+        volumes=volumes,
         residual_dispense_location=antibody_plate[source_well],
         residual_dispense_height_from_bottom=1,
         dispense_rate=0.4,
@@ -269,3 +204,8 @@ def run(protocol: protocol_api.ProtocolContext):
 
 
     
+
+    volumes.report(protocol)
+
+    # close the run log
+    close_run_log(protocol)
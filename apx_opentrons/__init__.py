@@ -0,0 +1,5 @@
+"""Shared liquid-handling code for the APx opentrons protocols.
+
+Protocols make this package importable by adding the repository root
+(locally) or /data/user_storage/apricot_data (on the OT-2) to sys.path.
+"""
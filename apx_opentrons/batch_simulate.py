@@ -0,0 +1,178 @@
+"""Simulate every protocol for every combination of its run time parameters.
+
+Bool parameters and parameters with choices are expanded fully, numeric
+parameters with a range are tried at their minimum, default and maximum
+(or only at the default with --numeric-values default). The combinations
+are simulated on a process pool and reported with tip counts and
+estimated durations. Combinations that put two pipettes on the same mount
+or two plates in the same slot (two *position* parameters with the same
+value) cannot run and are skipped, e.g.
+
+    python -m apx_opentrons.batch_simulate --jobs 8 --labware-dir path/to/custom_labware
+"""
+from __future__ import annotations
+
+import argparse
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from .estimate import estimate_commands, format_duration
+from .simulation import ParameterSpec, load_protocol, protocol_parameters, simulate_protocol
+
+REPOSITORY_ROOT = Path(__file__).resolve().parent.parent
+PROTOCOL_GLOBS = ("OVP/sample_processing_protocols/*.py",
+                  "OVP/drug_plate_generation/*.py",
+                  "Frankfurt_Melanoma/sample_processing_protocols/*.py",
+                  "Frankfurt_Melanoma/drug_plate_generation/*.py")
+
+
+@dataclass
+class BatchResult:
+    path: Path
+    params: dict
+    error: Optional[str] = None
+    # why the combination was not simulated
+    skipped: Optional[str] = None
+    n_tips: int = 0
+    seconds: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.skipped is None
+
+
+def find_protocols(root: Path = REPOSITORY_ROOT) -> list[Path]:
+    return [path for pattern in PROTOCOL_GLOBS for path in sorted(root.glob(pattern))]
+
+
+def parameter_values(spec: ParameterSpec, numeric_values: str = "edges") -> list:
+    if spec.choices:
+        return list(spec.choices)
+    if spec.kind == "bool":
+        return [False, True]
+    if spec.kind in ("int", "float") and numeric_values == "edges":
+        values = [spec.minimum, spec.default, spec.maximum]
+        return list(dict.fromkeys(value for value in values if value is not None))
+    return [spec.default]
+
+
+def parameter_space(specs: dict[str, ParameterSpec],
+                    numeric_values: str = "edges") -> list[dict]:
+    """All combinations of the parameter values to simulate."""
+    names = list(specs)
+    values = [parameter_values(specs[name], numeric_values) for name in names]
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def position_conflict(params: dict) -> Optional[str]:
+    """Why a combination cannot run if two of its mount or deck slot
+    parameters, which the protocols name *position*, have the same value."""
+    positions = [name for name in params if "position" in name]
+    for i, name in enumerate(positions):
+        for other in positions[i + 1:]:
+            if params[name] == params[other]:
+                return f"{name} and {other} are both {params[name]}"
+    return None
+
+
+def _simulate(job) -> BatchResult:
+    path, params, labware_dirs = job
+    try:
+        result = simulate_protocol(path, params=params, labware_dirs=labware_dirs)
+    except Exception as error:
+        # errors while loading the protocol or setting up the simulator
+        return BatchResult(path, params, error=f"{type(error).__name__}: {error}")
+    seconds = sum(estimate.total for estimate in estimate_commands(result.commands))
+    return BatchResult(path, params, error=result.error, n_tips=result.n_tips,
+                       seconds=seconds)
+
+
+def simulate_all(protocols: list[Path],
+                 numeric_values: str = "edges",
+                 labware_dirs=None,
+                 jobs: Optional[int] = None) -> list[BatchResult]:
+    results = []
+    work = []
+    for path in protocols:
+        try:
+            specs = protocol_parameters(load_protocol(path))
+        except Exception as error:
+            results.append(BatchResult(path, {}, error=f"{type(error).__name__}: {error}"))
+            continue
+        for params in parameter_space(specs, numeric_values):
+            conflict = position_conflict(params)
+            if conflict:
+                results.append(BatchResult(path, params, skipped=conflict))
+            else:
+                work.append((path, params, labware_dirs))
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        results.extend(executor.map(_simulate, work, chunksize=4))
+    return results
+
+
+def format_summary(results: list[BatchResult], verbose: bool = False) -> str:
+    lines = [f"{'protocol':<62}{'runs':>6}{'skipped':>9}{'failed':>8}{'tips':>11}"
+             f"{'duration':>20}"]
+    by_protocol: dict[Path, list[BatchResult]] = {}
+    for result in results:
+        by_protocol.setdefault(result.path, []).append(result)
+
+    for path, protocol_results in by_protocol.items():
+        passed = [result for result in protocol_results if result.ok]
+        skipped = [result for result in protocol_results if result.skipped]
+        failed = [result for result in protocol_results if result.error]
+        name = str(path.relative_to(REPOSITORY_ROOT)
+                   if path.is_relative_to(REPOSITORY_ROOT) else path)
+        if passed:
+            tips = f"{min(r.n_tips for r in passed)}-{max(r.n_tips for r in passed)}"
+            duration = (f"{format_duration(min(r.seconds for r in passed))}-"
+                        f"{format_duration(max(r.seconds for r in passed))}")
+        else:
+            tips = duration = "-"
+        lines.append(f"{name:<62}{len(protocol_results):>6}{len(skipped):>9}{len(failed):>8}"
+                     f"{tips:>11}{duration:>20}")
+
+        for result in protocol_results:
+            if result.error or verbose:
+                params = ", ".join(f"{key}={value}" for key, value in result.params.items())
+                if result.error:
+                    status = f"FAILED: {result.error}"
+                elif result.skipped:
+                    status = f"skipped, {result.skipped}"
+                else:
+                    status = f"ok, {result.n_tips} tips, {format_duration(result.seconds)}"
+                lines.append(f"    ({params}) {status}")
+
+    n_skipped = sum(1 for result in results if result.skipped)
+    n_failed = sum(1 for result in results if result.error)
+    lines.append(f"\n{len(results) - n_skipped} simulations, {n_failed} failed, "
+                 f"{n_skipped} combinations skipped")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("protocols", nargs="*", type=Path,
+                        help="protocol files (default: all OVP and Frankfurt_Melanoma protocols)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--numeric-values", choices=["edges", "default"], default="edges")
+    parser.add_argument("--labware-dir", action="append", default=[], type=Path,
+                        help="directory with custom labware definitions (*.json)")
+    parser.add_argument("--verbose", action="store_true",
+                        help="list every combination, not only failures")
+    args = parser.parse_args(argv)
+
+    protocols = [path.resolve() for path in args.protocols] or find_protocols()
+    results = simulate_all(protocols, numeric_values=args.numeric_values,
+                           labware_dirs=args.labware_dir, jobs=args.jobs)
+    print(format_summary(results, verbose=args.verbose))
+    return 0 if not any(result.error for result in results) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,265 @@
+"""Plan drug plate campaigns: any number of replicate drug plates from one
+master plate, over as many deck loads as needed.
+
+The master plate stays on the deck and the replicate plates are loaded in
+batches (loads) into the plate slots. Every column of the master plate
+is handed out to the same column of all plates of a load with one tip,
+in as few aspirations as the tip holds (see max_dispenses_per_aspiration).
+The plates are split into loads so that, first, there are as few loads
+as the slots allow and, second, the aspirations are as full as possible:
+with 20 ul tips, 3 ul per plate and 2 ul residual, one aspiration serves
+6 plates, so 12 plates on 9 slots are loaded as 6 + 6 (2 aspirations per
+column) instead of 9 + 3 (3 aspirations). The protocol pauses between
+loads for the plates to be swapped.
+
+The volume left in the tip after the last dispense is the 2 ul the
+protocol keeps (RESIDUAL_VOLUME, not measured) and the volume that stays
+in the master plate wells comes from volume_tracking.DEAD_VOLUMES.
+summarize_campaign adds up the drug lost to both and the estimated run
+time, e.g. to compare the master plate layouts:
+
+    python -m apx_opentrons.drug_plate_campaign --plates 12 --plates-per-load 9
+"""
+from __future__ import annotations
+
+import argparse
+from dataclasses import dataclass, field
+from functools import lru_cache
+from math import ceil
+from typing import Optional
+
+from .liquid_handling import (Plan, PipetteLimits, chunk_destinations,
+                              max_dispenses_per_aspiration)
+from .metadata_resolver import load_manifest, load_plate_metadata
+from .plate_metadata import PlateMetadata
+from .protocol_designer import PIPETTES
+from .timing import TimingModel
+from .volume_tracking import DEAD_VOLUMES
+
+# deck slots for replicate plates, the master plate is in 8, tips in 7
+PLATE_SLOTS = (1, 2, 3, 4, 5, 6, 9, 10, 11)
+
+MASTER_PLATE = "greinermasterblock_96_wellplate_2000ul"
+PIPETTE = "p20_multi_gen2"
+# ul per drug plate well, and kept in the tip after the last dispense
+DRUG_VOLUME = 3.0
+RESIDUAL_VOLUME = 2.0
+# antibody drugs pipetted by hand, by drug plate layout version
+MANUAL_COLUMNS = {"2.0": (6, 12)}
+
+
+@dataclass
+class Load:
+    """Plates on the deck at the same time, numbered through the campaign
+    from 1, and the plate slots they go into."""
+    number: int
+    plates: list = field(default_factory=list)
+    slots: list = field(default_factory=list)
+
+    @property
+    def label(self) -> str:
+        """e.g. "plates 7-12" """
+        if len(self.plates) == 1:
+            return f"plate {self.plates[0]}"
+        return f"plates {self.plates[0]}-{self.plates[-1]}"
+
+    def aspirations(self, volume: float, limits: PipetteLimits,
+                    residual_volume: float = 0) -> list[list[int]]:
+        """Slots served by every aspiration of one master plate column."""
+        return chunk_destinations(self.slots, volume, limits, residual_volume)
+
+
+def split_plates(n_plates: int, plates_per_load: int, per_aspiration: int) -> list[int]:
+    """Number of plates per load, fewest loads first, then fewest
+    aspirations per column."""
+    @lru_cache(maxsize=None)
+    def best(n: int) -> tuple:
+        # (loads, aspirations, sizes) for n plates
+        if n == 0:
+            return 0, 0, ()
+        options = []
+        for size in range(min(n, plates_per_load), 0, -1):
+            loads, aspirations, sizes = best(n - size)
+            options.append((loads + 1, aspirations + ceil(size / per_aspiration),
+                            (size,) + sizes))
+        return min(options, key=lambda option: option[:2])
+
+    return list(best(n_plates)[2])
+
+
+def plan_campaign(n_plates: int,
+                  plates_per_load: int,
+                  volume: float,
+                  limits: PipetteLimits,
+                  residual_volume: float = 0,
+                  slots: tuple = PLATE_SLOTS) -> list[Load]:
+    if not 1 <= plates_per_load <= len(slots):
+        raise ValueError(f"{plates_per_load} plates per load, the deck has "
+                         f"{len(slots)} plate slots")
+    per_aspiration = max_dispenses_per_aspiration(volume, limits, residual_volume)
+    loads = []
+    first = 1
+    for number, size in enumerate(split_plates(n_plates, plates_per_load, per_aspiration),
+                                  start=1):
+        loads.append(Load(number, list(range(first, first + size)), list(slots[:size])))
+        first += size
+    return loads
+
+
+def plan_column(volume: float,
+                source,
+                dest: list[list],
+                limits: PipetteLimits,
+                residual_volume: float = 0,
+                rate: float = 0.5,
+                delay: float = 1.0,
+                touch_tip_radius: Optional[float] = None,
+                touch_tip_v_offset: Optional[float] = None,
+                pre_wet_volume: Optional[float] = None) -> Plan:
+    """Hand out one master plate column with one tip.
+
+    dest are the wells served by each aspiration. The tip is pre-wetted
+    with the volume of the first aspiration (or pre_wet_volume), touched
+    off after every aspiration and dispense, and the residual stays in the
+    tip until it is dropped, so later aspirations only top up the
+    dispensed volume.
+    """
+    if pre_wet_volume is None:
+        pre_wet_volume = len(dest[0]) * volume + residual_volume if dest else 0
+    plan = Plan(max_volume=limits.max_volume, min_volume=limits.min_volume)
+    plan.add("pick_up_tip")
+    if pre_wet_volume > 0:
+        plan.add("aspirate", volume=pre_wet_volume, location=source, rate=rate, pre_wet=True)
+        plan.add("dispense", volume=pre_wet_volume, location=source, rate=rate, pre_wet=True)
+    for i, wells in enumerate(dest):
+        aspirate_volume = len(wells) * volume + (residual_volume if i == 0 else 0)
+        plan.add("aspirate", volume=aspirate_volume, location=source, rate=rate)
+        plan.add("delay", seconds=delay)
+        plan.add("touch_tip", radius=touch_tip_radius, v_offset=touch_tip_v_offset)
+        for well in wells:
+            plan.add("dispense", volume=volume, location=well, rate=rate)
+            plan.add("delay", seconds=delay)
+            plan.add("touch_tip", radius=touch_tip_radius, v_offset=touch_tip_v_offset)
+    # the residual is dropped with the tip, blowing it out into the master
+    # plate left air bubbles that made the next column aspirate too little
+    plan.add("drop_tip")
+    return plan.validate()
+
+
+def format_campaign(loads: list[Load], volume: float, limits: PipetteLimits,
+                    residual_volume: float = 0) -> list[str]:
+    lines = []
+    for load in loads:
+        chunks = load.aspirations(volume, limits, residual_volume)
+        lines.append(f"Load {load.number}: {load.label} "
+                     f"in slots {', '.join(str(slot) for slot in load.slots)}, "
+                     f"{len(chunks)} aspiration(s) per column")
+    return lines
+
+
+@dataclass
+class CampaignSummary:
+    """Drug use of a campaign, per master plate well (ul) unless noted."""
+    version: str
+    n_plates: int
+    loads: int
+    columns: int
+    wells: int
+    dispensed: float
+    # dropped with the tips, once per load
+    residual: float
+    # left in the master plate
+    dead_volume: float
+    aspirations: int
+    tips: int
+    seconds: float
+
+    @property
+    def required(self) -> float:
+        """Volume to fill into every drug well of the master plate."""
+        return self.dispensed + self.residual + self.dead_volume
+
+    @property
+    def lost(self) -> float:
+        return self.residual + self.dead_volume
+
+    @property
+    def lost_fraction(self) -> float:
+        return self.lost / self.required if self.required else 0.0
+
+
+def summarize_campaign(layout: PlateMetadata,
+                       n_plates: int,
+                       plates_per_load: int,
+                       limits: PipetteLimits,
+                       volume: float = DRUG_VOLUME,
+                       residual_volume: float = 0,
+                       dead_volume: float = 0,
+                       timing: Optional[TimingModel] = None,
+                       version: str = "") -> CampaignSummary:
+    """Drug use and run time of a campaign for the drug wells of layout,
+    one 8-channel tip column per master plate column and load."""
+    timing = timing or TimingModel()
+    loads = plan_campaign(n_plates, plates_per_load, volume, limits, residual_volume)
+    columns = layout.columns()
+    aspirations = 0
+    seconds = 0.0
+    for load in loads:
+        chunks = load.aspirations(volume, limits, residual_volume)
+        aspirations += len(chunks) * len(columns)
+        # placeholder locations, every well counts as one move
+        plan = plan_column(volume, "master", [[f"plate {slot}" for slot in slots]
+                                              for slots in chunks],
+                           limits, residual_volume)
+        seconds += len(columns) * timing.plan_seconds(plan.steps)
+    return CampaignSummary(version=version, n_plates=n_plates, loads=len(loads),
+                           columns=len(columns), wells=len(layout),
+                           dispensed=n_plates * volume,
+                           residual=len(loads) * residual_volume,
+                           dead_volume=dead_volume, aspirations=aspirations,
+                           tips=len(loads) * len(columns), seconds=seconds)
+
+
+def format_summary(summary: CampaignSummary) -> list[str]:
+    return [f"{summary.n_plates} plates in {summary.loads} load(s), "
+            f"{summary.columns} columns, {summary.aspirations} aspirations, "
+            f"{summary.tips} tip columns, about {summary.seconds / 60:.0f} min",
+            f"per master plate well: fill {summary.required:g} ul, {summary.dispensed:g} ul "
+            f"dispensed, {summary.residual:g} ul dropped with the tips, "
+            f"{summary.dead_volume:g} ul left in the well "
+            f"({100 * summary.lost_fraction:.0f}% lost)",
+            f"drug lost on the master plate ({summary.wells} wells): "
+            f"{summary.wells * summary.lost:g} ul"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Drug loss and run time of drug plate "
+                                                 "campaigns for the master plate layouts")
+    parser.add_argument("--plates", type=int, default=6, help="number of drug plates")
+    parser.add_argument("--plates-per-load", type=int, default=6,
+                        help=f"drug plates on the deck at once (at most {len(PLATE_SLOTS)})")
+    parser.add_argument("--versions", nargs="*",
+                        help="drug plate layout versions (default: all)")
+    args = parser.parse_args(argv)
+
+    min_volume, max_volume, flow_rate = PIPETTES[PIPETTE]
+    limits = PipetteLimits(max_volume=max_volume, min_volume=min_volume)
+    timing = TimingModel(aspirate_flow_rate=flow_rate, dispense_flow_rate=flow_rate,
+                         blow_out_flow_rate=flow_rate)
+    versions = args.versions or sorted(load_manifest()["OVP"]["drug_plate_metadata"])
+    for version in versions:
+        layout = load_plate_metadata("OVP", "drug_plate_metadata", version)
+        if version in MANUAL_COLUMNS:
+            layout = layout.exclude("col", *MANUAL_COLUMNS[version])
+        summary = summarize_campaign(layout, args.plates, args.plates_per_load, limits,
+                                     residual_volume=RESIDUAL_VOLUME,
+                                     dead_volume=DEAD_VOLUMES[MASTER_PLATE],
+                                     timing=timing, version=version)
+        print(f"drug plate layout v{version}:")
+        for line in format_summary(summary):
+            print(f"    {line}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,518 @@
+"""Schedule the drug transfer from 96-well drug plates to a 384-well cell plate.
+
+Every cell plate well gets its drugs as a list of Transfers: single drugs
+come from the 1000x well of the drug, combinations get half the volume of
+each partner from its 2000x well. The scheduler groups all transfers that
+aspirate from the same source well into one distribution, across single
+and combination conditions, so a drug used in several combinations is
+dispensed with as few tips as possible.
+
+A tip only ever holds one drug, and destinations are pooled into one tip
+only while they hold the same drugs. By default every aspiration takes a
+new tip. With reuse_tips, a tip goes back to its source only after
+dispensing into wells without another drug, and those dispenses are made
+from the top of the well with a touch tip, so the tip does not reach the
+cell medium that is already in every well.
+
+Optionally, combinations are premixed (plan_premixes): the 2000x wells
+of the partners are combined in a spare well of the drug plate and the
+mix is distributed like a single drug, so a combination well takes one
+transfer instead of two.
+"""
+from __future__ import annotations
+
+from collections import Counter
+from dataclasses import dataclass, field
+from math import ceil
+from typing import NamedTuple, Optional
+
+from .liquid_handling import (Plan, PipetteLimits, distribute, max_dispenses_per_aspiration,
+                              pipette_limits, plan_distribute)
+from .plate_geometry import HEAD_WELLS_96, ROWS_384, head_wells
+from .plate_metadata import PlateMetadata
+
+# sample column of the drug plate metadata, the antibody drugs have their own tier
+SINGLE_TIERS = ("1000x", "1000x_ab_drugs")
+COMBINATION_TIERS = ("2000x", "2000x_ab_drugs")
+
+
+class Transfer(NamedTuple):
+    """One drug going into one cell plate well.
+
+    source is the (drug plate, well name) to aspirate from, prior are the
+    drugs already in the destination when this transfer is dispensed.
+    """
+    drug: str
+    condition: str
+    source: tuple
+    dest: str
+    volume: float
+    prior: tuple = ()
+
+
+@dataclass
+class TransferGroup:
+    """Transfers from one source well that can share tips."""
+    drug: str
+    source: tuple
+    volume: float
+    prior: tuple = ()
+    dest: list = field(default_factory=list)
+    conditions: list = field(default_factory=list)
+
+    @property
+    def reuse_tip(self) -> bool:
+        # no other drug is in the destinations, so a tip dispensing from
+        # above the medium can go back to the source
+        return not self.prior
+
+    def n_tips(self, limits: PipetteLimits, residual_volume: float = 0) -> int:
+        if self.reuse_tip:
+            return 1
+        per_tip = max_dispenses_per_aspiration(self.volume, limits, residual_volume)
+        return ceil(len(self.dest) / per_tip)
+
+
+def combination_partners(condition: str) -> list[str]:
+    """Drugs of a combination condition, e.g. "Carboplatin + Paclitaxel"."""
+    return [drug.strip() for drug in condition.split(" + ")]
+
+
+def well_position(name: str) -> tuple[int, int]:
+    """(row, column) of a well name like "B12", counting from 0."""
+    return ord(name[0].upper()) - ord("A"), int(name[1:]) - 1
+
+
+def _serpentine_key(name: str) -> tuple[int, int]:
+    # rows alternate left-to-right and right-to-left to shorten the moves
+    row, col = well_position(name)
+    return row, -col if row % 2 else col
+
+
+def drug_transfers(cell_plate_metadata: PlateMetadata,
+                   drug_plate_metadata: dict,
+                   panel_column: Optional[str] = None,
+                   single_volume: float = 5,
+                   combination_volume: float = 2.5) -> list[Transfer]:
+    """Transfers for every well of the cell plate metadata.
+
+    drug_plate_metadata maps drug plate keys to the PlateMetadata of each
+    drug plate. With panel_column, each cell plate well takes its drugs
+    from the plate named in that column, otherwise from the only plate.
+    Single drugs come from the 1000x well, combination partners from the
+    2000x well of the drug.
+
+    Partners of a combination are added in order of how many combination
+    conditions share them, so shared drugs go into drug-free wells where
+    they can be pooled across conditions.
+    """
+    plates = list(drug_plate_metadata)
+    wells = []
+    for condition in cell_plate_metadata.values("condition"):
+        for dest in cell_plate_metadata.condition_wells(condition):
+            record = cell_plate_metadata[dest]
+            plate = record[panel_column] if panel_column else plates[0]
+            wells.append((dest, condition, bool(record["combination"]), plate))
+
+    n_combinations = Counter(drug
+                             for plate, condition in {(plate, condition)
+                                                      for _, condition, combination, plate
+                                                      in wells if combination}
+                             for drug in combination_partners(condition))
+
+    transfers = []
+    for dest, condition, combination, plate in wells:
+        if combination:
+            drugs = sorted(combination_partners(condition),
+                           key=lambda drug: -n_combinations[drug])
+            volume = combination_volume
+            tiers = COMBINATION_TIERS
+        else:
+            drugs = [condition]
+            volume = single_volume
+            tiers = SINGLE_TIERS
+
+        for i, drug in enumerate(drugs):
+            source_well = drug_plate_metadata[plate].source_well(drug, tiers)
+            if source_well is None:
+                raise ValueError(f"no {tiers[0]} well for {drug} on drug plate {plate}")
+            transfers.append(Transfer(drug=drug,
+                                      condition=condition,
+                                      source=(plate, source_well),
+                                      dest=dest,
+                                      volume=volume,
+                                      prior=tuple(drugs[:i])))
+    return transfers
+
+
+def schedule_drug_transfers(transfers: list[Transfer],
+                            pool_conditions: bool = True) -> list[TransferGroup]:
+    """Group transfers into distributions and order them.
+
+    Transfers are grouped by source well, volume and the drugs already in
+    the destination (and by condition if pool_conditions is False, which
+    is one distribution per condition and drug as before). Groups adding
+    the first drug of a well run before the ones adding the second, then
+    in drug plate order; destinations are visited row by row in a
+    serpentine.
+    """
+    groups: dict[tuple, TransferGroup] = {}
+    for transfer in transfers:
+        key = (transfer.source, transfer.volume, transfer.prior)
+        if not pool_conditions:
+            key += (transfer.condition,)
+        if key not in groups:
+            groups[key] = TransferGroup(drug=transfer.drug,
+                                        source=transfer.source,
+                                        volume=transfer.volume,
+                                        prior=transfer.prior)
+        group = groups[key]
+        group.dest.append(transfer.dest)
+        if transfer.condition not in group.conditions:
+            group.conditions.append(transfer.condition)
+
+    for group in groups.values():
+        group.dest.sort(key=_serpentine_key)
+    return sorted(groups.values(),
+                  key=lambda group: (len(group.prior), str(group.source[0]),
+                                     well_position(group.source[1])))
+
+
+def count_tips(groups: list[TransferGroup],
+               limits: PipetteLimits,
+               residual_volume: float = 0,
+               reuse_tips: bool = False) -> int:
+    if not reuse_tips:
+        return sum(ceil(len(group.dest) / max_dispenses_per_aspiration(
+            group.volume, limits, residual_volume)) for group in groups)
+    return sum(group.n_tips(limits, residual_volume) for group in groups)
+
+
+@dataclass
+class Premix:
+    """A combination mixed in a spare drug plate well.
+
+    Each partner adds partner_volume from its source well (partners are
+    (drug, source well) on plate), volume is the mix prepared for
+    distributing dispense_volume into every well of dest.
+    """
+    condition: str
+    plate: str
+    well: str
+    volume: float
+    dispense_volume: float
+    partners: list = field(default_factory=list)
+    dest: list = field(default_factory=list)
+
+    @property
+    def partner_volume(self) -> float:
+        return self.volume / len(self.partners)
+
+
+def spare_wells(drug_plate_metadata: PlateMetadata) -> list[str]:
+    """Wells of a 96-well drug plate without a drug, column by column."""
+    used = set(drug_plate_metadata.wells)
+    return [well for column in HEAD_WELLS_96.values() for well in column
+            if well not in used]
+
+
+def plan_premix_partner(volume: float,
+                        source,
+                        dest,
+                        limits: PipetteLimits,
+                        residual_volume: float = 0,
+                        **kwargs) -> Plan:
+    """Add volume of a partner to the premix well with one tip.
+
+    The volume is split into equal dispenses the tip holds, dispensed at
+    dest (the top of the premix well), so the tip never touches the mix and
+    can go back to the source.
+    """
+    n_dispenses = ceil(volume / (limits.max_volume - residual_volume))
+    return plan_distribute(volume / n_dispenses, source, [dest] * n_dispenses, limits,
+                           residual_volume=residual_volume, reuse_tips=True,
+                           chunking="min-trips", **kwargs)
+
+
+def plan_premixes(transfers: list[Transfer],
+                  drug_plate_metadata: dict,
+                  limits: PipetteLimits,
+                  volume: float = 5,
+                  residual_volume: float = 0,
+                  reuse_tips: bool = False,
+                  capacity: float = 2000,
+                  dead_volume: float = 0,
+                  source_volume: Optional[float] = None) -> tuple[list[Premix], list[Transfer]]:
+    """Premix the combinations of transfers in spare drug plate wells.
+
+    Every combination condition gets a spare well of its drug plate (see
+    spare_wells) holding what distributing volume into its wells takes
+    with residual_volume (planned like transfer_drugs does) plus the
+    dead_volume of the well, half from each partner. Returns the premixes
+    and the transfers with every combination replaced by one transfer of
+    volume from its premix well.
+
+    Raises a ValueError if a mix does not fit into capacity, a plate has
+    no spare wells left or, with the source_volume loaded into every drug
+    well, a source well cannot give the partner volumes and keep its dead
+    volume.
+    """
+    combinations: dict[tuple, list[Transfer]] = {}
+    singles = []
+    for transfer in transfers:
+        if transfer.drug == transfer.condition:
+            singles.append(transfer)
+        else:
+            combinations.setdefault((transfer.source[0], transfer.condition),
+                                    []).append(transfer)
+
+    spare = {plate: spare_wells(metadata) for plate, metadata in drug_plate_metadata.items()}
+    premixes = []
+    premixed = []
+    drawn = Counter()
+    for (plate, condition), condition_transfers in combinations.items():
+        dest = sorted({transfer.dest for transfer in condition_transfers}, key=_serpentine_key)
+        partners = []
+        for transfer in sorted(condition_transfers, key=lambda transfer: len(transfer.prior)):
+            if (transfer.drug, transfer.source[1]) not in partners:
+                partners.append((transfer.drug, transfer.source[1]))
+        if not spare[plate]:
+            raise ValueError(f"no spare well left on drug plate {plate} to premix {condition}")
+        well = spare[plate].pop(0)
+
+        distribution = plan_distribute(volume, [well], dest, limits,
+                                       residual_volume=residual_volume, reuse_tips=reuse_tips,
+                                       chunking="min-trips" if reuse_tips else "balanced")
+        mix_volume = dead_volume + sum(step.volume for step in distribution.steps
+                                       if step.action == "aspirate")
+        if mix_volume > capacity:
+            raise ValueError(f"{mix_volume:g} ul premix of {condition} for {len(dest)} wells "
+                             f"exceeds the well capacity of {capacity:g} ul")
+        premix = Premix(condition=condition, plate=plate, well=well, volume=mix_volume,
+                        dispense_volume=volume, partners=partners, dest=dest)
+        premixes.append(premix)
+
+        for drug, source_well in partners:
+            plan = plan_premix_partner(premix.partner_volume, source_well, well, limits,
+                                       residual_volume)
+            drawn[(plate, source_well)] += sum(step.volume for step in plan.steps
+                                               if step.action == "aspirate")
+        premixed += [Transfer(drug=condition, condition=condition, source=(plate, well),
+                              dest=dest_well, volume=volume) for dest_well in dest]
+
+    if source_volume is not None:
+        for (plate, source_well), draw in drawn.items():
+            if draw + dead_volume > source_volume:
+                raise ValueError(f"premixes take {draw:g} ul from well {source_well} of drug "
+                                 f"plate {plate}, which holds {source_volume:g} ul with "
+                                 f"{dead_volume:g} ul dead volume")
+    return premixes, singles + premixed
+
+
+def format_premix(premix: Premix) -> str:
+    return (f"Premixing {premix.condition}: {premix.partner_volume:g} ul from each of wells "
+            f"{', '.join(source_well for _, source_well in premix.partners)} into well "
+            f"{premix.well} for {len(premix.dest)} wells of {premix.dispense_volume:g} ul")
+
+
+def premix_combinations(premixes: list[Premix],
+                        drug_plates: dict,
+                        pipette,
+                        protocol,
+                        limits: Optional[PipetteLimits] = None,
+                        residual_volume: float = 0,
+                        **kwargs) -> None:
+    """Add the partners of every premix to its well, each with its own tip
+    and dispensed at the top of the well. kwargs go to plan_distribute."""
+    if limits is None:
+        limits = pipette_limits(pipette)
+    kwargs.setdefault("touch_tip", True)
+    for premix in premixes:
+        protocol.comment(format_premix(premix))
+        plate = drug_plates[premix.plate]
+        for drug, source_well in premix.partners:
+            plan_premix_partner(premix.partner_volume, plate[source_well],
+                                plate[premix.well].top(), limits, residual_volume,
+                                **kwargs).execute(pipette, protocol)
+
+
+@dataclass
+class MultiChannelMove:
+    """Transfers done by an 8-channel pipette from one drug plate column.
+
+    Channel k aspirates from row k of source_column and dispenses into
+    every other row of the cell plate starting at start_row, once for each
+    of the columns.
+    """
+    plate: str
+    source_column: int
+    start_row: str
+    volume: float
+    columns: list = field(default_factory=list)
+    transfers: list = field(default_factory=list)
+
+    @property
+    def source(self) -> str:
+        return f"A{self.source_column}"
+
+    @property
+    def dest(self) -> list[str]:
+        return [f"{self.start_row}{column}" for column in self.columns]
+
+
+def _channel_wells(source_column: int, start_row: str, column: int,
+                   n_channels: int):
+    return zip(head_wells(f"A{source_column}", plate_size=96)[:n_channels],
+               head_wells(f"{start_row}{column}")[:n_channels])
+
+
+def plan_multi_channel(transfers: list[Transfer],
+                       n_channels: int = 8,
+                       n_source_columns: int = 12,
+                       n_columns: int = 24) -> tuple[list[MultiChannelMove], list[Transfer]]:
+    """Find transfers an 8-channel pipette can do together.
+
+    A dispense of the multi-channel pipette into a cell plate column is
+    only used if every channel aspirates a drug that the well it dispenses
+    into needs, so no channel takes up a drug that is not transferred or
+    dispenses into a well outside the plan. Only transfers into drug-free
+    wells are considered, so combinations keep their order. Moves are
+    picked greedily by the number of transfers they cover.
+
+    Returns the moves and the transfers left for the single-channel
+    pipette.
+    """
+    pending = {(transfer.source, transfer.dest): transfer
+               for transfer in transfers if not transfer.prior}
+    plates = sorted({transfer.source[0] for transfer in pending.values()}, key=str)
+    volumes = sorted({transfer.volume for transfer in pending.values()})
+
+    moves = []
+    while True:
+        best = None
+        for plate, source_column, start_row, volume in (
+                (plate, source_column, start_row, volume)
+                for plate in plates
+                for source_column in range(1, n_source_columns + 1)
+                for start_row in ROWS_384[:2]
+                for volume in volumes):
+            move = MultiChannelMove(plate, source_column, start_row, volume)
+            for column in range(1, n_columns + 1):
+                active = [pending.get(((plate, source_well), dest))
+                          for source_well, dest in _channel_wells(source_column, start_row,
+                                                                  column, n_channels)]
+                if all(transfer is not None and transfer.volume == volume
+                       for transfer in active):
+                    move.columns.append(column)
+                    move.transfers.extend(active)
+            if move.transfers and (best is None
+                                   or len(move.transfers) > len(best.transfers)):
+                best = move
+
+        if best is None:
+            break
+        moves.append(best)
+        for transfer in best.transfers:
+            del pending[(transfer.source, transfer.dest)]
+
+    done = {id(transfer) for move in moves for transfer in move.transfers}
+    return moves, [transfer for transfer in transfers if id(transfer) not in done]
+
+
+def _dispense_locations(cell_plate, wells: list[str], above_liquid: bool) -> list:
+    # a tip that goes back to the drug stock must stay out of the medium
+    if above_liquid:
+        return [cell_plate[well].top() for well in wells]
+    return [cell_plate[well] for well in wells]
+
+
+def transfer_drugs(transfers: list[Transfer],
+                   drug_plates: dict,
+                   cell_plate,
+                   pipette,
+                   protocol,
+                   reuse_tips: bool = False,
+                   residual_volume: float = 0,
+                   limits: Optional[PipetteLimits] = None,
+                   multi_pipette=None,
+                   premixes=(),
+                   n_mix: int = 5,
+                   **kwargs) -> list[TransferGroup]:
+    """Schedule the transfers and execute the groups with distribute.
+
+    drug_plates maps the drug plate keys used in the sources to loaded
+    labware. By default every aspiration takes a new tip. With
+    reuse_tips, groups going into drug-free wells keep their tip for all
+    aspirations and dispense at the top of the wells followed by a touch
+    tip, so the tip never touches the medium before it goes back to the
+    source. The tips needed are compared to one distribution per
+    condition and drug in a run comment.
+
+    With a multi_pipette, transfers that line up with a whole drug plate
+    column are done 8 at a time first (see plan_multi_channel) and the
+    single-channel pipette does the rest.
+
+    premixes (see plan_premixes) are prepared with the single-channel
+    pipette before any transfer and distributed by it as well, mixing
+    n_mix times before every aspiration. kwargs go to distribute, e.g.
+    optimize_route.
+    """
+    if limits is None:
+        limits = pipette_limits(pipette)
+    touch_tip = kwargs.pop("touch_tip", False)
+    premix_wells = {(premix.plate, premix.well) for premix in premixes}
+    if premixes:
+        premix_combinations(premixes, drug_plates, pipette, protocol, limits,
+                            residual_volume, **kwargs)
+
+    if multi_pipette is not None:
+        premixed = [transfer for transfer in transfers if transfer.source in premix_wells]
+        moves, transfers = plan_multi_channel([transfer for transfer in transfers
+                                               if transfer.source not in premix_wells])
+        transfers += premixed
+        protocol.comment(f"Multi-channel: {len(moves)} distributions with "
+                         f"{sum(len(move.columns) for move in moves)} dispenses cover "
+                         f"{sum(len(move.transfers) for move in moves)} transfers, "
+                         f"{len(transfers)} transfers left for the single channel")
+        multi_limits = pipette_limits(multi_pipette)
+        for move in moves:
+            protocol.comment(f"Distributing drug plate column {move.source_column} "
+                             f"to wells {move.dest} with the multi-channel pipette")
+            distribute(volume=move.volume,
+                       source=drug_plates[move.plate][move.source],
+                       dest=_dispense_locations(cell_plate, move.dest, reuse_tips),
+                       pipette=multi_pipette,
+                       protocol=protocol,
+                       limits=multi_limits,
+                       residual_volume=residual_volume,
+                       reuse_tips=reuse_tips,
+                       touch_tip=touch_tip or reuse_tips,
+                       chunking="min-trips" if reuse_tips else "balanced",
+                       **kwargs)
+
+    groups = schedule_drug_transfers(transfers)
+    baseline = schedule_drug_transfers(transfers, pool_conditions=False)
+    protocol.comment(f"Drug transfer: {len(groups)} distributions with "
+                     f"{count_tips(groups, limits, residual_volume, reuse_tips)} tips "
+                     f"({count_tips(baseline, limits, residual_volume, reuse_tips=False)} "
+                     f"tips with one distribution per condition and drug)")
+
+    for group in groups:
+        plate, source_well = group.source
+        reuse_tip = reuse_tips and group.reuse_tip
+        protocol.comment(f"Distributing {group.drug} from well {source_well} "
+                         f"to wells {group.dest} ({', '.join(group.conditions)}) "
+                         f"on 384-well cell plate")
+        distribute(volume=group.volume,
+                   source=drug_plates[plate][source_well],
+                   dest=_dispense_locations(cell_plate, group.dest, reuse_tip),
+                   pipette=pipette,
+                   protocol=protocol,
+                   limits=limits,
+                   residual_volume=residual_volume,
+                   reuse_tips=reuse_tip,
+                   touch_tip=touch_tip or reuse_tip,
+                   chunking="min-trips" if reuse_tip else "balanced",
+                   n_mix=n_mix if group.source in premix_wells else None,
+                   **kwargs)
+    return groups
@@ -0,0 +1,208 @@
+"""Estimate the wall-clock duration of a protocol from a simulated run.
+
+Runs the protocol in the opentrons simulator (see simulation.py) and adds
+up gantry motion, plunger time at the current flow rates, delays and the
+fixed overheads of tip handling and touch_tip for every command. The
+result is broken down by the protocol line that issued the commands, e.g.
+
+    python -m apx_opentrons.estimate OVP/sample_processing_protocols/06_OVP_post_PFA_PBS_wash.py \
+        --param n_wash=4 --param process_full_plate=true --labware-dir path/to/custom_labware
+"""
+from __future__ import annotations
+
+import argparse
+import ast
+from collections import defaultdict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+
+from .simulation import (Command, SimulationResult, parse_param_values,
+                         protocol_parameters, load_protocol, simulate_protocol)
+from .timing import DEFAULT_TIMING, TimingModel
+
+# commands that move the pipette to their location
+MOVING_ACTIONS = {"aspirate", "dispense", "blow_out", "touch_tip", "air_gap",
+                  "move_to", "pick_up_tip", "drop_tip", "return_tip"}
+
+
+@dataclass
+class CommandEstimate:
+    command: Command
+    motion: float = 0.0
+    liquid: float = 0.0
+    delay: float = 0.0
+    overhead: float = 0.0
+
+    @property
+    def total(self) -> float:
+        return self.motion + self.liquid + self.delay + self.overhead
+
+
+@dataclass
+class PhaseEstimate:
+    line: Optional[int]
+    label: str
+    n_commands: int = 0
+    motion: float = 0.0
+    liquid: float = 0.0
+    delay: float = 0.0
+    overhead: float = 0.0
+
+    @property
+    def total(self) -> float:
+        return self.motion + self.liquid + self.delay + self.overhead
+
+
+@dataclass
+class Estimate:
+    result: SimulationResult
+    commands: list = field(default_factory=list)
+
+    @property
+    def total_seconds(self) -> float:
+        return sum(estimate.total for estimate in self.commands)
+
+    def by_phase(self) -> list[PhaseEstimate]:
+        """Estimates grouped by the protocol line that issued the commands,
+        in the order the phases first ran."""
+        phases: dict[Optional[int], PhaseEstimate] = {}
+        for estimate in self.commands:
+            line = estimate.command.line
+            if line not in phases:
+                phases[line] = PhaseEstimate(line=line,
+                                             label=statement_label(self.result.path, line))
+            phase = phases[line]
+            phase.n_commands += 1
+            phase.motion += estimate.motion
+            phase.liquid += estimate.liquid
+            phase.delay += estimate.delay
+            phase.overhead += estimate.overhead
+        return list(phases.values())
+
+    def by_action(self) -> dict[str, tuple[int, float]]:
+        totals = defaultdict(lambda: [0, 0.0])
+        for estimate in self.commands:
+            totals[estimate.command.action][0] += 1
+            totals[estimate.command.action][1] += estimate.total
+        return {action: tuple(total) for action, total in totals.items()}
+
+
+@lru_cache(maxsize=None)
+def _statements(path: Path) -> dict[int, str]:
+    """Map each line of a file to the (collapsed) source of its statement."""
+    source = path.read_text()
+    statements = {}
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.stmt) and not isinstance(
+                node, (ast.FunctionDef, ast.For, ast.While, ast.If, ast.With, ast.Try)):
+            segment = ast.get_source_segment(source, node) or ""
+            statements.setdefault(node.lineno, " ".join(segment.split()))
+    return statements
+
+
+def statement_label(path: Path, line: Optional[int], width: int = 60) -> str:
+    if line is None:
+        return "(outside the protocol file)"
+    statements = _statements(Path(path))
+    # multi-line calls can report a line inside the statement
+    start = max((start for start in statements if start <= line), default=None)
+    label = statements.get(start, "")
+    if len(label) > width:
+        label = label[:width - 3] + "..."
+    return f"L{line} {label}"
+
+
+def estimate_commands(commands: list[Command],
+                      timing: TimingModel = DEFAULT_TIMING) -> list[CommandEstimate]:
+    """Estimate each leaf command; parents such as mix or transfer are
+    accounted for by their nested commands."""
+    estimates = []
+    position = None
+    for command in commands:
+        if not command.is_leaf:
+            continue
+        estimate = CommandEstimate(command)
+        action = command.action
+
+        if action in MOVING_ACTIONS:
+            estimate.motion = timing.travel_seconds(position, command.point)
+            position = command.point
+
+        if action in ("aspirate", "dispense") and command.volume and command.flow_rate:
+            estimate.liquid = command.volume / command.flow_rate
+        elif action == "delay":
+            estimate.delay = command.seconds
+        elif action == "touch_tip":
+            estimate.overhead = timing.touch_tip_seconds
+        elif action == "pick_up_tip":
+            estimate.overhead = timing.pick_up_tip_seconds
+        elif action in ("drop_tip", "return_tip"):
+            estimate.overhead = timing.drop_tip_seconds
+        elif action == "blow_out":
+            estimate.overhead = timing.blow_out_seconds
+        elif action == "home":
+            estimate.overhead = timing.home_seconds
+            position = None
+
+        estimates.append(estimate)
+    return estimates
+
+
+def estimate_protocol(path, params: Optional[dict] = None, labware_dirs=None,
+                      timing: TimingModel = DEFAULT_TIMING) -> Estimate:
+    result = simulate_protocol(path, params=params, labware_dirs=labware_dirs)
+    return Estimate(result=result, commands=estimate_commands(result.commands, timing))
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+def format_report(estimate: Estimate) -> str:
+    result = estimate.result
+    params = ", ".join(f"{name}={value}" for name, value in result.params.items())
+    lines = [f"{result.path.name} ({params})",
+             f"estimated duration {format_duration(estimate.total_seconds)}, "
+             f"{len(estimate.commands)} commands, {result.n_tips} tips"]
+    if not result.ok:
+        lines.append(f"SIMULATION FAILED: {result.error}")
+
+    lines.append("")
+    lines.append(f"{'phase':<66}{'cmds':>6}{'motion':>9}{'liquid':>9}"
+                 f"{'delay':>9}{'overhead':>9}{'total':>10}")
+    for phase in estimate.by_phase():
+        lines.append(f"{phase.label:<66}{phase.n_commands:>6}{phase.motion:>9.0f}"
+                     f"{phase.liquid:>9.0f}{phase.delay:>9.0f}{phase.overhead:>9.0f}"
+                     f"{format_duration(phase.total):>10}")
+
+    lines.append("")
+    lines.append(f"{'command':<20}{'count':>8}{'total':>10}")
+    for action, (count, seconds) in sorted(estimate.by_action().items(),
+                                           key=lambda item: -item[1][1]):
+        lines.append(f"{action:<20}{count:>8}{format_duration(seconds):>10}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("protocol", type=Path)
+    parser.add_argument("--param", action="append", default=[],
+                        help="run time parameter as name=value, can be repeated")
+    parser.add_argument("--labware-dir", action="append", default=[], type=Path,
+                        help="directory with custom labware definitions (*.json)")
+    args = parser.parse_args(argv)
+
+    specs = protocol_parameters(load_protocol(args.protocol))
+    estimate = estimate_protocol(args.protocol,
+                                 params=parse_param_values(specs, args.param),
+                                 labware_dirs=args.labware_dir)
+    print(format_report(estimate))
+    return 0 if estimate.result.ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,73 @@
+"""Compare protocol startup time with pandas and with the csv-based reader.
+
+Every variant runs in a fresh interpreter, like a protocol analysis on the
+OT-2, and imports its reader and parses the given metadata files, e.g.
+
+    python -m apx_opentrons.import_benchmark --repeat 5 OVP/metadata/plate_metadata_v2.0.csv
+
+Run it on the robot (ssh, with /data/user_storage/apricot_data as working
+directory) to see the difference on the Raspberry Pi.
+"""
+from __future__ import annotations
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Optional
+
+REPOSITORY_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_FILES = ("OVP/metadata/plate_metadata_v2.0.csv",
+                 "OVP/metadata/drug_plate_metadata_v2.0.csv")
+
+VARIANTS = {
+    "python": "",
+    "pandas": "import pandas as pd\n"
+              "for path in paths: pd.read_csv(path)\n",
+    "PlateMetadata": "from apx_opentrons.plate_metadata import PlateMetadata\n"
+                     "for path in paths: PlateMetadata.read_csv(path)\n",
+}
+
+
+def time_variant(code: str, paths, repeat: int = 5) -> Optional[list[float]]:
+    """Wall-clock seconds of a fresh interpreter running code, None if it
+    fails (e.g. pandas is not installed)."""
+    script = (f"import sys\nsys.path.insert(0, {str(REPOSITORY_ROOT)!r})\n"
+              f"paths = {[str(path) for path in paths]!r}\n{code}")
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        completed = subprocess.run([sys.executable, "-c", script],
+                                   capture_output=True)
+        if completed.returncode != 0:
+            return None
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("files", nargs="*", type=Path,
+                        default=[REPOSITORY_ROOT / path for path in DEFAULT_FILES])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    results = {name: time_variant(code, args.files, args.repeat)
+               for name, code in VARIANTS.items()}
+    baseline = statistics.median(results["python"])
+
+    print(f"{'variant':<16}{'median':>10}{'min':>10}{'over python':>14}")
+    for name, seconds in results.items():
+        if seconds is None:
+            print(f"{name:<16}{'not available':>34}")
+            continue
+        median = statistics.median(seconds)
+        print(f"{name:<16}{median:>9.3f}s{min(seconds):>9.3f}s"
+              f"{median - baseline:>13.3f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
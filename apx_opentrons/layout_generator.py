@@ -0,0 +1,282 @@
+"""Generate randomized cell plate layouts that are cheap to pipette.
+
+A layout is randomized within every experimental unit: the conditions of
+the wells that are not excluded from randomization are shuffled among
+those wells, everything else (controls, edge wells, sample columns)
+stays where it is. A randomization is valid if no condition occurs more
+than max_per_row times in a row or max_per_column times in a column of
+its unit, as in the current layouts (once per row, at most twice per
+column).
+
+Every candidate is scored by simulating the drug transfer of
+04_OVP_drug_transfer.py on it (drug_transfer.py): the tips, the gantry
+travel and the estimated duration of the distributions. Any valid
+randomization is as good as any other for the design, so picking the
+cheapest of a number of seeded candidates keeps the design and saves
+robot time. The layout is written in the schema and row order of the
+input file:
+
+    python -m apx_opentrons.layout_generator OVP 2.0 --candidates 200 --seed 1 \\
+        --output OVP/metadata/plate_metadata_v2.1.csv
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import random
+import statistics
+from collections import Counter
+from dataclasses import dataclass
+from typing import Optional
+
+from .drug_transfer import drug_transfers, plan_multi_channel, schedule_drug_transfers
+from .liquid_handling import PipetteLimits, plan_distribute
+from .metadata_resolver import load_plate_metadata, resolve_metadata
+from .plate_metadata import PlateMetadata, parse_value
+from .protocol_designer import PIPETTES, DesignerLocation, Point, _slot_origin
+from .routing import travel_distance
+from .timing import TimingModel
+
+# columns that belong to the well position and are never shuffled
+POSITION_COLUMNS = ("well", "row", "col", "sample", "sample_name", "experimental_unit",
+                    "exclude_from_randomization")
+
+# A1 position (x, y from the front left corner of the slot), top of the
+# wells and well spacing in mm, from the labware definitions
+LABWARE_GEOMETRY = {
+    "greiner_bio_one_384_well_plate_100ul_reduced_well_size": (12.13, 76.49, 14.4, 4.5),
+    "greinermasterblock_96_wellplate_2000ul": (14.38, 74.24, 44.0, 9.0),
+}
+
+# deck and settings of 04_OVP_drug_transfer.py
+CELL_PLATE = ("greiner_bio_one_384_well_plate_100ul_reduced_well_size", "6")
+DRUG_PLATE = ("greinermasterblock_96_wellplate_2000ul", "5")
+PIPETTE = "p20_single_gen2"
+SINGLE_VOLUME = 5
+COMBINATION_VOLUME = 2.5
+RESIDUAL_VOLUME = 5
+DISPENSE_DELAY = 0.5
+
+
+def well_location(labware: tuple, well: str) -> DesignerLocation:
+    """Deck coordinates of the top of a well of (load name, slot)."""
+    load_name, slot = labware
+    x, y, z, spacing = LABWARE_GEOMETRY[load_name]
+    origin = _slot_origin(slot)
+    row, column = ord(well[0]) - ord("A"), int(well[1:]) - 1
+    return DesignerLocation(f"{slot}/{well}",
+                            Point(origin.x + x + column * spacing,
+                                  origin.y + y - row * spacing, origin.z + z))
+
+
+def read_layout(path) -> tuple[list[str], list[dict]]:
+    """Column names and rows of a layout CSV, as text so a generated layout
+    is written exactly like the input."""
+    with open(path, newline="", encoding="utf-8-sig") as file:
+        reader = csv.DictReader(file)
+        return list(reader.fieldnames), list(reader)
+
+
+def write_layout(path, fieldnames: list[str], rows: list[dict]) -> None:
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.DictWriter(file, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def to_metadata(rows: list[dict]) -> PlateMetadata:
+    return PlateMetadata({column: parse_value(text) for column, text in row.items()}
+                         for row in rows)
+
+
+def violations(rows: list[dict], indices: list[int],
+               max_per_row: int = 1, max_per_column: int = 2) -> int:
+    """Wells of a unit beyond the allowed repeats of their condition per
+    row and column."""
+    per_row = Counter((rows[i]["condition"], rows[i]["row"]) for i in indices)
+    per_column = Counter((rows[i]["condition"], rows[i]["col"]) for i in indices)
+    return (sum(max(0, n - max_per_row) for n in per_row.values())
+            + sum(max(0, n - max_per_column) for n in per_column.values()))
+
+
+def randomize(rows: list[dict],
+              rng: random.Random,
+              unit_column: str = "experimental_unit",
+              max_per_row: int = 1,
+              max_per_column: int = 2,
+              max_swaps: int = 20000) -> list[dict]:
+    """A valid randomization of the layout rows (a new list).
+
+    The conditions of every unit are shuffled and then swapped at random
+    until no condition repeats too often in a row or column; swaps that
+    add repeats are rejected.
+    """
+    rows = [dict(row) for row in rows]
+    moved = [column for column in rows[0]
+             if column not in POSITION_COLUMNS and column != unit_column]
+    units: dict = {}
+    for i, row in enumerate(rows):
+        if row["exclude_from_randomization"] != "True":
+            units.setdefault(row[unit_column], []).append(i)
+
+    def swap(i: int, j: int) -> None:
+        for column in moved:
+            rows[i][column], rows[j][column] = rows[j][column], rows[i][column]
+
+    for unit, indices in units.items():
+        treatments = [{column: rows[i][column] for column in moved} for i in indices]
+        rng.shuffle(treatments)
+        for i, treatment in zip(indices, treatments):
+            rows[i].update(treatment)
+
+        count = violations(rows, indices, max_per_row, max_per_column)
+        for _ in range(max_swaps):
+            if count == 0:
+                break
+            i, j = rng.choice(indices), rng.choice(indices)
+            swap(i, j)
+            new_count = violations(rows, indices, max_per_row, max_per_column)
+            if new_count > count:
+                swap(i, j)
+            else:
+                count = new_count
+        else:
+            raise ValueError(f"no valid randomization of {unit} found in {max_swaps} swaps, "
+                             f"allow more repeats per row or column")
+    return rows
+
+
+@dataclass
+class LayoutCost:
+    """Simulated drug transfer of a layout."""
+    tips: int
+    distributions: int
+    # transfers done by the 8-channel pipette
+    multi_channel_transfers: int
+    travel: float  # mm
+    seconds: float
+
+    @property
+    def key(self) -> tuple:
+        return self.seconds, self.tips, self.travel
+
+
+def layout_cost(layout: PlateMetadata,
+                drug_plate_metadata: PlateMetadata,
+                unit_column: str = "experimental_unit",
+                exclude_units: tuple = ("elution_control",),
+                use_multi_channel: bool = False,
+                reuse_tips: bool = False,
+                timing: Optional[TimingModel] = None) -> LayoutCost:
+    """Tips, travel and duration of transferring the drugs to layout like
+    04_OVP_drug_transfer.py does (a new 20 ul tip per aspiration, or one
+    per drug-free group with reuse_tips, routes optimized)."""
+    min_volume, max_volume, flow_rate = PIPETTES[PIPETTE]
+    limits = PipetteLimits(max_volume=max_volume, min_volume=min_volume)
+    if timing is None:
+        timing = TimingModel(aspirate_flow_rate=flow_rate, dispense_flow_rate=flow_rate,
+                             blow_out_flow_rate=flow_rate)
+
+    for unit in exclude_units:
+        layout = layout.exclude(unit_column, unit)
+    transfers = drug_transfers(layout, {"drug_plate": drug_plate_metadata},
+                               single_volume=SINGLE_VOLUME,
+                               combination_volume=COMBINATION_VOLUME)
+    moves = []
+    if use_multi_channel:
+        moves, transfers = plan_multi_channel(transfers)
+
+    distributions = [(move.volume, move.source, move.dest, reuse_tips) for move in moves]
+    distributions += [(group.volume, group.source[1], group.dest,
+                       reuse_tips and group.reuse_tip)
+                      for group in schedule_drug_transfers(transfers)]
+
+    cost = LayoutCost(tips=0, distributions=len(distributions),
+                      multi_channel_transfers=sum(len(move.transfers) for move in moves),
+                      travel=0.0, seconds=0.0)
+    for volume, source, dest, reuse_tip in distributions:
+        # a list, locations are tuples and would be taken for several sources
+        plan = plan_distribute(volume=volume,
+                               source=[well_location(DRUG_PLATE, source)],
+                               dest=[well_location(CELL_PLATE, well) for well in dest],
+                               limits=limits,
+                               dispense_delay=DISPENSE_DELAY,
+                               residual_volume=RESIDUAL_VOLUME,
+                               reuse_tips=reuse_tip,
+                               touch_tip=reuse_tip,
+                               chunking="min-trips" if reuse_tip else "balanced",
+                               optimize_route=True)
+        cost.tips += sum(1 for step in plan.steps if step.action == "pick_up_tip")
+        cost.travel += travel_distance([step.location for step in plan.steps])
+        cost.seconds += timing.plan_seconds(plan.steps)
+    return cost
+
+
+def generate_layouts(rows: list[dict],
+                     drug_plate_metadata: PlateMetadata,
+                     n_candidates: int = 100,
+                     seed: Optional[int] = None,
+                     unit_column: str = "experimental_unit",
+                     max_per_row: int = 1,
+                     max_per_column: int = 2,
+                     **kwargs) -> list[tuple[list[dict], LayoutCost]]:
+    """n_candidates valid randomizations of rows with their costs, cheapest
+    first. kwargs go to layout_cost."""
+    rng = random.Random(seed)
+    candidates = []
+    for _ in range(n_candidates):
+        candidate = randomize(rows, rng, unit_column, max_per_row, max_per_column)
+        candidates.append((candidate, layout_cost(to_metadata(candidate),
+                                                  drug_plate_metadata, unit_column,
+                                                  **kwargs)))
+    return sorted(candidates, key=lambda candidate: candidate[1].key)
+
+
+def format_cost(cost: LayoutCost) -> str:
+    return (f"{cost.tips} tips, {cost.distributions} distributions, "
+            f"{cost.travel / 1000:.1f} m travel, about {cost.seconds / 60:.0f} min"
+            + (f", {cost.multi_channel_transfers} transfers with the 8-channel"
+               if cost.multi_channel_transfers else ""))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("project", help="e.g. OVP")
+    parser.add_argument("version", help="version of the layout to randomize, e.g. 2.0")
+    parser.add_argument("--name", default="plate_metadata")
+    parser.add_argument("--drug-plate", nargs=2, default=("drug_plate_metadata", "2.0"),
+                        metavar=("NAME", "VERSION"))
+    parser.add_argument("--unit-column", default="experimental_unit",
+                        help="randomize within the values of this column")
+    parser.add_argument("--candidates", type=int, default=100)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--max-per-row", type=int, default=1)
+    parser.add_argument("--max-per-column", type=int, default=2)
+    parser.add_argument("--multi-channel", action="store_true",
+                        help="score with the 8-channel pipette of use_multi_channel")
+    parser.add_argument("--reuse-tips", action="store_true",
+                        help="score with the tips reused like reuse_tips does")
+    parser.add_argument("--output", help="write the cheapest layout to this CSV file")
+    args = parser.parse_args(argv)
+
+    fieldnames, rows = read_layout(resolve_metadata(args.project, args.name, args.version))
+    drug_plate_metadata = load_plate_metadata(args.project, *args.drug_plate)
+    options = {"use_multi_channel": args.multi_channel, "reuse_tips": args.reuse_tips}
+
+    current = layout_cost(to_metadata(rows), drug_plate_metadata, args.unit_column,
+                          **options)
+    candidates = generate_layouts(rows, drug_plate_metadata, args.candidates, args.seed,
+                                  args.unit_column, args.max_per_row, args.max_per_column,
+                                  **options)
+    median = statistics.median(cost.seconds for _, cost in candidates)
+    print(f"current layout v{args.version}: {format_cost(current)}")
+    print(f"{len(candidates)} candidates: median about {median / 60:.0f} min")
+    print(f"cheapest candidate: {format_cost(candidates[0][1])}")
+    if args.output:
+        write_layout(args.output, fieldnames, candidates[0][0])
+        print(f"written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
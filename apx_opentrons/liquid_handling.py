@@ -0,0 +1,630 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from math import ceil
+from typing import TYPE_CHECKING, Any, NamedTuple, Optional, Union
+
+from .routing import shortest_route, travel_distance
+from .timing import DEFAULT_TIMING, TimingModel
+
+# opentrons is only needed for type hints, so plans can be built and
+# inspected offline without the robot software installed
+if TYPE_CHECKING:
+    from opentrons import protocol_api
+    from opentrons.protocol_api import Well
+
+    from .volume_tracking import VolumeTracker
+
+# volumes are compared with a small tolerance to absorb float rounding
+# (e.g. 6 * 2.5 + 5 ul)
+VOLUME_TOLERANCE = 1e-6
+
+
+class Step(NamedTuple):
+    """A single pipetting command of a plan.
+
+    ``volume=None`` on a dispense means "dispense everything left in the
+    tip", which is how the residual volume is returned to the source.
+    ``pre_wet`` marks the aspirate and dispense that only wet the tip.
+    """
+    action: str
+    location: Any = None
+    volume: Optional[float] = None
+    rate: float = 1.0
+    seconds: float = 0.0
+    repetitions: int = 0
+    radius: Optional[float] = None
+    v_offset: Optional[float] = None
+    pre_wet: bool = False
+
+
+class PipetteLimits(NamedTuple):
+    """Working volume range of a pipette with its loaded tips."""
+    max_volume: float
+    min_volume: float = 0.0
+
+
+def pipette_limits(pipette) -> PipetteLimits:
+    """Read the usable volume range from a loaded pipette and its tip racks.
+
+    The capacity is the smaller of the pipette's and the tip's max volume,
+    e.g. 20 ul for a p20 with filter tips or 200 ul for a p300 with 200 ul
+    tips.
+    """
+    max_volume = pipette.max_volume
+    if pipette.tip_racks:
+        tip_volume = pipette.tip_racks[0].wells()[0].max_volume
+        max_volume = min(max_volume, tip_volume)
+    return PipetteLimits(max_volume=max_volume, min_volume=pipette.min_volume)
+
+
+@dataclass
+class Plan:
+    """A validated list of pipetting steps that can be executed on a pipette.
+
+    ``tip_attached`` is True if the caller picks up and drops the tip around
+    the plan (``ignore_tips=True`` in the helpers).
+    """
+    max_volume: float
+    min_volume: float = 0.0
+    tip_attached: bool = False
+    steps: list = field(default_factory=list)
+
+    def add(self, action: str, **kwargs) -> None:
+        self.steps.append(Step(action, **kwargs))
+
+    @property
+    def n_tips(self) -> int:
+        return sum(1 for step in self.steps if step.action == "pick_up_tip")
+
+    @property
+    def n_aspirations(self) -> int:
+        """Aspirations that transfer liquid, without tip pre-wetting."""
+        return sum(1 for step in self.steps
+                   if step.action == "aspirate" and not step.pre_wet)
+
+    @property
+    def total_delay(self) -> float:
+        return sum(step.seconds for step in self.steps if step.action == "delay")
+
+    def estimated_seconds(self, timing: TimingModel = DEFAULT_TIMING) -> float:
+        return timing.plan_seconds(self.steps)
+
+    @property
+    def travel_distance(self) -> Optional[float]:
+        """xy gantry travel between the steps in mm, None without deck
+        coordinates."""
+        return travel_distance([step.location for step in self.steps])
+
+    def validate(self) -> "Plan":
+        """Check tip handling and tip volumes step by step.
+
+        Raises a ValueError naming the first offending step.
+        """
+        has_tip = self.tip_attached
+        current_volume = 0.0
+
+        for i, step in enumerate(self.steps):
+            if step.action == "pick_up_tip":
+                if has_tip:
+                    raise ValueError(f"step {i}: picking up a tip while a tip is attached")
+                has_tip = True
+                current_volume = 0.0
+                continue
+
+            if step.action == "delay":
+                if step.seconds < 0:
+                    raise ValueError(f"step {i}: negative delay of {step.seconds} s")
+                continue
+
+            if step.action == "move_to":
+                continue
+
+            if not has_tip:
+                raise ValueError(f"step {i}: {step.action} without a tip attached")
+
+            if step.action == "drop_tip":
+                has_tip = False
+                current_volume = 0.0
+            elif step.action == "aspirate":
+                current_volume += step.volume
+                if current_volume > self.max_volume + VOLUME_TOLERANCE:
+                    raise ValueError(f"step {i}: {current_volume} ul exceed the "
+                                     f"pipette capacity of {self.max_volume} ul")
+            elif step.action == "dispense":
+                if step.volume is not None and step.volume < self.min_volume - VOLUME_TOLERANCE:
+                    raise ValueError(f"step {i}: dispensing {step.volume} ul is below the "
+                                     f"pipette minimum of {self.min_volume} ul")
+                volume = current_volume if step.volume is None else step.volume
+                if volume > current_volume + VOLUME_TOLERANCE:
+                    raise ValueError(f"step {i}: dispensing {volume} ul with only "
+                                     f"{current_volume} ul in the tip")
+                current_volume -= volume
+            elif step.action == "mix":
+                if step.volume + current_volume > self.max_volume + VOLUME_TOLERANCE:
+                    raise ValueError(f"step {i}: mixing {step.volume} ul exceeds the "
+                                     f"pipette capacity of {self.max_volume} ul")
+            elif step.action == "blow_out":
+                current_volume = 0.0
+            elif step.action != "touch_tip":
+                raise ValueError(f"step {i}: unknown action {step.action}")
+
+        if has_tip and not self.tip_attached:
+            raise ValueError("plan ends with a tip still attached")
+
+        return self
+
+    def execute(self, pipette, protocol: protocol_api.ProtocolContext) -> None:
+        for step in self.steps:
+            if step.action == "pick_up_tip":
+                pipette.pick_up_tip()
+            elif step.action == "drop_tip":
+                pipette.drop_tip()
+            elif step.action == "aspirate":
+                pipette.aspirate(volume=step.volume,
+                                 location=step.location,
+                                 rate=step.rate)
+            elif step.action == "dispense":
+                pipette.dispense(volume=step.volume,
+                                 location=step.location,
+                                 rate=step.rate)
+            elif step.action == "mix":
+                pipette.mix(repetitions=step.repetitions,
+                            volume=step.volume,
+                            location=step.location,
+                            rate=step.rate)
+            elif step.action == "touch_tip":
+                touch_tip_kwargs = {}
+                if step.radius is not None:
+                    touch_tip_kwargs["radius"] = step.radius
+                if step.v_offset is not None:
+                    touch_tip_kwargs["v_offset"] = step.v_offset
+                pipette.touch_tip(**touch_tip_kwargs)
+            elif step.action == "delay":
+                protocol.delay(seconds=step.seconds)
+            elif step.action == "move_to":
+                pipette.move_to(step.location)
+            elif step.action == "blow_out":
+                pipette.blow_out(step.location)
+
+
+def split_evenly(items: list, n_chunks: int) -> list[list]:
+    """Split items into n_chunks consecutive chunks whose sizes differ by at
+    most one, longer chunks first (same as np.array_split)."""
+    size, n_longer = divmod(len(items), n_chunks)
+    chunks = []
+    start = 0
+    for i in range(n_chunks):
+        stop = start + size + (1 if i < n_longer else 0)
+        chunks.append(list(items[start:stop]))
+        start = stop
+    return chunks
+
+
+def max_dispenses_per_aspiration(volume: float,
+                                 limits: PipetteLimits,
+                                 residual_volume: float = 0) -> int:
+    """Number of volume-sized dispenses that fit into one aspiration."""
+    if volume < limits.min_volume - VOLUME_TOLERANCE:
+        raise ValueError(f"{volume} ul is below the pipette minimum of "
+                         f"{limits.min_volume} ul")
+
+    n_per_chunk = int((limits.max_volume - residual_volume + VOLUME_TOLERANCE) // volume)
+    if n_per_chunk < 1:
+        raise ValueError(f"{volume} ul plus {residual_volume} ul residual volume "
+                         f"do not fit into a {limits.max_volume} ul tip")
+    return n_per_chunk
+
+
+CHUNKING_STRATEGIES = ("balanced", "min-trips")
+
+
+def chunk_destinations(items: list,
+                       volume: float,
+                       limits: PipetteLimits,
+                       residual_volume: float = 0,
+                       chunking: str = "balanced") -> list[list]:
+    """Chunk items so that each chunk fits into one aspiration, using as few
+    aspirations (and trips back to the source) as the tip allows.
+
+    "balanced" spreads the items evenly over the chunks, "min-trips" fills
+    every aspiration completely and leaves the remainder for the last
+    chunk. Both take the same number of aspirations, min-trips also
+    changes how plan_distribute handles the residual of a kept tip.
+    """
+    if chunking not in CHUNKING_STRATEGIES:
+        raise ValueError(f"unknown chunking strategy {chunking}, "
+                         f"choose from {CHUNKING_STRATEGIES}")
+    if not items:
+        return []
+
+    n_per_chunk = max_dispenses_per_aspiration(volume, limits, residual_volume)
+    if chunking == "balanced":
+        return split_evenly(items, ceil(len(items) / n_per_chunk))
+    return [list(items[i:i + n_per_chunk]) for i in range(0, len(items), n_per_chunk)]
+
+
+def _add_delay(plan: Plan, seconds: float) -> None:
+    # zero-second delays only add commands to the run log
+    if seconds:
+        plan.add("delay", seconds=seconds)
+
+
+def plan_distribute(volume: float,
+                    source: Union[Well, list[Well]],
+                    dest: list[Well],
+                    limits: PipetteLimits,
+                    aspirate_delay: float = 0,
+                    dispense_delay: float = 0,
+                    residual_volume: float = 0,
+                    residual_dispense_height_from_bottom: Optional[float] = None,
+                    touch_tip_radius: Optional[float] = None,
+                    touch_tip_v_offset: Optional[float] = None,
+                    touch_tip: bool = False,
+                    residual_dispense_location: Optional[Well] = None,
+                    n_mix: Optional[int] = None,
+                    aspirate_rate: float = 1.0,
+                    dispense_rate: float = 1.0,
+                    reuse_tips: bool = False,
+                    ignore_tips: bool = False,
+                    pre_wet_tips: bool = False,
+                    chunking: str = "balanced",
+                    optimize_route: bool = False,
+                    source_volumes: Optional[list[float]] = None) -> Plan:
+    """Plan a one-to-many distribution from source to every well in dest.
+
+    Each aspiration takes up the volume for a chunk of destinations plus
+    residual_volume, which is returned to residual_dispense_location (if
+    given) or discarded with the tip.
+
+    With chunking="min-trips" and a tip that is kept across chunks
+    (reuse_tips or ignore_tips), the residual volume stays in the tip and
+    only the dispensed volume is topped up for the next chunk. The residual
+    is returned once after the last chunk and the tip is only pre-wetted
+    once. A kept tip without a residual_dispense_location does the same
+    with any chunking, the residual has nowhere else to go.
+
+    With optimize_route the destinations are reordered to shorten the
+    gantry travel, including the trips back to the source (see routing.py).
+
+    source can also be a list of wells, e.g. reservoir columns holding the
+    same liquid, with the volume per channel each of them can give in
+    source_volumes. Aspirations are taken from the first source until the
+    next one would exceed what is left in it, then from the next source;
+    the last source takes the rest. If residual_dispense_location is one
+    of the sources, the residual is returned to the source in use.
+    """
+    sources = list(source) if isinstance(source, (list, tuple)) else [source]
+    if source_volumes is None:
+        source_volumes = [float("inf")] * len(sources)
+    elif len(source_volumes) != len(sources):
+        raise ValueError(f"{len(source_volumes)} source volumes given for "
+                         f"{len(sources)} sources")
+    remaining = list(source_volumes)
+    current = 0
+
+    plan = Plan(max_volume=limits.max_volume, min_volume=limits.min_volume,
+                tip_attached=ignore_tips)
+    if optimize_route:
+        dest = shortest_route(dest, sources[0], lambda items: chunk_destinations(
+            items, volume, limits, residual_volume, chunking=chunking))
+    chunked_dest = chunk_destinations(dest, volume, limits, residual_volume,
+                                      chunking=chunking)
+    # a kept tip with nowhere to return the residual to carries it along
+    keep_residual = (reuse_tips or ignore_tips) and (chunking == "min-trips"
+                                                     or residual_dispense_location is None)
+
+    residual_to_source = any(residual_dispense_location == well for well in sources)
+
+    def residual_location(well: Well):
+        if residual_dispense_height_from_bottom is None:
+            return well
+        return well.bottom(z=residual_dispense_height_from_bottom)
+
+    for i, sub_list in enumerate(chunked_dest):
+        first_chunk = i == 0
+        last_chunk = i == len(chunked_dest) - 1
+
+        if not ignore_tips and (not reuse_tips or first_chunk):
+            plan.add("pick_up_tip")
+
+        aspirate_volume = len(sub_list)*volume
+        if first_chunk or not keep_residual:
+            aspirate_volume += residual_volume
+
+        # move on to the next source before this one runs low
+        while (current < len(sources) - 1
+               and aspirate_volume > remaining[current] + VOLUME_TOLERANCE):
+            current += 1
+        source = sources[current]
+        remaining[current] -= aspirate_volume
+
+        # pre-wet tip if required
+        if pre_wet_tips and (first_chunk or not keep_residual):
+            plan.add("aspirate", volume=limits.max_volume, location=source, pre_wet=True)
+            plan.add("dispense", volume=limits.max_volume, location=source, pre_wet=True)
+
+        # mix if required
+        if n_mix is not None:
+            plan.add("mix", repetitions=n_mix, volume=aspirate_volume,
+                     location=source, rate=aspirate_rate)
+
+        plan.add("aspirate", volume=aspirate_volume, location=source,
+                 rate=aspirate_rate)
+        _add_delay(plan, aspirate_delay)
+
+        for destination in sub_list:
+            plan.add("dispense", volume=volume, location=destination,
+                     rate=dispense_rate)
+            _add_delay(plan, dispense_delay)
+
+            if touch_tip:
+                plan.add("touch_tip", radius=touch_tip_radius,
+                         v_offset=touch_tip_v_offset)
+
+        # return the residual volume to the source
+        if residual_dispense_location is not None and residual_volume > 0:
+            if last_chunk or not keep_residual:
+                if residual_to_source:
+                    plan.add("dispense", volume=None, location=residual_location(source))
+                    remaining[current] += residual_volume
+                else:
+                    plan.add("dispense", volume=None,
+                             location=residual_location(residual_dispense_location))
+
+        if not ignore_tips and (not reuse_tips or last_chunk):
+            plan.add("drop_tip")
+
+    return plan.validate()
+
+
+def plan_consolidate(volume: float,
+                     source: list[Well],
+                     dest: Well,
+                     limits: PipetteLimits,
+                     aspirate_delay: float = 0,
+                     dispense_delay: float = 0,
+                     touch_tip_radius: Optional[float] = None,
+                     touch_tip_v_offset: Optional[float] = None,
+                     touch_tip: bool = False,
+                     aspirate_rate: float = 1.0,
+                     dispense_rate: float = 1.0,
+                     reuse_tips: bool = False,
+                     ignore_tips: bool = False,
+                     chunking: str = "balanced",
+                     optimize_route: bool = False) -> Plan:
+    """Plan a many-to-one consolidation from every well in source to dest.
+
+    With optimize_route the sources are reordered to shorten the gantry
+    travel, see plan_distribute.
+    """
+    plan = Plan(max_volume=limits.max_volume, min_volume=limits.min_volume,
+                tip_attached=ignore_tips)
+    if optimize_route:
+        source = shortest_route(source, dest, lambda items: chunk_destinations(
+            items, volume, limits, chunking=chunking))
+    chunked_source = chunk_destinations(source, volume, limits, chunking=chunking)
+
+    for i, sub_list in enumerate(chunked_source):
+        first_chunk = i == 0
+        last_chunk = i == len(chunked_source) - 1
+
+        if not ignore_tips and (not reuse_tips or first_chunk):
+            plan.add("pick_up_tip")
+
+        for source_well in sub_list:
+            plan.add("aspirate", volume=volume, location=source_well,
+                     rate=aspirate_rate)
+            _add_delay(plan, aspirate_delay)
+
+        plan.add("dispense", volume=len(sub_list)*volume, location=dest,
+                 rate=dispense_rate)
+
+        if touch_tip:
+            plan.add("touch_tip", radius=touch_tip_radius,
+                     v_offset=touch_tip_v_offset)
+
+        _add_delay(plan, dispense_delay)
+
+        if not ignore_tips and (not reuse_tips or last_chunk):
+            plan.add("drop_tip")
+
+    return plan.validate()
+
+
+def _at_height(well: Well, height_from_bottom: Optional[float]):
+    if height_from_bottom is None:
+        return well
+    return well.bottom(z=height_from_bottom)
+
+
+def plan_wash(volume: float,
+              source: Well,
+              wells: list[Well],
+              waste: Well,
+              limits: PipetteLimits,
+              n_cycles: int = 1,
+              remove_volume: Optional[float] = None,
+              final_remove_volume: Optional[float] = None,
+              residual_volume: float = 0,
+              source_height_from_bottom: Optional[float] = None,
+              fill_height_from_bottom: Optional[float] = None,
+              remove_height_from_bottom: Optional[float] = None,
+              waste_height_from_bottom: Optional[float] = None,
+              fill_rate: float = 1.0,
+              remove_rate: float = 1.0,
+              ignore_tips: bool = False) -> Plan:
+    """Plan n_cycles wash cycles: add volume from source to every well,
+    then remove remove_volume (default: volume) from every well into waste.
+
+    The last cycle removes final_remove_volume instead, if given. Heights
+    are used for the aspirations from source and wells and the dispenses
+    into wells and waste; without them the pipette's well clearances
+    apply.
+
+    Every cycle is a full distribution (min-trips chunking, residual
+    returned to the source) followed by a full consolidation.
+    """
+    remove_volume = volume if remove_volume is None else remove_volume
+    final_remove_volume = remove_volume if final_remove_volume is None else final_remove_volume
+    source_location = _at_height(source, source_height_from_bottom)
+    fill_locations = [_at_height(well, fill_height_from_bottom) for well in wells]
+    remove_locations = [_at_height(well, remove_height_from_bottom) for well in wells]
+    waste_location = _at_height(waste, waste_height_from_bottom)
+
+    plan = Plan(max_volume=limits.max_volume, min_volume=limits.min_volume,
+                tip_attached=ignore_tips)
+    if not wells or n_cycles < 1:
+        return plan
+    if not ignore_tips:
+        plan.add("pick_up_tip")
+
+    for cycle in range(n_cycles):
+        last_cycle = cycle == n_cycles - 1
+        passes = (
+            plan_distribute(volume, source_location, fill_locations, limits,
+                            residual_volume=residual_volume,
+                            residual_dispense_location=source,
+                            residual_dispense_height_from_bottom=source_height_from_bottom,
+                            dispense_rate=fill_rate, ignore_tips=True,
+                            chunking="min-trips"),
+            plan_consolidate(final_remove_volume if last_cycle else remove_volume,
+                             remove_locations, waste_location, limits,
+                             aspirate_rate=remove_rate, ignore_tips=True))
+        for step_plan in passes:
+            plan.steps.extend(step_plan.steps)
+
+    if not ignore_tips:
+        plan.add("drop_tip")
+    return plan.validate()
+
+
+def _report_chunking(protocol: protocol_api.ProtocolContext,
+                     name: str,
+                     plan: Plan,
+                     baseline: Plan,
+                     chunking: str,
+                     timing: TimingModel) -> None:
+    seconds = plan.estimated_seconds(timing)
+    saved = baseline.estimated_seconds(timing) - seconds
+    protocol.comment(f"{name}: {plan.n_aspirations} aspirations "
+                     f"({baseline.n_aspirations} balanced), ~{seconds:.0f} s, "
+                     f"{saved:.0f} s saved by {chunking} chunking")
+
+
+def _report_route(protocol: protocol_api.ProtocolContext,
+                  name: str,
+                  plan: Plan,
+                  baseline: Plan) -> None:
+    after, before = plan.travel_distance, baseline.travel_distance
+    if after is not None and before is not None and after < before:
+        protocol.comment(f"{name}: {before:.0f} mm -> {after:.0f} mm gantry travel "
+                         f"with reordered wells")
+
+
+# helper function to distribute with more flexibility
+def distribute(volume: float,
+               source: Union[Well, list[Well]],
+               dest: list[Well],
+               pipette,
+               protocol: protocol_api.ProtocolContext,
+               limits: Optional[PipetteLimits] = None,
+               chunking: str = "balanced",
+               optimize_route: bool = False,
+               volumes: Optional[VolumeTracker] = None,
+               report: bool = False,
+               **kwargs) -> Plan:
+    """Plan, validate and execute a distribution, see plan_distribute.
+
+    The volume range is read from the pipette and its tips unless limits
+    are given. With report, the expected time saved by a chunking
+    strategy other than "balanced" is added as a run comment, and so is
+    the gantry travel saved by reordering the destinations
+    (optimize_route). Both are compared to a second plan, which is only
+    made for the report.
+
+    With volumes, the plan is checked against the tracked well volumes
+    before it is executed (see volume_tracking.py). To distribute from
+    several sources (a list of wells), the volume they hold is taken from
+    volumes unless source_volumes are given.
+    """
+    if limits is None:
+        limits = pipette_limits(pipette)
+    sources = list(source) if isinstance(source, (list, tuple)) else [source]
+    if len(sources) > 1 and "source_volumes" not in kwargs:
+        if volumes is None:
+            raise ValueError("distributing from several sources needs their volumes, "
+                             "pass volumes or source_volumes")
+        kwargs["source_volumes"] = [volumes.available(well, pipette.channels)
+                                    for well in sources]
+    plan = plan_distribute(volume, source, dest, limits=limits,
+                           chunking=chunking, optimize_route=optimize_route, **kwargs)
+    if report and chunking != "balanced" and plan.steps:
+        baseline = plan_distribute(volume, source, dest, limits=limits,
+                                   optimize_route=optimize_route, **kwargs)
+        _report_chunking(protocol, "distribute", plan, baseline, chunking,
+                         TimingModel.for_pipette(pipette))
+    if report and optimize_route and plan.steps:
+        _report_route(protocol, "distribute", plan,
+                      plan_distribute(volume, source, dest, limits=limits,
+                                      chunking=chunking, **kwargs))
+    if volumes is not None:
+        volumes.apply(plan, pipette.channels, sources=tuple(sources))
+    plan.execute(pipette, protocol)
+    return plan
+
+
+# helper function to consolidate with more flexibility
+def consolidate(volume: float,
+                source: list[Well],
+                dest: Well,
+                pipette,
+                protocol: protocol_api.ProtocolContext,
+                limits: Optional[PipetteLimits] = None,
+                chunking: str = "balanced",
+                optimize_route: bool = False,
+                volumes: Optional[VolumeTracker] = None,
+                report: bool = False,
+                **kwargs) -> Plan:
+    """Plan, validate and execute a consolidation, see plan_consolidate.
+
+    The volume range is read from the pipette and its tips unless limits
+    are given. With report and optimize_route, the gantry travel saved by
+    reordering the sources is added as a run comment. With volumes, the
+    plan is checked against the tracked well volumes first.
+    """
+    if limits is None:
+        limits = pipette_limits(pipette)
+    plan = plan_consolidate(volume, source, dest, limits=limits,
+                            chunking=chunking, optimize_route=optimize_route, **kwargs)
+    if report and optimize_route and plan.steps:
+        _report_route(protocol, "consolidate", plan,
+                      plan_consolidate(volume, source, dest, limits=limits,
+                                       chunking=chunking, **kwargs))
+    if volumes is not None:
+        volumes.apply(plan, pipette.channels)
+    plan.execute(pipette, protocol)
+    return plan
+
+
+def wash(volume: float,
+         source: Well,
+         wells: list[Well],
+         waste: Well,
+         pipette,
+         protocol: protocol_api.ProtocolContext,
+         limits: Optional[PipetteLimits] = None,
+         volumes: Optional[VolumeTracker] = None,
+         **kwargs) -> Plan:
+    """Plan, validate and execute wash cycles, see plan_wash.
+
+    With volumes, the plan is checked against the tracked well volumes
+    first.
+    """
+    if limits is None:
+        limits = pipette_limits(pipette)
+    plan = plan_wash(volume, source, wells, waste, limits=limits, **kwargs)
+    if volumes is not None:
+        volumes.apply(plan, pipette.channels, sources=(source,))
+    plan.execute(pipette, protocol)
+    return plan
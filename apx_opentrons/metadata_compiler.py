@@ -0,0 +1,447 @@
+"""Compile the xlsx plate layouts into the metadata CSVs and a precompiled
+JSON form.
+
+Every layout workbook (e.g. OVP/metadata/plate_layout_v2.0.xlsx) has one
+sheet per metadata column (sample or sample_name, experimental_unit,
+condition, replicate) drawn as a plate: column numbers in the first row,
+row letters in the first column. The "merged" sheet only shows them
+together and is skipped. The workbooks are read as a stream of XML
+events with the standard library, like plate_metadata.py the protocols
+and tools do not need pandas or openpyxl.
+
+The other columns of the CSV (exclude_from_randomization,
+final_concentration_uM, drug_panel, the stock concentrations, ...)
+describe conditions, not wells, and are taken over from the current CSV
+by condition (and sample for exclude_from_randomization); combination
+is derived from the condition. The layout is validated before anything
+is written: well names on the plate, wells drawn twice, wells missing in
+a sheet, combination syntax "A + B" and concentrations (a number, or one
+per partner separated by "," or "/", e.g. "1, 0.5").
+
+Next to every CSV a compiled JSON file holds the parsed records and the
+PlateMetadata indexes, with the sha256 of the CSV they were compiled
+from. load_plate_metadata uses it instead of parsing the CSV as long as
+the hashes match.
+
+    python -m apx_opentrons.metadata_compiler           # validate and list differences to the CSVs
+    python -m apx_opentrons.metadata_compiler --write   # write the CSVs (if unchanged or --force) and compiled files
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import io
+import json
+import re
+import zipfile
+from pathlib import Path
+from typing import Optional
+from xml.etree.ElementTree import iterparse
+
+from .plate_metadata import PlateMetadata
+
+REPOSITORY_ROOT = Path(__file__).resolve().parent.parent
+METADATA_DIRS = ("OVP/metadata", "Frankfurt_Melanoma/metadata")
+
+SHEET_NAMESPACE = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+RELATIONSHIP_NAMESPACE = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+SKIPPED_SHEETS = ("merged",)
+
+# rows and columns of the plates, by the start of the workbook name
+PLATE_SIZES = {"drug_plate": (8, 12), "plate": (16, 24)}
+LAYOUT_COLUMNS = ("well", "row", "col", "sample", "sample_name", "experimental_unit",
+                  "condition", "replicate")
+# columns of a new CSV after the layout columns
+DEFAULT_COLUMNS = ("exclude_from_randomization", "combination", "final_concentration_uM",
+                   "drug_panel")
+COMPILED_FORMAT = 1
+
+LAYOUT_NAME = re.compile(r"^(?P<prefix>.*)layout_(?P<tag>.*?)v?(?P<version>\d+(?:\.\d+)*)\.xlsx$")
+CONCENTRATION_SEPARATOR = re.compile(r"\s*[,/]\s*")
+
+# values a CSV holds on purpose instead of its workbook's, by CSV path:
+# (well, column) -> (CSV value, workbook value)
+ACCEPTED_DIFFERENCES = {
+    "OVP/metadata/plate_metadata_v2.0.csv": {
+        # the protocols exclude the elution controls by this name
+        **{(well, "experimental_unit"): ("elution_control", "elution_ctrl")
+           for well in ("C02", "E02", "G02", "I02")},
+        # these wells take the high staurosporine combination and keep
+        # their place when the layout is randomized
+        **{(well, column): values
+           for well in ("D12", "I13", "L12")
+           for column, values in (
+               ("condition", ("Staurosporine (high) + Etoposide",
+                              "Staurosporine (low) + Etoposide")),
+               ("exclude_from_randomization", ("True", "False")),
+               ("final_concentration_uM", ("1, 0.5", "0.2, 0.5")))},
+    },
+}
+
+
+def csv_path_for(xlsx_path: Path) -> Path:
+    """e.g. plate_layout_v2.0.xlsx -> plate_metadata_v2.0.csv"""
+    match = LAYOUT_NAME.match(xlsx_path.name)
+    if match is None:
+        raise ValueError(f"{xlsx_path.name} is not named like <plate>_layout_<version>.xlsx")
+    return xlsx_path.with_name(f"{match['prefix']}metadata_{match['tag']}v{match['version']}.csv")
+
+
+def compiled_path_for(csv_path: Path) -> Path:
+    return Path(csv_path).with_suffix(".json")
+
+
+def _cell_text(element, shared_strings: list[str]) -> Optional[str]:
+    kind = element.get("t")
+    if kind == "inlineStr":
+        return "".join(text.text or "" for text in element.iter(f"{SHEET_NAMESPACE}t"))
+    value = element.find(f"{SHEET_NAMESPACE}v")
+    if value is None or value.text is None:
+        return None
+    if kind == "s":
+        return shared_strings[int(value.text)]
+    return value.text
+
+
+def _shared_strings(workbook: zipfile.ZipFile) -> list[str]:
+    if "xl/sharedStrings.xml" not in workbook.namelist():
+        return []
+    strings = []
+    with workbook.open("xl/sharedStrings.xml") as stream:
+        for _, element in iterparse(stream):
+            if element.tag == f"{SHEET_NAMESPACE}si":
+                strings.append("".join(text.text or ""
+                                       for text in element.iter(f"{SHEET_NAMESPACE}t")))
+                element.clear()
+    return strings
+
+
+def read_sheets(path) -> dict[str, dict[str, str]]:
+    """Cell texts by reference (e.g. "B2") of every sheet of a workbook."""
+    with zipfile.ZipFile(path) as workbook:
+        shared_strings = _shared_strings(workbook)
+        with workbook.open("xl/_rels/workbook.xml.rels") as stream:
+            targets = {element.get("Id"): element.get("Target")
+                       for _, element in iterparse(stream) if element.get("Id")}
+        with workbook.open("xl/workbook.xml") as stream:
+            sheets = [(element.get("name"), targets[element.get(f"{RELATIONSHIP_NAMESPACE}id")])
+                      for _, element in iterparse(stream)
+                      if element.tag == f"{SHEET_NAMESPACE}sheet"]
+
+        cells = {}
+        for name, target in sheets:
+            target = target.lstrip("/")
+            cells[name] = {}
+            with workbook.open(target if target.startswith("xl/") else f"xl/{target}") as stream:
+                for _, element in iterparse(stream):
+                    if element.tag == f"{SHEET_NAMESPACE}c":
+                        text = _cell_text(element, shared_strings)
+                        if text not in (None, ""):
+                            cells[name][element.get("r")] = text
+                        element.clear()
+    return cells
+
+
+def _split_reference(reference: str) -> tuple[str, int]:
+    match = re.fullmatch(r"([A-Z]+)(\d+)", reference)
+    return match[1], int(match[2])
+
+
+def sheet_wells(cells: dict[str, str]) -> tuple[dict[tuple[str, int], str], list[str]]:
+    """Values by (row letter, column number) of a sheet drawn as a plate,
+    and the problems found."""
+    columns, rows, problems = {}, {}, []
+    for reference, text in cells.items():
+        letters, number = _split_reference(reference)
+        if number == 1 and letters != "A":
+            columns[letters] = text
+        elif letters == "A" and number != 1:
+            rows[number] = text
+    for labels, kind in ((columns.values(), "column"), (rows.values(), "row")):
+        repeated = sorted({label for label in labels if list(labels).count(label) > 1})
+        if repeated:
+            problems.append(f"{kind} {', '.join(repeated)} drawn twice")
+
+    values = {}
+    for reference, text in cells.items():
+        letters, number = _split_reference(reference)
+        if number == 1 or letters == "A":
+            continue
+        if letters not in columns or number not in rows:
+            problems.append(f"{reference} ({text}) is outside the plate drawing")
+            continue
+        try:
+            well = (rows[number].strip().upper(), int(float(columns[letters])))
+        except ValueError:
+            problems.append(f"{reference}: column {columns[letters]} is not a number")
+            continue
+        if well in values:
+            problems.append(f"well {well[0]}{well[1]} drawn twice")
+        values[well] = text.strip()
+    return values, problems
+
+
+def read_layout(path) -> tuple[dict[str, dict[tuple[str, int], str]], list[str]]:
+    """Values of every metadata column by well, and the problems found."""
+    layers, problems = {}, []
+    for name, cells in read_sheets(path).items():
+        if name in SKIPPED_SHEETS:
+            continue
+        values, sheet_problems = sheet_wells(cells)
+        layers[name] = values
+        problems += [f"sheet {name}: {problem}" for problem in sheet_problems]
+    return layers, problems
+
+
+def read_csv_rows(path) -> tuple[list[str], list[dict]]:
+    with open(path, newline="", encoding="utf-8-sig") as file:
+        reader = csv.DictReader(file)
+        return list(reader.fieldnames), list(reader)
+
+
+def combination_partners(condition: str) -> list[str]:
+    return condition.split(" + ")
+
+
+def check_condition(condition: str) -> Optional[str]:
+    if "+" not in condition:
+        return None
+    partners = combination_partners(condition)
+    if len(partners) < 2 or any(partner != partner.strip() or not partner
+                                for partner in partners):
+        return f'combination "{condition}" is not written as "A + B"'
+    return None
+
+
+def check_concentration(condition: str, text: str) -> Optional[str]:
+    if text == "":
+        return None
+    values = CONCENTRATION_SEPARATOR.split(text.strip())
+    for value in values:
+        try:
+            float(value)
+        except ValueError:
+            return f'concentration "{text}" of {condition} is not a number or a list of numbers'
+    n_partners = len(combination_partners(condition)) if "+" in condition else 1
+    if len(values) not in (1, n_partners) or (n_partners == 1 and len(values) != 1):
+        return (f'{len(values)} concentrations "{text}" for the {n_partners} '
+                f"drug(s) of {condition}")
+    return None
+
+
+def compile_layout(xlsx_path,
+                   plate_size: Optional[tuple[int, int]] = None,
+                   annotations: Optional[tuple[list[str], list[dict]]] = None,
+                   ) -> tuple[list[str], list[dict], list[str]]:
+    """CSV columns and rows of a layout workbook, and the problems found.
+
+    annotations are the columns and rows of the current CSV, which give the
+    columns that are not drawn in the workbook, by condition.
+    """
+    xlsx_path = Path(xlsx_path)
+    if plate_size is None:
+        plate_size = PLATE_SIZES["drug_plate" if xlsx_path.name.startswith("drug_plate")
+                                 else "plate"]
+    layers, problems = read_layout(xlsx_path)
+    if "condition" not in layers:
+        return [], [], problems + ["no condition sheet"]
+    sample_column = next((name for name in ("sample_name", "sample") if name in layers),
+                         None)
+
+    wells = sorted(set().union(*(set(values) for values in layers.values())))
+    n_rows, n_columns = plate_size
+    for row, column in wells:
+        if not (len(row) == 1 and "A" <= row < chr(ord("A") + n_rows)
+                and 1 <= column <= n_columns):
+            problems.append(f"well {row}{column} is not on a {n_rows * n_columns}-well plate")
+    for name, values in layers.items():
+        missing = [f"{row}{column}" for row, column in wells if (row, column) not in values]
+        if missing:
+            problems.append(f"sheet {name}: no value for {', '.join(missing[:5])}"
+                            + (", ..." if len(missing) > 5 else ""))
+
+    fieldnames, annotation_rows = annotations or ([], [])
+    if not fieldnames:
+        fieldnames = ["well", "row", "col"] + [column for column in LAYOUT_COLUMNS
+                                               if column in layers] + list(DEFAULT_COLUMNS)
+    extra = [column for column in fieldnames
+             if column not in LAYOUT_COLUMNS and column != "combination"]
+    by_condition: dict = {}
+    for row in annotation_rows:
+        for column in extra:
+            by_condition.setdefault((column, row["condition"], row.get(sample_column)),
+                                    row[column])
+            by_condition.setdefault((column, row["condition"], None), row[column])
+
+    rows, unannotated = [], set()
+    for row, column in wells:
+        record = {"well": f"{row}{column:02d}", "row": row, "col": str(column)}
+        for name, values in layers.items():
+            record[name] = values.get((row, column), "")
+        condition = record["condition"]
+        record["combination"] = str(" + " in condition)
+        for name in extra:
+            value = by_condition.get((name, condition, record.get(sample_column)),
+                                     by_condition.get((name, condition, None)))
+            if value is None:
+                unannotated.add(condition)
+                value = ""
+            record[name] = value
+        rows.append({name: record.get(name, "") for name in fieldnames})
+
+    if unannotated and annotation_rows:
+        problems.append(f"no annotations in the CSV for {', '.join(sorted(unannotated))}")
+    for condition in sorted({row["condition"] for row in rows}):
+        problem = check_condition(condition)
+        if problem:
+            problems.append(problem)
+    if "final_concentration_uM" in fieldnames:
+        for condition, text in sorted({(row["condition"], row["final_concentration_uM"])
+                                       for row in rows}):
+            problem = check_concentration(condition, text)
+            if problem:
+                problems.append(problem)
+    for row in rows:
+        if not row.get("replicate", "1").isdigit():
+            problems.append(f"well {row['well']}: replicate {row['replicate']} is not a number")
+    return fieldnames, rows, problems
+
+
+def differences(old_rows: list[dict], new_rows: list[dict], limit: int = 5) -> list[str]:
+    """Changed, added and removed wells between two versions of a CSV."""
+    old = {row["well"]: row for row in old_rows}
+    new = {row["well"]: row for row in new_rows}
+    lines = []
+    for well in sorted(set(old) - set(new)):
+        lines.append(f"{well} removed")
+    for well in sorted(set(new) - set(old)):
+        lines.append(f"{well} added")
+    for well in sorted(set(old) & set(new)):
+        for column, value in new[well].items():
+            if old[well].get(column) != value:
+                lines.append(f"{well} {column}: {old[well].get(column)!r} -> {value!r}")
+    if len(lines) > limit:
+        lines = lines[:limit] + [f"... {len(lines) - limit} more"]
+    return lines
+
+
+def accept_differences(csv_path, rows: list[dict]) -> tuple[list[dict], int]:
+    """Rows with the ACCEPTED_DIFFERENCES of csv_path applied, and how many
+    were found. A value is only replaced if the workbook still has the
+    recorded one."""
+    try:
+        name = Path(csv_path).resolve().relative_to(REPOSITORY_ROOT).as_posix()
+    except ValueError:
+        return rows, 0
+    accepted = ACCEPTED_DIFFERENCES.get(name, {})
+    n_accepted = 0
+    result = []
+    for row in rows:
+        row = dict(row)
+        for column, value in row.items():
+            csv_value, workbook_value = accepted.get((row["well"], column), (None, None))
+            if value == workbook_value:
+                row[column] = csv_value
+                n_accepted += 1
+        result.append(row)
+    return result, n_accepted
+
+
+def csv_text(fieldnames: list[str], rows: list[dict]) -> str:
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=fieldnames, lineterminator="\n")
+    writer.writeheader()
+    writer.writerows(rows)
+    return output.getvalue()
+
+
+def compile_metadata(csv_path) -> dict:
+    """Compiled form of a metadata CSV: parsed records, indexes and the
+    hash of the CSV."""
+    # metadata_resolver loads the compiled files through this module
+    from .metadata_resolver import file_hash
+
+    metadata = PlateMetadata.read_csv(csv_path)
+    return {"format": COMPILED_FORMAT,
+            "sha256": file_hash(csv_path),
+            **metadata.indexes()}
+
+
+def write_compiled(csv_path) -> Path:
+    path = compiled_path_for(csv_path)
+    path.write_text(json.dumps(compile_metadata(csv_path), separators=(",", ":")) + "\n")
+    return path
+
+
+def load_compiled(csv_path, digest: str) -> Optional[PlateMetadata]:
+    """PlateMetadata from the compiled file of csv_path, None if there is
+    none or it was compiled from a different CSV."""
+    try:
+        data = json.loads(compiled_path_for(csv_path).read_text())
+    except (OSError, ValueError):
+        return None
+    if data.get("format") != COMPILED_FORMAT or data.get("sha256") != digest:
+        return None
+    return PlateMetadata.from_indexes(data)
+
+
+def layout_files(paths=None) -> list[Path]:
+    if paths:
+        return [Path(path) for path in paths]
+    return sorted(path for directory in METADATA_DIRS
+                  for path in (REPOSITORY_ROOT / directory).glob("*layout*.xlsx"))
+
+
+def main(argv=None):
+    from .metadata_resolver import file_hash, update_manifest
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("layouts", nargs="*", help="layout workbooks (default: all)")
+    parser.add_argument("--write", action="store_true",
+                        help="write the CSVs and compiled files")
+    parser.add_argument("--force", action="store_true",
+                        help="also overwrite CSVs whose layout differs from the workbook")
+    args = parser.parse_args(argv)
+
+    failed, rewritten = False, False
+    for xlsx_path in layout_files(args.layouts):
+        csv_path = csv_path_for(xlsx_path)
+        annotations = read_csv_rows(csv_path) if csv_path.exists() else None
+        fieldnames, rows, problems = compile_layout(xlsx_path, annotations=annotations)
+        print(f"{xlsx_path.name} -> {csv_path.name}: {len(rows)} wells")
+        for problem in problems:
+            print(f"    ERROR: {problem}")
+        if problems:
+            failed = True
+            continue
+
+        rows, n_accepted = accept_differences(csv_path, rows)
+        if n_accepted:
+            print(f"    {n_accepted} accepted differences (see ACCEPTED_DIFFERENCES)")
+        changes = differences(annotations[1], rows) if annotations else ["new file"]
+        for change in changes:
+            print(f"    {change}")
+        if args.write and (not annotations or not changes or args.force):
+            text = csv_text(fieldnames, rows)
+            if not csv_path.exists() or csv_path.read_text(encoding="utf-8") != text:
+                csv_path.write_text(text, encoding="utf-8")
+                rewritten = True
+                print(f"    wrote {csv_path.name}")
+        elif changes:
+            failed = True
+            print("    the CSV differs from the workbook, update the workbook or write "
+                  "with --force")
+        if args.write:
+            print(f"    wrote {write_compiled(csv_path).name}")
+        elif load_compiled(csv_path, file_hash(csv_path)) is None:
+            failed = True
+            print(f"    {compiled_path_for(csv_path).name} is missing or out of date")
+
+    if rewritten:
+        for entry in update_manifest():
+            print(f"updated the manifest hash of {entry.project}/{entry.name} {entry.version}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
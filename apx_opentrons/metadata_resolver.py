@@ -0,0 +1,200 @@
+"""Find and load plate metadata by project, name and version.
+
+Protocols ask for e.g. ("OVP", "plate_metadata", "2.0") instead of a
+hardcoded Windows or robot path. The versions and the sha256 of their
+files are listed in metadata_manifest.json next to this module. The file
+is looked for in every root of the search path, in the repository layout
+(<root>/OVP/metadata/<file>), the robot layout (<root>/OVP/<file>) and
+the flat layout older protocols used (<root>/<file>). Files whose content
+does not match the manifest are skipped, so a stale copy on the robot is
+reported instead of silently used.
+
+Files with a current compiled form next to them (see
+metadata_compiler.py) are loaded from it. Other files are parsed and
+cached by content hash, in memory and as JSON in the cache directory, so
+the laptop and the robot load the same layout and unchanged files are
+not parsed again.
+
+    python -m apx_opentrons.metadata_resolver             # list versions and where they resolve
+    python -m apx_opentrons.metadata_resolver --update    # refresh the hashes after editing a file
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from .metadata_compiler import load_compiled
+from .plate_metadata import PlateMetadata
+
+REPOSITORY_ROOT = Path(__file__).resolve().parent.parent
+MANIFEST_PATH = Path(__file__).with_name("metadata_manifest.json")
+
+# extra roots (separated by os.pathsep) are searched before the defaults
+SEARCH_PATH_VARIABLE = "APX_METADATA_PATH"
+DEFAULT_ROOTS = (REPOSITORY_ROOT,
+                 Path("/data/user_storage/apricot_data"),
+                 Path(r"C:\Users\OT-Operator\Documents\OT-2_protocols\APx_opentrons_resources"))
+
+CACHE_DIR_VARIABLE = "APX_METADATA_CACHE"
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "apx_opentrons" / "metadata"
+
+# parsed records by sha256 of the file content
+_parsed: dict[str, list[dict]] = {}
+
+
+class MetadataEntry(NamedTuple):
+    project: str
+    name: str
+    version: str
+    file: str
+    sha256: Optional[str] = None
+
+
+def search_path() -> list[Path]:
+    roots = [Path(root) for root in os.environ.get(SEARCH_PATH_VARIABLE, "").split(os.pathsep)
+             if root]
+    roots.extend(DEFAULT_ROOTS)
+    return list(dict.fromkeys(roots))
+
+
+def load_manifest(path: Path = MANIFEST_PATH) -> dict:
+    return json.loads(Path(path).read_text())
+
+
+def manifest_entries(manifest: Optional[dict] = None) -> list[MetadataEntry]:
+    manifest = load_manifest() if manifest is None else manifest
+    return [MetadataEntry(project, name, version, entry["file"], entry.get("sha256"))
+            for project, names in manifest.items()
+            for name, versions in names.items()
+            for version, entry in versions.items()]
+
+
+def manifest_entry(project: str, name: str, version: str,
+                   manifest: Optional[dict] = None) -> MetadataEntry:
+    manifest = load_manifest() if manifest is None else manifest
+    versions = manifest.get(project, {}).get(name)
+    if versions is None:
+        known = [f"{entry.project}/{entry.name}" for entry in manifest_entries(manifest)]
+        raise ValueError(f"unknown metadata {project}/{name}, "
+                         f"choose from {sorted(set(known))}")
+    if version not in versions:
+        raise ValueError(f"unknown version {version} of {project}/{name}, "
+                         f"choose from {sorted(versions)}")
+    entry = versions[version]
+    return MetadataEntry(project, name, version, entry["file"], entry.get("sha256"))
+
+
+def file_hash(path: Path) -> str:
+    # line endings differ between Windows checkouts and the robot
+    content = Path(path).read_bytes().replace(b"\r\n", b"\n")
+    return hashlib.sha256(content).hexdigest()
+
+
+def candidate_paths(entry: MetadataEntry, roots=None) -> list[Path]:
+    roots = search_path() if roots is None else roots
+    return [path
+            for root in roots
+            for path in (Path(root) / entry.project / "metadata" / entry.file,
+                         Path(root) / entry.project / entry.file,
+                         Path(root) / entry.file)]
+
+
+def resolve_metadata(project: str, name: str, version: str, roots=None,
+                     manifest: Optional[dict] = None) -> Path:
+    """Path of the first file on the search path that matches the manifest."""
+    entry = manifest_entry(project, name, version, manifest)
+    candidates = candidate_paths(entry, roots)
+    mismatched = []
+    for path in candidates:
+        if not path.is_file():
+            continue
+        if entry.sha256 is None or file_hash(path) == entry.sha256:
+            return path
+        mismatched.append(path)
+
+    if mismatched:
+        raise ValueError(f"{mismatched[0]} does not match version {version} of "
+                         f"{project}/{name} in the manifest; copy the current file "
+                         f"(and the apx_opentrons package) to this machine")
+    raise FileNotFoundError(f"{entry.file} not found, searched "
+                            f"{', '.join(str(path) for path in candidates)}")
+
+
+def _cache_dir(cache_dir) -> Path:
+    if cache_dir is not None:
+        return Path(cache_dir)
+    return Path(os.environ.get(CACHE_DIR_VARIABLE, DEFAULT_CACHE_DIR))
+
+
+def load_plate_metadata(project: str, name: str, version: str, roots=None,
+                        cache_dir=None) -> PlateMetadata:
+    """Load a metadata file by project, name and version, see module docs."""
+    path = resolve_metadata(project, name, version, roots)
+    digest = file_hash(path)
+    if digest in _parsed:
+        return PlateMetadata(_parsed[digest])
+
+    # compiled next to the CSV by metadata_compiler, already indexed
+    metadata = load_compiled(path, digest)
+    if metadata is not None:
+        _parsed[digest] = metadata.records
+        return metadata
+
+    cache_path = _cache_dir(cache_dir) / f"{digest}.json"
+    try:
+        records = json.loads(cache_path.read_text())
+    except (OSError, ValueError):
+        records = PlateMetadata.read_csv(path).records
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            cache_path.write_text(json.dumps(records))
+        except OSError:
+            # e.g. a read-only home directory, parsing again is cheap enough
+            pass
+
+    _parsed[digest] = records
+    return PlateMetadata(records)
+
+
+def update_manifest(path: Path = MANIFEST_PATH,
+                    root: Path = REPOSITORY_ROOT) -> list[MetadataEntry]:
+    """Set the hashes in the manifest to the files in the repository."""
+    manifest = load_manifest(path)
+    changed = []
+    for entry in manifest_entries(manifest):
+        digest = file_hash(root / entry.project / "metadata" / entry.file)
+        if digest != entry.sha256:
+            manifest[entry.project][entry.name][entry.version]["sha256"] = digest
+            changed.append(entry)
+    Path(path).write_text(json.dumps(manifest, indent=2) + "\n")
+    return changed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--update", action="store_true",
+                        help="refresh the hashes in the manifest from the repository files")
+    args = parser.parse_args(argv)
+
+    if args.update:
+        for entry in update_manifest():
+            print(f"updated {entry.project}/{entry.name} {entry.version}")
+        return 0
+
+    failed = False
+    for entry in manifest_entries():
+        try:
+            location = str(resolve_metadata(entry.project, entry.name, entry.version))
+        except (FileNotFoundError, ValueError) as error:
+            location = f"ERROR: {error}"
+            failed = True
+        print(f"{entry.project}/{entry.name} {entry.version}: {location}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
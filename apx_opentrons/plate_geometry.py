@@ -0,0 +1,87 @@
+"""Well addresses of 96- and 384-well plates and the 8-channel head on them.
+
+A 384-well plate is four interleaved 96-well grids (quadrants). Quadrant
+(row offset, column offset) holds the 96-well position (r, c) at 384-well
+row 2r + row offset and column 2c + column offset, e.g. quadrant (1, 0)
+of "A1" is "B1". An 8-channel pipette spans every other row of a 384-well
+plate, so a head position is named after the well of its first channel,
+"A<col>" or "B<col>", and reaches the wells of one quadrant row in that
+column.
+
+All maps are built once at import, so protocols look up head positions
+instead of rebuilding them from row letters for every column.
+"""
+from __future__ import annotations
+
+from typing import Iterable
+
+ROWS_96 = "ABCDEFGH"
+ROWS_384 = "ABCDEFGHIJKLMNOP"
+N_COLUMNS_96 = 12
+N_COLUMNS_384 = 24
+N_CHANNELS = 8
+
+# (row offset, column offset) of the 96-well grids in a 384-well plate
+QUADRANTS = ((0, 0), (0, 1), (1, 0), (1, 1))
+
+
+def split_well(well: str) -> tuple[str, int]:
+    """("C", 3) for "C3"."""
+    return well[0], int(well[1:])
+
+
+# 96-well position and quadrant -> 384-well address, and back
+WELL_96_TO_384 = {
+    (f"{row}{column}", quadrant): f"{ROWS_384[2*r + quadrant[0]]}{2*(column - 1) + quadrant[1] + 1}"
+    for r, row in enumerate(ROWS_96)
+    for column in range(1, N_COLUMNS_96 + 1)
+    for quadrant in QUADRANTS
+}
+WELL_384_TO_96 = {well_384: key for key, well_384 in WELL_96_TO_384.items()}
+
+# 8-channel head position -> wells of channels 1..8, and well -> (head, channel)
+HEAD_WELLS_96 = {
+    f"A{column}": tuple(f"{row}{column}" for row in ROWS_96)
+    for column in range(1, N_COLUMNS_96 + 1)
+}
+HEAD_WELLS_384 = {
+    f"{start_row}{column}": tuple(f"{ROWS_384[offset + 2*k]}{column}" for k in range(N_CHANNELS))
+    for offset, start_row in enumerate(ROWS_384[:2])
+    for column in range(1, N_COLUMNS_384 + 1)
+}
+WELL_TO_HEAD_384 = {
+    well: (head, channel)
+    for head, wells in HEAD_WELLS_384.items()
+    for channel, well in enumerate(wells)
+}
+
+
+def well_384(well_96: str, quadrant: tuple[int, int]) -> str:
+    return WELL_96_TO_384[(well_96, quadrant)]
+
+
+def well_96(well_384: str) -> tuple[str, tuple[int, int]]:
+    """96-well position and quadrant of a 384-well address."""
+    return WELL_384_TO_96[well_384]
+
+
+def head_position(well: str) -> tuple[str, int]:
+    """Head position (well of channel 1) that reaches a 384-well address,
+    and the channel (0-7) that lands in it."""
+    return WELL_TO_HEAD_384[well]
+
+
+def head_wells(head: str, plate_size: int = 384) -> tuple[str, ...]:
+    """Wells reached by the channels of a head position, channel 1 first."""
+    return (HEAD_WELLS_384 if plate_size == 384 else HEAD_WELLS_96)[head]
+
+
+def multichannel_targets(occupied: Iterable[str]) -> list[str]:
+    """Head positions on a 384-well plate that cover all occupied wells.
+
+    Every head position with at least one channel in an occupied well is
+    returned once, in column order and row A before B, ready to be used
+    as the destinations of an 8-channel distribution.
+    """
+    heads = {WELL_TO_HEAD_384[well][0] for well in occupied}
+    return sorted(heads, key=lambda head: (split_well(head)[1], head[0]))
@@ -0,0 +1,136 @@
+"""Plate metadata (one row per well) with precomputed lookups.
+
+The metadata CSVs in OVP/metadata and Frankfurt_Melanoma/metadata are read
+once and indexed by well, condition, experimental unit and drug tier, so
+protocols look up wells instead of filtering a table for every condition.
+Well names follow opentrons ("C3", not "C03").
+
+Files are parsed with the csv module only: importing pandas takes several
+seconds on the OT-2's Raspberry Pi and runs again every time the app
+analyzes a protocol (see import_benchmark.py).
+"""
+from __future__ import annotations
+
+import csv
+from typing import Iterable, Optional
+
+
+def well_name(record: dict) -> str:
+    """Opentrons name of the well in a metadata row, e.g. "C3"."""
+    return f"{record['row']}{int(record['col'])}"
+
+
+def parse_value(text: str):
+    """Convert a CSV field like pandas would: numbers, True/False and
+    empty fields (None)."""
+    if text == "":
+        return None
+    if text in ("True", "False"):
+        return text == "True"
+    for convert in (int, float):
+        try:
+            return convert(text)
+        except ValueError:
+            pass
+    return text
+
+
+def _index(records: list[dict], *columns: str) -> dict:
+    index = {}
+    if records and all(column in records[0] for column in columns):
+        for record in records:
+            key = tuple(record[column] for column in columns)
+            index.setdefault(key[0] if len(columns) == 1 else key, []).append(
+                well_name(record))
+    return index
+
+
+class PlateMetadata:
+    """Rows of a plate metadata file in file order.
+
+    Filtering returns a new, re-indexed PlateMetadata, so the indexes
+    always describe the selected wells only.
+    """
+
+    def __init__(self, records: Iterable[dict]):
+        self.records = list(records)
+        self._by_well = {well_name(record): record for record in self.records}
+        self._condition_wells = _index(self.records, "condition")
+        self._unit_wells = _index(self.records, "experimental_unit")
+        self._source_wells = _index(self.records, "condition", "sample")
+
+    @classmethod
+    def read_csv(cls, path) -> "PlateMetadata":
+        with open(path, newline="", encoding="utf-8-sig") as file:
+            return cls({column: parse_value(text) for column, text in row.items()}
+                       for row in csv.DictReader(file))
+
+    def indexes(self) -> dict:
+        """Records and lookups as JSON data (keys as [key, wells] pairs), see
+        from_indexes."""
+        return {"records": self.records,
+                "condition_wells": list(map(list, self._condition_wells.items())),
+                "unit_wells": list(map(list, self._unit_wells.items())),
+                "source_wells": [[condition, sample, wells] for (condition, sample), wells
+                                 in self._source_wells.items()]}
+
+    @classmethod
+    def from_indexes(cls, data: dict) -> "PlateMetadata":
+        """PlateMetadata from indexes() without indexing the records again."""
+        metadata = cls.__new__(cls)
+        metadata.records = data["records"]
+        metadata._by_well = {well_name(record): record for record in metadata.records}
+        metadata._condition_wells = {key: wells for key, wells in data["condition_wells"]}
+        metadata._unit_wells = {key: wells for key, wells in data["unit_wells"]}
+        metadata._source_wells = {(condition, sample): wells
+                                  for condition, sample, wells in data["source_wells"]}
+        return metadata
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __contains__(self, well: str) -> bool:
+        return well in self._by_well
+
+    def __getitem__(self, well: str) -> dict:
+        return self._by_well[well]
+
+    @property
+    def wells(self) -> list[str]:
+        return list(self._by_well)
+
+    def values(self, column: str) -> list:
+        """Unique values of a column in order of appearance."""
+        return list(dict.fromkeys(record[column] for record in self.records))
+
+    def columns(self) -> list[int]:
+        """Plate columns used, in order of appearance."""
+        return [int(col) for col in self.values("col")]
+
+    def select(self, column: str, *values) -> "PlateMetadata":
+        """Rows whose column has one of the values."""
+        return PlateMetadata(record for record in self.records
+                             if record[column] in values)
+
+    def exclude(self, column: str, *values) -> "PlateMetadata":
+        """Rows whose column has none of the values."""
+        return PlateMetadata(record for record in self.records
+                             if record[column] not in values)
+
+    def condition_wells(self, condition: str) -> list[str]:
+        return list(self._condition_wells.get(condition, []))
+
+    def unit_wells(self, experimental_unit: str) -> list[str]:
+        return list(self._unit_wells.get(experimental_unit, []))
+
+    def source_well(self, condition: str, tiers: Iterable[str]) -> Optional[str]:
+        """Drug plate well of a condition in the first of the given tiers
+        (sample column, e.g. "1000x" or "2000x") that has one."""
+        for tier in tiers:
+            wells = self._source_wells.get((condition, tier))
+            if wells:
+                return wells[0]
+        return None
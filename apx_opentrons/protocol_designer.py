@@ -0,0 +1,270 @@
+"""Read Protocol Designer (schema 8) JSON protocols as liquid_handling plans.
+
+The aspirate height tests in OVP/height_tests and
+Frankfurt_Melanoma/height_tests were built in the Protocol Designer. Their
+commands are converted into the same Plan/Step objects the Python
+protocols use, one plan per pipette, with locations that carry deck
+coordinates computed from the labware definitions embedded in the file.
+The plans can then be validated and timed like any other plan (see
+timing.py), e.g.
+
+    python -m apx_opentrons.protocol_designer OVP/height_tests/*.json
+
+The test settings only exist in the file names
+(ASPIRATE_TEST_300multichannel_30uLresidual_2.7MM) and the measured
+residual volumes in "OT2 notes.txt"; both are read as well.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from .liquid_handling import Plan
+from .timing import TimingModel
+
+REPOSITORY_ROOT = Path(__file__).resolve().parent.parent
+HEIGHT_TEST_GLOBS = ("OVP/height_tests/*.json", "Frankfurt_Melanoma/height_tests/*.json")
+NOTES_FILE = "OT2 notes.txt"
+
+# (min volume, max volume, default aspirate/dispense flow rate in ul/s)
+PIPETTES = {
+    "p300_multi_gen2": (20, 300, 94.0),
+    "p300_single_gen2": (20, 300, 92.86),
+    "p20_multi_gen2": (1, 20, 7.6),
+    "p20_single_gen2": (1, 20, 7.56),
+}
+
+SLOT_SIZE = (132.5, 90.5)
+# the fixed trash in slot 12, roughly where tips are dropped
+FIXED_TRASH = (265 + 64, 271.5 + 43, 82.0)
+
+# setup commands without a pipetting step
+SETUP_COMMANDS = {"loadPipette", "loadLabware", "loadLiquid", "loadModule",
+                  "configureForVolume", "moveToAddressableAreaForDropTip"}
+
+
+class Point(NamedTuple):
+    x: float
+    y: float
+    z: float
+
+
+class DesignerLocation(NamedTuple):
+    """A well (or deck area) of a Protocol Designer protocol, with the deck
+    coordinates the pipette moves to."""
+    name: str
+    point: Point
+
+
+@dataclass
+class DesignerProtocol:
+    path: Path
+    name: str
+    pipettes: dict = field(default_factory=dict)
+    plans: dict = field(default_factory=dict)
+
+    @property
+    def test_settings(self) -> Optional[tuple[float, float]]:
+        """(residual volume in ul, aspirate height in mm) from the name of
+        a height test, None for other protocols."""
+        return height_test_settings(self.name)
+
+    def timing(self, mount: str) -> TimingModel:
+        flow_rate = PIPETTES[self.pipettes[mount]][2]
+        return TimingModel(aspirate_flow_rate=flow_rate, dispense_flow_rate=flow_rate,
+                           blow_out_flow_rate=flow_rate)
+
+
+def height_test_settings(name: str) -> Optional[tuple[float, float]]:
+    match = re.search(r"(\d+(?:\.\d+)?)uLresidual_(\d+(?:\.\d+)?)MM", name)
+    if match is None:
+        return None
+    return float(match.group(1)), float(match.group(2))
+
+
+def read_height_notes(path) -> dict[float, tuple[float, float]]:
+    """Measured residual volume range (ul) by aspirate height (mm) from
+    lines like "At 3.2mm residual volume is 25-30 ul." """
+    notes = {}
+    for line in Path(path).read_text(encoding="utf-8", errors="replace").splitlines():
+        match = re.match(r"At (\d+(?:\.\d+)?)\s*mm residual volume is "
+                         r"(\d+(?:\.\d+)?)\s*-\s*(\d+(?:\.\d+)?)\s*ul", line.strip())
+        if match:
+            height, low, high = (float(value) for value in match.groups())
+            notes[height] = (low, high)
+    return notes
+
+
+def _slot_origin(slot_name: str) -> Point:
+    index = int(slot_name) - 1
+    return Point((index % 3) * SLOT_SIZE[0], (index // 3) * SLOT_SIZE[1], 0.0)
+
+
+class _Deck:
+    """Labware positions of a protocol and well coordinates in them."""
+
+    def __init__(self, protocol: dict):
+        self.definitions = protocol["labwareDefinitions"]
+        self.labware = {}
+
+    def load(self, params: dict) -> None:
+        definition_id = params["labwareId"].split(":", 1)[-1]
+        definition = self.definitions.get(
+            definition_id,
+            self.definitions.get(f"{params['namespace']}/{params['loadName']}/{params['version']}"))
+        slot = params["location"].get("slotName")
+        if definition is None or slot is None:
+            raise ValueError(f"cannot place labware {params['labwareId']} "
+                             f"at {params['location']}")
+        origin = _slot_origin(slot)
+        corner = definition.get("cornerOffsetFromSlot", {})
+        self.labware[params["labwareId"]] = (
+            definition, slot,
+            Point(origin.x + corner.get("x", 0), origin.y + corner.get("y", 0),
+                  origin.z + corner.get("z", 0)))
+
+    def well(self, params: dict) -> DesignerLocation:
+        definition, slot, origin = self.labware[params["labwareId"]]
+        well = definition["wells"][params["wellName"]]
+        well_location = params.get("wellLocation", {})
+        offset = well_location.get("offset", {})
+        z = well["z"] + (well["depth"] if well_location.get("origin", "top") == "top" else 0)
+        return DesignerLocation(
+            f"{slot}/{params['wellName']}",
+            Point(origin.x + well["x"] + offset.get("x", 0),
+                  origin.y + well["y"] + offset.get("y", 0),
+                  origin.z + z + offset.get("z", 0)))
+
+    def tip_volume(self, labware_id: str) -> Optional[float]:
+        definition = self.labware[labware_id][0]
+        return next(iter(definition["wells"].values())).get("totalLiquidVolume")
+
+
+def read_designer_protocol(path) -> DesignerProtocol:
+    """Convert the commands of a Protocol Designer file into one Plan per
+    pipette mount."""
+    path = Path(path)
+    protocol = json.loads(path.read_text(encoding="utf-8"))
+    if protocol.get("schemaVersion") != 8:
+        raise ValueError(f"{path.name}: expected Protocol Designer schema 8, "
+                         f"got {protocol.get('schemaVersion')}")
+
+    result = DesignerProtocol(path=path,
+                              name=protocol["metadata"].get("protocolName") or path.stem)
+    deck = _Deck(protocol)
+    mounts = {}
+    tip_volumes = {}
+    position = {}
+    trash = DesignerLocation("fixedTrash", Point(*FIXED_TRASH))
+
+    for command in protocol["commands"]:
+        kind, params = command["commandType"], command.get("params", {})
+        if kind == "loadPipette":
+            if params["pipetteName"] not in PIPETTES:
+                raise ValueError(f"{path.name}: unknown pipette {params['pipetteName']}")
+            mounts[params["pipetteId"]] = params["mount"]
+            result.pipettes[params["mount"]] = params["pipetteName"]
+            continue
+        if kind == "loadLabware":
+            deck.load(params)
+            continue
+        if kind in SETUP_COMMANDS:
+            continue
+        if kind == "waitForDuration":
+            # not tied to a pipette, the pause belongs to the last used one
+            if position:
+                result.plans[next(reversed(position))].add("delay", seconds=params["seconds"])
+            continue
+
+        mount = mounts[params["pipetteId"]]
+        if mount not in result.plans:
+            result.plans[mount] = Plan(max_volume=PIPETTES[result.pipettes[mount]][1],
+                                       min_volume=PIPETTES[result.pipettes[mount]][0])
+        # keep the last used pipette last for the delays
+        position[mount] = position.pop(mount, None)
+        plan = result.plans[mount]
+        default_flow_rate = PIPETTES[result.pipettes[mount]][2]
+        rate = params.get("flowRate", default_flow_rate) / default_flow_rate
+
+        if kind == "pickUpTip":
+            position[mount] = deck.well(params)
+            tip_volumes[mount] = deck.tip_volume(params["labwareId"])
+            plan.add("pick_up_tip", location=position[mount])
+        elif kind in ("dropTip", "dropTipInPlace"):
+            plan.add("drop_tip", location=deck.well(params) if kind == "dropTip" else trash)
+        elif kind in ("aspirate", "dispense", "blowout", "touchTip", "moveToWell"):
+            position[mount] = deck.well(params)
+            if kind == "aspirate":
+                plan.add("aspirate", location=position[mount], volume=params["volume"], rate=rate)
+            elif kind == "dispense":
+                plan.add("dispense", location=position[mount], volume=params["volume"], rate=rate)
+            elif kind == "blowout":
+                plan.add("blow_out", location=position[mount])
+            elif kind == "touchTip":
+                plan.add("touch_tip", location=position[mount])
+            else:
+                plan.add("move_to", location=position[mount])
+        elif kind in ("aspirateInPlace", "dispenseInPlace", "blowOutInPlace"):
+            action = {"aspirateInPlace": "aspirate", "dispenseInPlace": "dispense",
+                      "blowOutInPlace": "blow_out"}[kind]
+            plan.add(action, location=position[mount], volume=params.get("volume"),
+                     rate=rate)
+        elif kind == "moveToAddressableArea":
+            if params["addressableAreaName"] != "fixedTrash":
+                raise ValueError(f"{path.name}: unsupported deck area "
+                                 f"{params['addressableAreaName']}")
+            position[mount] = trash
+            plan.add("move_to", location=trash)
+        else:
+            raise ValueError(f"{path.name}: unsupported command {kind}")
+
+    for mount, plan in result.plans.items():
+        if tip_volumes.get(mount):
+            plan.max_volume = min(plan.max_volume, tip_volumes[mount])
+        plan.validate()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("files", nargs="*", type=Path,
+                        help="Protocol Designer files (default: all height tests)")
+    args = parser.parse_args(argv)
+
+    files = args.files or [path for pattern in HEIGHT_TEST_GLOBS
+                           for path in sorted(REPOSITORY_ROOT.glob(pattern))]
+    notes = {}
+    for notes_path in REPOSITORY_ROOT.glob(f"*/{NOTES_FILE}"):
+        notes.update(read_height_notes(notes_path))
+
+    failed = False
+    for path in files:
+        try:
+            protocol = read_designer_protocol(path)
+        except (ValueError, KeyError) as error:
+            print(f"{path}: {error}")
+            failed = True
+            continue
+        settings = protocol.test_settings
+        summary = ""
+        if settings is not None:
+            residual, height = settings
+            measured = notes.get(height)
+            summary = (f"  {residual:g} ul residual at {height:g} mm"
+                       + (f", measured {measured[0]:g}-{measured[1]:g} ul" if measured else ""))
+        print(f"{os.path.relpath(path)}{summary}")
+        for mount, plan in protocol.plans.items():
+            aspirated = sum(step.volume for step in plan.steps if step.action == "aspirate")
+            print(f"    {mount} {protocol.pipettes[mount]}: {plan.n_tips} tips, "
+                  f"{plan.n_aspirations} aspirations ({aspirated:g} ul), "
+                  f"~{plan.estimated_seconds(protocol.timing(mount)):.0f} s")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,211 @@
+"""Copy the metadata and the apx_opentrons package to the OT-2, changed
+files only.
+
+The local files (OVP/metadata, Frankfurt_Melanoma/metadata and the
+package, see SYNCED_TREES) are hashed and compared with the manifest the
+last sync left on the robot (SYNC_MANIFEST in the robot root). The files
+whose hash differs are sent as one tar archive over a single ssh
+connection and unpacked in the repository layout (<root>/OVP/metadata/
+...), where load_plate_metadata finds them. The new manifest is the last
+member of the archive, so an interrupted sync is repeated next time.
+
+    python -m apx_opentrons.robot_sync              # list what would be copied
+    python -m apx_opentrons.robot_sync --push       # copy it
+    python -m apx_opentrons.robot_sync --push --verify
+
+--verify hashes the files on the robot instead of trusting the manifest,
+e.g. after copying files by hand. Instead of the robot, --target syncs to
+a local directory, and --ssh replaces the ssh command, e.g. --ssh "sh -c"
+runs the remote commands in a local shell.
+
+This replaces the scp -O calls in the README, which the OT-2's ssh server
+needs because it has no sftp-server.
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import io
+import json
+import shlex
+import subprocess
+import tarfile
+from pathlib import Path
+from typing import Optional
+
+REPOSITORY_ROOT = Path(__file__).resolve().parent.parent
+SYNCED_TREES = ("apx_opentrons", "OVP/metadata", "Frankfurt_Melanoma/metadata")
+# the layout workbooks are only needed to compile the CSVs
+SKIPPED_SUFFIXES = (".pyc", ".xlsx")
+SYNC_MANIFEST = ".apx_sync_manifest.json"
+
+ROBOT_HOST = "169.254.113.174"
+ROBOT_ROOT = "/data/user_storage/apricot_data"
+SSH_KEY = ".ssh/ot2_ssh_key"
+
+
+def content_hash(path: Path) -> str:
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+
+def local_files(root: Path = REPOSITORY_ROOT, trees=SYNCED_TREES) -> dict[str, str]:
+    """sha256 of every file to sync, by path relative to root."""
+    files = {}
+    for tree in trees:
+        for path in sorted((root / tree).rglob("*")):
+            if (path.is_file() and "__pycache__" not in path.parts
+                    and path.suffix not in SKIPPED_SUFFIXES):
+                files[path.relative_to(root).as_posix()] = content_hash(path)
+    return files
+
+
+def changed_files(local: dict[str, str], remote: dict[str, str]) -> list[str]:
+    return [name for name, digest in local.items() if remote.get(name) != digest]
+
+
+def sync_archive(root: Path, names: list[str], manifest: dict[str, str]) -> bytes:
+    """tar archive of the files and, last, the new sync manifest."""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as archive:
+        for name in names:
+            archive.add(root / name, arcname=name, recursive=False)
+        data = (json.dumps(manifest, indent=2, sort_keys=True) + "\n").encode()
+        info = tarfile.TarInfo(SYNC_MANIFEST)
+        info.size = len(data)
+        archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+class DirectoryTarget:
+    """A local directory standing in for the robot."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def __str__(self) -> str:
+        return str(self.root)
+
+    def read_manifest(self) -> dict[str, str]:
+        try:
+            return json.loads((self.root / SYNC_MANIFEST).read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def hashes(self, names: list[str]) -> dict[str, str]:
+        return {name: content_hash(self.root / name) for name in names
+                if (self.root / name).is_file()}
+
+    def push(self, archive: bytes) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        with tarfile.open(fileobj=io.BytesIO(archive)) as members:
+            # only plain files below root, where the Python version has the filter
+            members.extractall(self.root, **({"filter": "data"}
+                                             if hasattr(tarfile, "data_filter") else {}))
+
+    def delete(self, names: list[str]) -> None:
+        for name in names:
+            (self.root / name).unlink(missing_ok=True)
+
+
+class SSHTarget:
+    """The robot, reached by running shell commands through ssh_command."""
+
+    def __init__(self, root: str = ROBOT_ROOT, ssh_command: Optional[list[str]] = None):
+        self.root = root
+        self.ssh_command = ssh_command or ["ssh", "-i", SSH_KEY, f"root@{ROBOT_HOST}"]
+
+    def __str__(self) -> str:
+        return f"{' '.join(self.ssh_command)}:{self.root}"
+
+    def run(self, command: str, data: Optional[bytes] = None) -> bytes:
+        completed = subprocess.run(self.ssh_command + [command], input=data,
+                                   capture_output=True)
+        if completed.returncode != 0:
+            raise RuntimeError(f"{command!r} failed on {self}: "
+                               f"{completed.stderr.decode(errors='replace').strip()}")
+        return completed.stdout
+
+    def read_manifest(self) -> dict[str, str]:
+        path = shlex.quote(f"{self.root}/{SYNC_MANIFEST}")
+        output = self.run(f"cat {path} 2>/dev/null || true")
+        try:
+            return json.loads(output) if output.strip() else {}
+        except ValueError:
+            return {}
+
+    def hashes(self, names: list[str]) -> dict[str, str]:
+        if not names:
+            return {}
+        # sha256sum skips missing files with a message on stderr
+        output = self.run(f"cd {shlex.quote(self.root)} && "
+                          f"sha256sum {' '.join(shlex.quote(name) for name in names)} "
+                          f"2>/dev/null || true")
+        hashes = {}
+        for line in output.decode().splitlines():
+            digest, _, name = line.partition("  ")
+            hashes[name] = digest
+        return hashes
+
+    def push(self, archive: bytes) -> None:
+        root = shlex.quote(self.root)
+        self.run(f"mkdir -p {root} && tar -xf - -C {root}", data=archive)
+
+    def delete(self, names: list[str]) -> None:
+        if names:
+            self.run(f"cd {shlex.quote(self.root)} && "
+                     f"rm -f {' '.join(shlex.quote(name) for name in names)}")
+
+
+def sync(target, root: Path = REPOSITORY_ROOT, trees=SYNCED_TREES, push: bool = False,
+         verify: bool = False, delete: bool = False) -> tuple[list[str], list[str]]:
+    """Changed files and files removed locally, copied to and deleted on
+    target if push (and delete)."""
+    local = local_files(root, trees)
+    manifest = target.read_manifest()
+    remote = target.hashes(sorted(set(local) | set(manifest))) if verify else manifest
+    changed = changed_files(local, remote)
+    removed = sorted(name for name in remote if name not in local)
+
+    # files removed locally stay listed until they are deleted
+    new_manifest = dict(local)
+    if not delete:
+        new_manifest.update({name: remote[name] for name in removed})
+    if push and (changed or new_manifest != manifest):
+        target.push(sync_archive(root, changed, new_manifest))
+        if delete:
+            target.delete(removed)
+    return changed, removed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--push", action="store_true", help="copy the changed files")
+    parser.add_argument("--verify", action="store_true",
+                        help="hash the files on the robot instead of reading the manifest")
+    parser.add_argument("--delete", action="store_true",
+                        help="delete synced files that were removed locally")
+    parser.add_argument("--target", help="sync to this local directory instead of the robot")
+    parser.add_argument("--ssh", help=f'ssh command (default: "ssh -i {SSH_KEY} root@{ROBOT_HOST}")')
+    parser.add_argument("--root", default=ROBOT_ROOT, help="directory on the robot")
+    args = parser.parse_args(argv)
+
+    if args.target:
+        target = DirectoryTarget(args.target)
+    else:
+        target = SSHTarget(args.root, shlex.split(args.ssh) if args.ssh else None)
+    changed, removed = sync(target, push=args.push, verify=args.verify, delete=args.delete)
+
+    verb = "copied" if args.push else "to copy"
+    print(f"{target}: {len(changed)} file(s) {verb}")
+    for name in changed:
+        print(f"    {name}")
+    if removed:
+        print(f"{len(removed)} file(s) removed locally"
+              + (" and deleted" if args.push and args.delete else ", delete with --delete"))
+        for name in removed:
+            print(f"    {name}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,96 @@
+"""Order the wells of a distribution to shorten gantry travel.
+
+A distribution visits its destinations in chunks, going back to the
+source (a consolidation: to the destination) after every chunk. The route
+is built nearest neighbour first from the source and improved with 2-opt
+(reversing segments of the order) on the total xy distance, including the
+trips back to the source, as long as that shortens it. Coordinates come
+from the loaded labware (see timing.location_point); locations without
+coordinates, e.g. in plans built offline, keep their order.
+"""
+from __future__ import annotations
+
+from typing import Callable, Optional
+
+from .timing import location_point
+
+# stop improving after this many passes over all segment reversals
+MAX_PASSES = 20
+
+
+def distance(a: tuple, b: tuple) -> float:
+    """xy distance in mm, the z travel does not depend on the order."""
+    return ((a[0] - b[0])**2 + (a[1] - b[1])**2) ** 0.5
+
+
+def route_length(points: list[tuple], hub: tuple,
+                 chunk: Callable[[list], list[list]]) -> float:
+    """Distance of visiting points in order in the chunks given by chunk,
+    starting at and returning to hub for every chunk."""
+    total = 0.0
+    for sub_list in chunk(points):
+        position = hub
+        for point in sub_list:
+            total += distance(position, point)
+            position = point
+        total += distance(position, hub)
+    return total
+
+
+def nearest_neighbour(points: list[tuple], start: tuple) -> list[int]:
+    order = []
+    remaining = set(range(len(points)))
+    position = start
+    while remaining:
+        # ties go to the earlier point, so equal layouts keep their order
+        nearest = min(remaining, key=lambda i: (distance(position, points[i]), i))
+        order.append(nearest)
+        remaining.remove(nearest)
+        position = points[nearest]
+    return order
+
+
+def two_opt(order: list[int], cost: Callable[[list[int]], float],
+            max_passes: int = MAX_PASSES) -> list[int]:
+    best = cost(order)
+    for _ in range(max_passes):
+        improved = False
+        for i in range(len(order) - 1):
+            for j in range(i + 2, len(order) + 1):
+                candidate = order[:i] + order[i:j][::-1] + order[j:]
+                length = cost(candidate)
+                if length < best - 1e-9:
+                    order, best, improved = candidate, length, True
+        if not improved:
+            break
+    return order
+
+
+def shortest_route(locations: list, hub,
+                   chunk: Callable[[list], list[list]]) -> list:
+    """locations reordered to shorten the route from hub through the chunks
+    and back, or unchanged if any coordinates are unknown or the given
+    order is already as short."""
+    points = [location_point(location) for location in locations]
+    hub_point = location_point(hub)
+    if len(locations) < 3 or hub_point is None or None in points:
+        return list(locations)
+
+    def cost(order: list[int]) -> float:
+        return route_length([points[i] for i in order], hub_point, chunk)
+
+    given = list(range(len(locations)))
+    order = two_opt(nearest_neighbour(points, hub_point), cost)
+    if cost(order) >= cost(given):
+        order = given
+    return [locations[i] for i in order]
+
+
+def travel_distance(locations: list) -> Optional[float]:
+    """xy distance along consecutive locations in mm, None if any location
+    has no coordinates."""
+    points = [location_point(location) for location in locations
+              if location is not None]
+    if None in points:
+        return None
+    return sum(distance(a, b) for a, b in zip(points, points[1:]))
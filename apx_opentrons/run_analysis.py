@@ -0,0 +1,252 @@
+"""Compare run logs from the robot (see run_log.py) with the estimate.
+
+Every log is aligned command by command with the simulated commands of
+the same protocol and run time parameters (see estimate.py), and the
+measured durations are added up next to the estimated ones, by command and
+by protocol line. The largest differences and the longest gaps between
+commands (e.g. homing or a paused run, which the protocol does not issue
+itself) are listed, e.g.
+
+    python -m apx_opentrons.run_analysis run_logs/*.jsonl --labware-dir path/to/custom_labware
+
+Logs are read one record at a time and every protocol and parameter
+combination is simulated once, so any number of plates can be analyzed.
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import heapq
+import json
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterator, Optional
+
+from .batch_simulate import REPOSITORY_ROOT, find_protocols
+from .estimate import estimate_commands, format_duration, statement_label
+from .simulation import load_protocol, protocol_parameters, simulate_protocol
+from .timing import DEFAULT_TIMING, TimingModel
+
+# simulated commands skipped at most while looking for the next logged one
+LOOKAHEAD = 50
+
+
+def read_run_log(path) -> Iterator[dict]:
+    """Records of a JSON lines or CSV run log, one at a time."""
+    path = Path(path)
+    with open(path, newline="") as file:
+        if path.suffix == ".csv":
+            for row in csv.DictReader(file):
+                record = {key: value for key, value in row.items() if value != ""}
+                for key in ("time", "volume", "seconds"):
+                    if key in record:
+                        record[key] = float(record[key])
+                yield record
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+@dataclass
+class Expected:
+    """A command the protocol issues in the simulation, with the estimated
+    duration of it and its nested commands."""
+    action: str
+    line: Optional[int]
+    seconds: float
+
+
+def expected_commands(result, timing: TimingModel = DEFAULT_TIMING) -> list[Expected]:
+    """Top-level commands of a simulation, i.e. the calls the run log sees."""
+    estimates = {id(estimate.command): estimate.total
+                 for estimate in estimate_commands(result.commands, timing)}
+    expected = []
+    for command in result.commands:
+        if command.depth == 0:
+            expected.append(Expected(command.action, command.line, 0.0))
+        if expected:
+            expected[-1].seconds += estimates.get(id(command), 0.0)
+    return expected
+
+
+@dataclass
+class Totals:
+    count: int = 0
+    estimated: float = 0.0
+    actual: float = 0.0
+
+    def add(self, estimated: float, actual: float) -> None:
+        self.count += 1
+        self.estimated += estimated
+        self.actual += actual
+
+
+@dataclass
+class Comparison:
+    """Aggregated comparison of any number of runs."""
+    top: int = 10
+    n_runs: int = 0
+    by_action: dict = field(default_factory=dict)
+    by_line: dict = field(default_factory=dict)
+    unmatched_log: dict = field(default_factory=dict)
+    unmatched_plan: dict = field(default_factory=dict)
+    gap_seconds: float = 0.0
+    # (difference, run, index, action, line, estimated, actual), kept small
+    largest: list = field(default_factory=list)
+    # (seconds, run, after action)
+    gaps: list = field(default_factory=list)
+
+    def _keep(self, heap: list, item: tuple) -> None:
+        if len(heap) < self.top:
+            heapq.heappush(heap, item)
+        else:
+            heapq.heappushpop(heap, item)
+
+    def add_run(self, name: str, records: Iterator[dict],
+                expected: list[Expected]) -> None:
+        self.n_runs += 1
+        position = 0
+        end_of_previous = None
+        previous_action = "start"
+        for index, record in enumerate(records):
+            action = record["command"]
+            if action in ("start", "end"):
+                continue
+            start, seconds = record.get("time"), record.get("seconds", 0.0)
+            if end_of_previous is not None and start is not None:
+                gap = start - end_of_previous
+                if gap > 0:
+                    self.gap_seconds += gap
+                    self._keep(self.gaps, (gap, name, previous_action))
+            if start is not None:
+                end_of_previous = start + seconds
+            previous_action = action
+
+            match = None
+            for offset in range(min(LOOKAHEAD, len(expected) - position)):
+                if expected[position + offset].action == action:
+                    match = position + offset
+                    break
+            if match is None:
+                self.unmatched_log[action] = self.unmatched_log.get(action, 0) + 1
+                self.by_action.setdefault(action, Totals()).add(0.0, seconds)
+                continue
+            for skipped in expected[position:match]:
+                self.unmatched_plan[skipped.action] = self.unmatched_plan.get(skipped.action, 0) + 1
+            position = match + 1
+
+            command = expected[match]
+            self.by_action.setdefault(action, Totals()).add(command.seconds, seconds)
+            self.by_line.setdefault(command.line, Totals()).add(command.seconds, seconds)
+            self._keep(self.largest, (seconds - command.seconds, name, index, action,
+                                      command.line, command.seconds, seconds))
+
+        for skipped in expected[position:]:
+            self.unmatched_plan[skipped.action] = self.unmatched_plan.get(skipped.action, 0) + 1
+
+
+def _header(path) -> dict:
+    for record in read_run_log(path):
+        if record["command"] == "start":
+            return json.loads(record.get("note") or "{}")
+        break
+    return {}
+
+
+def protocols_by_name(root: Path = REPOSITORY_ROOT) -> dict[str, list[Path]]:
+    names: dict[str, list[Path]] = {}
+    for path in find_protocols(root):
+        module = load_protocol(path)
+        names.setdefault(module.metadata["protocolName"], []).append(path)
+    return names
+
+
+def format_comparison(comparison: Comparison, label) -> str:
+    def row(name, totals: Totals) -> str:
+        difference = totals.actual - totals.estimated
+        return (f"{name:<62}{totals.count:>7}{format_duration(totals.estimated):>10}"
+                f"{format_duration(totals.actual):>10}{difference:>+10.0f}s")
+
+    header = f"{'':<62}{'count':>7}{'estimate':>10}{'actual':>10}{'difference':>11}"
+    lines = [f"{comparison.n_runs} runs", "", "by command", header]
+    for action, totals in sorted(comparison.by_action.items(),
+                                 key=lambda item: item[1].estimated - item[1].actual):
+        lines.append(row(action, totals))
+
+    lines += ["", "by protocol line", header]
+    for line, totals in sorted(comparison.by_line.items(),
+                               key=lambda item: item[1].estimated - item[1].actual):
+        lines.append(row(label(line), totals))
+
+    lines += ["", f"time between commands (homing, pauses, planning): "
+                  f"{format_duration(comparison.gap_seconds)}"]
+    for gap, name, action in sorted(comparison.gaps, reverse=True):
+        lines.append(f"    {gap:>8.1f}s after {action} in {name}")
+
+    lines += ["", "largest differences"]
+    for difference, name, index, action, line, estimated, actual in sorted(
+            comparison.largest, reverse=True):
+        lines.append(f"    {difference:>+8.1f}s {action} (estimate {estimated:.1f}s, "
+                     f"actual {actual:.1f}s), record {index} of {name}: {label(line)}")
+
+    if comparison.unmatched_log or comparison.unmatched_plan:
+        lines += ["", f"logged but not simulated: {comparison.unmatched_log}",
+                  f"simulated but not logged: {comparison.unmatched_plan}"]
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("logs", nargs="+", type=Path)
+    parser.add_argument("--protocol", type=Path,
+                        help="protocol file of the logs (default: found by the protocol "
+                             "name in the log)")
+    parser.add_argument("--labware-dir", action="append", default=[], type=Path,
+                        help="directory with custom labware definitions (*.json)")
+    parser.add_argument("--top", type=int, default=10,
+                        help="number of largest differences and gaps to list")
+    args = parser.parse_args(argv)
+
+    names = None
+    simulated: dict[tuple, list[Expected]] = {}
+    comparisons: dict[Path, Comparison] = {}
+    for log in args.logs:
+        header = _header(log)
+        path = args.protocol
+        if path is None:
+            if names is None:
+                names = protocols_by_name()
+            candidates = names.get(header.get("protocol"), [])
+            if len(candidates) != 1:
+                print(f"skipping {log}: {len(candidates)} protocols named "
+                      f"{header.get('protocol')!r}, use --protocol")
+                continue
+            path = candidates[0]
+        path = path.resolve()
+
+        specs = protocol_parameters(load_protocol(path))
+        params = {name: value for name, value in header.get("params", {}).items()
+                  if name in specs}
+        key = (path, tuple(sorted(params.items())))
+        if key not in simulated:
+            result = simulate_protocol(path, params=params, labware_dirs=args.labware_dir)
+            if not result.ok:
+                print(f"skipping {log}: simulation failed, {result.error}")
+                simulated[key] = None
+                continue
+            simulated[key] = expected_commands(result)
+        if simulated[key] is None:
+            continue
+        comparison = comparisons.setdefault(path, Comparison(top=args.top))
+        comparison.add_run(log.name, read_run_log(log), simulated[key])
+
+    for path, comparison in comparisons.items():
+        print(f"{path.relative_to(REPOSITORY_ROOT) if path.is_relative_to(REPOSITORY_ROOT) else path}")
+        print(format_comparison(comparison, lambda line: statement_label(path, line)))
+        print()
+    return 0 if comparisons else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
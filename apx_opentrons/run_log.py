@@ -0,0 +1,204 @@
+"""Record how long every pipette and protocol command takes on the robot.
+
+At the start of run(), a protocol wraps its ProtocolContext:
+
+    protocol = instrument(protocol, metadata["protocolName"])
+
+and closes the log as the last step of run():
+
+    close_run_log(protocol)
+
+Pipettes loaded through the wrapped context are wrapped as well, and
+every aspirate, dispense, mix, touch_tip, tip handling, move, delay and
+comment is written to a run log with its start time, location, volume
+and duration. Commands issued by the helpers in this package (distribute,
+consolidate, wash, ...) go through the same pipette and are logged one by
+one.
+
+Logs are JSON lines (or CSV) in /data/user_storage/apricot_data/run_logs,
+or the directory in APX_RUN_LOG_DIR, named after the protocol and the
+start of the run. Every record is flushed as it is written, and the log
+of a run that stops before close_run_log is closed when Python exits.
+Nothing is logged while the protocol is analyzed or
+simulated.
+"""
+from __future__ import annotations
+
+import atexit
+import csv
+import json
+import os
+import re
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Optional
+
+LOG_DIR_VARIABLE = "APX_RUN_LOG_DIR"
+DEFAULT_LOG_DIR = Path("/data/user_storage/apricot_data/run_logs")
+FIELDS = ("time", "command", "location", "volume", "seconds", "note")
+
+PIPETTE_COMMANDS = {"aspirate", "dispense", "mix", "touch_tip", "blow_out",
+                    "air_gap", "pick_up_tip", "drop_tip", "return_tip", "move_to",
+                    "transfer", "distribute", "consolidate"}
+PROTOCOL_COMMANDS = {"delay", "home", "pause", "comment", "move_labware"}
+
+
+def location_name(location) -> Optional[str]:
+    """Deck slot and well of a Well or Location, e.g. "6/C3"."""
+    if location is None:
+        return None
+    labware = getattr(location, "labware", None)
+    if labware is not None:
+        # a Location, e.g. well.bottom(z=1)
+        if getattr(labware, "is_well", False):
+            location = labware.as_well()
+        else:
+            return str(labware)
+    if hasattr(location, "well_name"):
+        return f"{getattr(location.parent, 'parent', '?')}/{location.well_name}"
+    return str(location)
+
+
+class RunLog:
+    """Append-only run log, one record per command, flushed every line so
+    an aborted run still leaves a usable log."""
+
+    def __init__(self, path, format: Optional[str] = None):
+        self.path = Path(path)
+        self.format = format or ("csv" if self.path.suffix == ".csv" else "jsonl")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "a", newline="", buffering=1)
+        self._writer = None
+        if self.format == "csv":
+            self._writer = csv.DictWriter(self._file, fieldnames=FIELDS)
+            if self.path.stat().st_size == 0:
+                self._writer.writeheader()
+        # runs that raise never reach close_run_log
+        atexit.register(self.close)
+
+    def write(self, command: str, location=None, volume: Optional[float] = None,
+              seconds: float = 0.0, note: Optional[str] = None,
+              start: Optional[float] = None) -> None:
+        record = {"time": round(time.time() if start is None else start, 3),
+                  "command": command,
+                  "location": location_name(location),
+                  "volume": volume,
+                  "seconds": round(seconds, 3),
+                  "note": note}
+        if self._writer is not None:
+            self._writer.writerow(record)
+        else:
+            self._file.write(json.dumps({key: value for key, value in record.items()
+                                         if value is not None}) + "\n")
+
+    def close(self) -> None:
+        atexit.unregister(self.close)
+        self._file.close()
+
+
+def _argument(args, kwargs, name: str, position: int):
+    if name in kwargs:
+        return kwargs[name]
+    return args[position] if len(args) > position else None
+
+
+class _Instrumented(ABC):
+    """Forwards everything to the wrapped object and times the commands
+    named in _commands, which _record writes to the log."""
+
+    _commands: set = set()
+
+    def __init__(self, wrapped, log: RunLog):
+        object.__setattr__(self, "_wrapped", wrapped)
+        object.__setattr__(self, "_log", log)
+
+    def __getattr__(self, name):
+        attribute = getattr(self._wrapped, name)
+        if name not in self._commands or not callable(attribute):
+            return attribute
+
+        def timed(*args, **kwargs):
+            start, counter = time.time(), time.perf_counter()
+            result = attribute(*args, **kwargs)
+            self._record(name, args, kwargs, start, time.perf_counter() - counter)
+            return result
+        return timed
+
+    def __setattr__(self, name, value):
+        setattr(self._wrapped, name, value)
+
+    @abstractmethod
+    def _record(self, name, args, kwargs, start, seconds) -> None:
+        ...
+
+
+class InstrumentedPipette(_Instrumented):
+    _commands = PIPETTE_COMMANDS
+
+    def _record(self, name, args, kwargs, start, seconds) -> None:
+        if name in ("aspirate", "dispense"):
+            volume, location = _argument(args, kwargs, "volume", 0), _argument(args, kwargs, "location", 1)
+        elif name == "mix":
+            volume, location = _argument(args, kwargs, "volume", 1), _argument(args, kwargs, "location", 2)
+        elif name in ("transfer", "distribute", "consolidate"):
+            volume, location = _argument(args, kwargs, "volume", 0), _argument(args, kwargs, "source", 1)
+        else:
+            # commands without a location act where the pipette is
+            volume, location = None, _argument(args, kwargs, "location", 0)
+        self._log.write(name, location, volume, seconds,
+                        note=self._wrapped.mount, start=start)
+
+
+class InstrumentedProtocol(_Instrumented):
+    _commands = PROTOCOL_COMMANDS
+
+    def load_instrument(self, *args, **kwargs):
+        return InstrumentedPipette(self._wrapped.load_instrument(*args, **kwargs), self._log)
+
+    def _record(self, name, args, kwargs, start, seconds) -> None:
+        note = _argument(args, kwargs, "msg", 0) if name in ("comment", "pause") else None
+        self._log.write(name, seconds=seconds, note=note, start=start)
+
+
+def log_path(protocol_name: str, log_dir=None, format: str = "jsonl") -> Path:
+    log_dir = Path(log_dir or os.environ.get(LOG_DIR_VARIABLE, DEFAULT_LOG_DIR))
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", protocol_name).strip("_")
+    return log_dir / f"{time.strftime('%Y%m%d_%H%M%S')}_{slug}.{format}"
+
+
+def instrument(protocol, protocol_name: str, log_dir=None, format: str = "jsonl"):
+    """Wrap a ProtocolContext so its pipettes and commands are timed into a
+    new run log, see module docs. Returns protocol unchanged while
+    simulating or if the log cannot be created."""
+    if protocol.is_simulating():
+        return protocol
+    path = log_path(protocol_name, log_dir, format)
+    try:
+        log = RunLog(path, format)
+    except OSError as error:
+        protocol.comment(f"No run log: {error}")
+        return protocol
+    log.write("start", note=json.dumps({"protocol": protocol_name,
+                                        "params": _parameters(protocol)}))
+    protocol.comment(f"Logging command timings to {path}")
+    return InstrumentedProtocol(protocol, log)
+
+
+def close_run_log(protocol) -> None:
+    """Write the end of the run and close the log of a protocol wrapped by
+    instrument, nothing to do for an unwrapped one."""
+    if isinstance(protocol, InstrumentedProtocol):
+        protocol._log.write("end")
+        protocol._log.close()
+
+
+def _parameters(protocol) -> dict:
+    params = getattr(protocol, "params", None)
+    if params is None:
+        return {}
+    try:
+        return dict(params.get_all())
+    except AttributeError:
+        return {name: value for name, value in vars(params).items()
+                if not name.startswith("_")}
@@ -0,0 +1,297 @@
+"""Offline simulation of the protocols in this repository.
+
+Loads a protocol file, collects the parameters it defines in
+add_parameters, runs run() against the opentrons simulator and records
+every command the protocol issues, including the ones nested inside
+mix/transfer.
+"""
+from __future__ import annotations
+
+import hashlib
+import importlib.util
+import json
+import linecache
+import sys
+from dataclasses import dataclass, field
+from pathlib import Path
+from types import ModuleType, SimpleNamespace
+from typing import Any, Optional, Union
+
+
+@dataclass
+class ParameterSpec:
+    """A run time parameter defined in a protocol's add_parameters."""
+    name: str
+    kind: str
+    default: Any
+    choices: Optional[list] = None
+    minimum: Optional[float] = None
+    maximum: Optional[float] = None
+
+
+# limits the robot software enforces when a protocol is uploaded
+MAX_DISPLAY_NAME_LENGTH = 30
+MAX_DESCRIPTION_LENGTH = 100
+
+
+class ParameterRecorder:
+    """Stand-in for protocol_api.Parameters that records the definitions.
+
+    Display names and descriptions are checked against the limits of the
+    robot software, which rejects the protocol otherwise.
+    """
+
+    def __init__(self):
+        self.specs: dict[str, ParameterSpec] = {}
+
+    def _add(self, kind, variable_name, default, choices=None, minimum=None,
+             maximum=None, display_name="", description=None, **kwargs):
+        if len(display_name) > MAX_DISPLAY_NAME_LENGTH:
+            raise ValueError(f"{variable_name}: display name {display_name!r} is longer "
+                             f"than {MAX_DISPLAY_NAME_LENGTH} characters")
+        if description is not None and len(description) > MAX_DESCRIPTION_LENGTH:
+            raise ValueError(f"{variable_name}: description is longer than "
+                             f"{MAX_DESCRIPTION_LENGTH} characters")
+        self.specs[variable_name] = ParameterSpec(
+            name=variable_name,
+            kind=kind,
+            default=default,
+            choices=[choice["value"] for choice in choices] if choices else None,
+            minimum=minimum,
+            maximum=maximum)
+
+    def add_bool(self, variable_name, display_name, default, **kwargs):
+        self._add("bool", variable_name, default, display_name=display_name, **kwargs)
+
+    def add_int(self, variable_name, display_name, default, **kwargs):
+        self._add("int", variable_name, default, display_name=display_name, **kwargs)
+
+    def add_float(self, variable_name, display_name, default, **kwargs):
+        self._add("float", variable_name, default, display_name=display_name, **kwargs)
+
+    def add_str(self, variable_name, display_name, default, **kwargs):
+        self._add("str", variable_name, default, display_name=display_name, **kwargs)
+
+
+@dataclass
+class Command:
+    """A command recorded from the simulator's command broker.
+
+    depth is 0 for commands issued by the protocol and increases for
+    commands nested inside e.g. a mix or transfer. line is the line of the
+    protocol file that issued the top-level command. Positions and flow
+    rates are captured when the command is issued, so the record holds no
+    references to live opentrons objects.
+    """
+    action: str
+    text: str
+    depth: int
+    line: Optional[int] = None
+    is_leaf: bool = True
+    point: Optional[tuple] = None
+    volume: Optional[float] = None
+    flow_rate: Optional[float] = None
+    seconds: float = 0.0
+
+
+def _point(location, clearance: Optional[float] = None) -> Optional[tuple]:
+    """Deck coordinates of a Location or Well, None for e.g. a trash bin."""
+    if hasattr(location, "point"):
+        point = location.point
+    elif hasattr(location, "well_name"):
+        point = (location.bottom(z=clearance) if clearance is not None
+                 else location.top()).point
+    else:
+        # a TrashBin or WasteChute, whose top() has no point (and is not
+        # available before API 2.18)
+        return None
+    return (point.x, point.y, point.z)
+
+
+# broker names of commands that run logs record under the pipette method
+ACTION_ALIASES = {"drop_tip_in_disposal_location": "drop_tip",
+                  "move_to_disposal_location": "move_to"}
+
+
+def _command_from_message(message: dict, depth: int, line: Optional[int]) -> Command:
+    # "command.ASPIRATE" -> "aspirate"
+    action = message["name"].split(".", 1)[-1].lower()
+    action = ACTION_ALIASES.get(action, action)
+    payload = message.get("payload", {})
+    instrument = payload.get("instrument")
+    volume = payload.get("volume")
+    rate = payload.get("rate") or 1.0
+
+    flow_rate = None
+    clearance = None
+    if instrument is not None and action in ("aspirate", "dispense", "blow_out"):
+        flow_rate = getattr(instrument.flow_rate, action) * rate
+        if action != "blow_out":
+            clearance = getattr(instrument.well_bottom_clearance, action)
+
+    seconds = 0.0
+    if action == "delay":
+        seconds = (payload.get("minutes") or 0) * 60 + (payload.get("seconds") or 0)
+
+    location = payload.get("location")
+    return Command(action=action,
+                   text=payload.get("text", ""),
+                   depth=depth,
+                   line=line,
+                   point=_point(location, clearance) if location is not None else None,
+                   volume=volume,
+                   flow_rate=flow_rate,
+                   seconds=seconds)
+
+
+@dataclass
+class SimulationResult:
+    path: Path
+    params: dict
+    commands: list = field(default_factory=list)
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    @property
+    def n_tips(self) -> int:
+        return sum(1 for command in self.commands if command.action == "pick_up_tip")
+
+    def source_line(self, line: Optional[int]) -> str:
+        if line is None:
+            return ""
+        return linecache.getline(str(self.path), line).strip()
+
+
+def load_protocol(path: Union[str, Path]) -> ModuleType:
+    """Import a protocol file as a module (file names start with digits)."""
+    path = Path(path).resolve()
+    name = "apx_protocol_" + hashlib.md5(str(path).encode()).hexdigest()[:12]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def protocol_parameters(module: ModuleType) -> dict[str, ParameterSpec]:
+    recorder = ParameterRecorder()
+    if hasattr(module, "add_parameters"):
+        module.add_parameters(recorder)
+    return recorder.specs
+
+
+def parse_param_values(specs: dict[str, ParameterSpec], items) -> dict:
+    """Convert name=value strings into typed run time parameter values."""
+    values = {}
+    for item in items:
+        name, _, text = item.partition("=")
+        if name not in specs:
+            raise ValueError(f"unknown parameter {name}, "
+                             f"choose from {sorted(specs)}")
+        kind = specs[name].kind
+        if kind == "bool":
+            if text.lower() not in ("true", "false"):
+                raise ValueError(f"{name} expects true or false, got {text}")
+            values[name] = text.lower() == "true"
+        elif kind == "int":
+            values[name] = int(text)
+        elif kind == "float":
+            values[name] = float(text)
+        else:
+            values[name] = text
+    return values
+
+
+def load_custom_labware(labware_dirs) -> dict:
+    """Read custom labware definitions (*.json) keyed by their URI."""
+    definitions = {}
+    for labware_dir in labware_dirs or []:
+        for definition_path in sorted(Path(labware_dir).glob("*.json")):
+            definition = json.loads(definition_path.read_text())
+            uri = (f"{definition['namespace']}/"
+                   f"{definition['parameters']['loadName']}/"
+                   f"{definition['version']}")
+            definitions[uri] = definition
+    return definitions
+
+
+class _ContextWithParams:
+    """Protocol context with run time parameters set from a plain dict."""
+
+    def __init__(self, context, params: dict):
+        self._context = context
+        self.params = SimpleNamespace(**params)
+
+    def __getattr__(self, name):
+        return getattr(self._context, name)
+
+
+class _CommandRecorder:
+    """Broker subscriber that flattens nested commands into a list."""
+
+    def __init__(self, protocol_path: Path):
+        self.protocol_path = str(protocol_path)
+        self.commands: list[Command] = []
+        self._depth = 0
+        self._line = None
+
+    def _protocol_line(self) -> Optional[int]:
+        frame = sys._getframe(1)
+        while frame is not None:
+            if frame.f_code.co_filename == self.protocol_path:
+                return frame.f_lineno
+            frame = frame.f_back
+        return None
+
+    def __call__(self, message: dict) -> None:
+        if message.get("$") == "after":
+            self._depth -= 1
+            return
+
+        if self.commands and self.commands[-1].depth < self._depth:
+            self.commands[-1].is_leaf = False
+        if self._depth == 0:
+            self._line = self._protocol_line()
+
+        self.commands.append(_command_from_message(message, self._depth, self._line))
+        self._depth += 1
+
+
+def simulate_protocol(path: Union[str, Path],
+                      params: Optional[dict] = None,
+                      labware_dirs=None) -> SimulationResult:
+    """Run a protocol in the opentrons simulator and record its commands.
+
+    params overrides the defaults from add_parameters. Errors raised by the
+    protocol are stored on the result instead of being raised.
+    """
+    from opentrons import simulate
+    try:
+        from opentrons.legacy_commands import types as command_types
+    except ImportError:
+        # robot software before 7.0
+        from opentrons.commands import types as command_types
+
+    path = Path(path).resolve()
+    module = load_protocol(path)
+    values = {name: spec.default for name, spec in protocol_parameters(module).items()}
+    values.update(params or {})
+    result = SimulationResult(path=path, params=values)
+
+    context = simulate.get_protocol_api(
+        module.requirements["apiLevel"],
+        extra_labware=load_custom_labware(labware_dirs) or None)
+    recorder = _CommandRecorder(path)
+    unsubscribe = context.broker.subscribe(command_types.COMMAND, recorder)
+    try:
+        module.run(_ContextWithParams(context, values))
+    except Exception as error:
+        # stored as text so results can be passed between processes
+        result.error = f"{type(error).__name__}: {error}"
+    finally:
+        unsubscribe()
+
+    result.commands = recorder.commands
+    return result
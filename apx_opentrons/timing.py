@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Optional
+
+
+def location_point(location) -> Optional[tuple]:
+    """(x, y, z) deck coordinates of a Location or Well, None if unknown
+    (e.g. plans built offline with placeholder locations)."""
+    if hasattr(location, "point"):
+        point = location.point
+    elif hasattr(location, "top"):
+        point = location.top().point
+    else:
+        return None
+    return (point.x, point.y, point.z)
+
+
+@dataclass(frozen=True)
+class TimingModel:
+    """Rough duration model for pipetting steps on the OT-2.
+
+    Defaults correspond to a p300 gen2 pipette at default flow rates; the
+    fixed overheads are averages of gantry moves between neighbouring
+    labware on the deck.
+    """
+    aspirate_flow_rate: float = 92.86  # ul/s
+    dispense_flow_rate: float = 92.86  # ul/s
+    blow_out_flow_rate: float = 92.86  # ul/s
+    # used when no coordinates are known (plans built offline)
+    move_seconds: float = 1.5
+    # gantry motion between known coordinates
+    xy_speed: float = 400.0  # mm/s
+    z_speed: float = 125.0  # mm/s
+    arc_clearance: float = 10.0  # mm above the higher of both points
+    move_overhead_seconds: float = 0.3
+    # fixed parts of commands, without the move to the tip rack/trash
+    pick_up_tip_seconds: float = 4.5
+    drop_tip_seconds: float = 3.5
+    touch_tip_seconds: float = 2.5
+    blow_out_seconds: float = 1.0
+    home_seconds: float = 10.0
+
+    @classmethod
+    def for_pipette(cls, pipette, **kwargs) -> "TimingModel":
+        """Model using the flow rates currently set on a loaded pipette."""
+        return cls(aspirate_flow_rate=pipette.flow_rate.aspirate,
+                   dispense_flow_rate=pipette.flow_rate.dispense,
+                   blow_out_flow_rate=pipette.flow_rate.blow_out,
+                   **kwargs)
+
+    def liquid_seconds(self, action: str, volume: float, rate: float = 1.0) -> float:
+        """Time the plunger needs to move volume at rate times the flow rate."""
+        if action == "aspirate":
+            flow_rate = self.aspirate_flow_rate
+        elif action == "dispense":
+            flow_rate = self.dispense_flow_rate
+        else:
+            flow_rate = self.blow_out_flow_rate
+        return volume / (flow_rate * rate)
+
+    def travel_seconds(self, start: Optional[tuple], end: Optional[tuple]) -> float:
+        """Time to move between two (x, y, z) deck coordinates.
+
+        Moves within the same well only travel in z; moves between wells
+        arc up to arc_clearance above the higher point.
+        """
+        if start is None or end is None:
+            return self.move_seconds
+        dx, dy = end[0] - start[0], end[1] - start[1]
+        xy_distance = (dx*dx + dy*dy) ** 0.5
+        if xy_distance < 0.1:
+            return abs(end[2] - start[2]) / self.z_speed
+        safe_z = max(start[2], end[2]) + self.arc_clearance
+        z_distance = (safe_z - start[2]) + (safe_z - end[2])
+        return (xy_distance / self.xy_speed + z_distance / self.z_speed
+                + self.move_overhead_seconds)
+
+    def step_seconds(self, step, previous_location: Optional[Any] = None) -> float:
+        """Estimated duration of a liquid_handling.Step.
+
+        A move is counted whenever the step targets a different location
+        than the previous one, from the deck coordinates if both locations
+        have them.
+        """
+        seconds = 0.0
+        if step.location is not None and step.location != previous_location:
+            seconds += self.travel_seconds(location_point(previous_location),
+                                           location_point(step.location))
+
+        if step.action == "aspirate":
+            seconds += self.liquid_seconds("aspirate", step.volume, step.rate)
+        elif step.action == "dispense":
+            # a dispense without volume empties the tip; the volume is not
+            # known here, so count it as a short move-and-dispense
+            if step.volume is not None:
+                seconds += self.liquid_seconds("dispense", step.volume, step.rate)
+        elif step.action == "mix":
+            seconds += step.repetitions * (
+                self.liquid_seconds("aspirate", step.volume, step.rate)
+                + self.liquid_seconds("dispense", step.volume, step.rate))
+        elif step.action == "touch_tip":
+            seconds += self.touch_tip_seconds
+        elif step.action == "blow_out":
+            seconds += self.blow_out_seconds
+        elif step.action == "delay":
+            seconds += step.seconds
+        elif step.action == "pick_up_tip":
+            seconds += self.move_seconds + self.pick_up_tip_seconds
+        elif step.action == "drop_tip":
+            seconds += self.move_seconds + self.drop_tip_seconds
+        return seconds
+
+    def plan_seconds(self, steps) -> float:
+        """Estimated duration of a sequence of steps."""
+        total = 0.0
+        previous_location = None
+        for step in steps:
+            total += self.step_seconds(step, previous_location)
+            if step.location is not None:
+                previous_location = step.location
+        return total
+
+
+DEFAULT_TIMING = TimingModel()
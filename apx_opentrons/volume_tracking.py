@@ -0,0 +1,203 @@
+"""Track the liquid volume in every well through the planned steps.
+
+Protocols load their liquids through a VolumeTracker instead of calling
+well.load_liquid directly,
+
+    volumes = VolumeTracker()
+    volumes.load_liquid(reservoir["A1"], PBS, 8000)
+
+and pass it to distribute, consolidate and wash (volumes=volumes). Every
+plan is replayed channel by channel on the tracked volumes before it is
+executed, and aspirating a source below its dead volume or dispensing
+more than a well holds is recorded as a problem. Aspirating more than a
+well holds from any other well (e.g. removing a wash completely) takes up
+air.
+
+At the end, volumes.report(protocol) adds run comments with the volume
+every source needs for the chosen parameters and the problems found, so
+they show up in the protocol analysis before the run. With
+VolumeTracker(strict=True) problems raise a ValueError instead, which
+fails the analysis; use it once the loaded volumes are no longer guesses.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Optional
+
+from .liquid_handling import VOLUME_TOLERANCE, Plan
+from .run_log import location_name
+
+# volume that cannot be aspirated from a well, see "OT2 notes.txt"
+DEAD_VOLUMES = {
+    "nest_12_reservoir_15ml": 400.0,
+    "greinermasterblock_96_wellplate_2000ul": 20.0,
+}
+
+
+@dataclass
+class WellVolume:
+    name: str
+    capacity: Optional[float]
+    dead_volume: float = 0.0
+    loaded: float = 0.0
+    volume: float = 0.0
+    lowest: float = 0.0
+    highest: float = 0.0
+    source: bool = False
+
+    @property
+    def required(self) -> float:
+        """Volume to load so the well never drops below its dead volume."""
+        return self.loaded - self.lowest + self.dead_volume
+
+    @property
+    def runs_dry(self) -> bool:
+        return self.source and self.lowest < self.dead_volume - VOLUME_TOLERANCE
+
+    @property
+    def overflows(self) -> bool:
+        return self.capacity is not None and self.highest > self.capacity + VOLUME_TOLERANCE
+
+
+def _well(location):
+    """The well of a Well or a Location in a well, None for other locations."""
+    labware = getattr(location, "labware", None)
+    if labware is not None:
+        return labware.as_well() if getattr(labware, "is_well", False) else None
+    return location if hasattr(location, "well_name") else None
+
+
+def channel_wells(well, n_channels: int) -> list:
+    """Wells reached by the channels of a pipette positioned at well.
+
+    All channels of a multichannel pipette land in the same well of a
+    reservoir, and in every other row of a 384-well plate.
+    """
+    if n_channels == 1:
+        return [well]
+    labware = well.parent
+    n_rows = len(labware.rows())
+    if n_rows == 1:
+        return [well] * n_channels
+    column = labware.columns_by_name()[well.well_name[1:]]
+    start = column.index(well)
+    return column[start::max(1, n_rows // n_channels)][:n_channels]
+
+
+class VolumeTracker:
+    def __init__(self, strict: bool = False):
+        self.strict = strict
+        self.wells: dict[str, WellVolume] = {}
+        # liquid in every channel of the attached tip
+        self.tip: list[float] = []
+
+    def _state(self, well) -> WellVolume:
+        name = location_name(well)
+        if name not in self.wells:
+            self.wells[name] = WellVolume(
+                name, getattr(well, "max_volume", None),
+                DEAD_VOLUMES.get(getattr(well.parent, "load_name", None), 0.0))
+        return self.wells[name]
+
+    def load_liquid(self, well, liquid, volume: float) -> None:
+        """Load a liquid into well and start tracking its volume."""
+        well.load_liquid(liquid=liquid, volume=volume)
+        state = self._state(well)
+        state.loaded += volume
+        state.volume += volume
+        state.lowest = state.highest = state.volume
+
+    def available(self, well, n_channels: int = 1) -> float:
+        """Volume per channel a pipette at well can aspirate before a loaded
+        well reaches its dead volume."""
+        wells = [self._state(target) for target in channel_wells(well, n_channels)]
+        loaded = [state for state in wells if state.loaded > 0]
+        if not loaded:
+            return 0.0
+        return min((state.volume - state.dead_volume)
+                   / sum(1 for other in wells if other is state)
+                   for state in loaded)
+
+    def _add(self, well, volume: float) -> None:
+        state = self._state(well)
+        state.volume += volume
+        state.highest = max(state.highest, state.volume)
+
+    def _remove(self, well, volume: float) -> float:
+        """Aspirate volume from well, returns the liquid taken up."""
+        state = self._state(well)
+        if not state.source:
+            taken = min(volume, max(0.0, state.volume))
+            state.volume -= taken
+            return taken
+        state.volume -= volume
+        state.lowest = min(state.lowest, state.volume)
+        return volume
+
+    def apply(self, plan: Plan, n_channels: int = 1, sources: tuple = ()) -> None:
+        """Replay plan on the tracked volumes, aspirating from the loaded
+        wells of sources down to their dead volume and from other wells as
+        far as they hold liquid.
+
+        If strict, a ValueError listing the problems is raised.
+        """
+        for source in sources:
+            # wells left empty on purpose, e.g. the ends of a source column,
+            # only give air
+            for well in channel_wells(_well(source), n_channels):
+                state = self._state(well)
+                state.source = state.source or state.loaded > 0
+        if len(self.tip) != n_channels:
+            self.tip = [0.0] * n_channels
+
+        for step in plan.steps:
+            well = _well(step.location)
+            if step.action in ("pick_up_tip", "drop_tip"):
+                self.tip = [0.0] * n_channels
+            elif step.action == "aspirate" and well is not None:
+                for channel, target in enumerate(channel_wells(well, n_channels)):
+                    self.tip[channel] += self._remove(target, step.volume)
+            elif step.action in ("dispense", "blow_out"):
+                for channel, target in enumerate(
+                        channel_wells(well, n_channels) if well is not None
+                        else [None] * n_channels):
+                    volume = self.tip[channel]
+                    if step.action == "dispense" and step.volume is not None:
+                        volume = min(step.volume, volume)
+                    self.tip[channel] -= volume
+                    if target is not None:
+                        self._add(target, volume)
+        problems = self.problems()
+        if problems and self.strict:
+            raise ValueError("; ".join(problems))
+
+    def problems(self) -> list[str]:
+        """Sources that run dry and wells that overflow, one line per
+        labware for the overflowing wells."""
+        problems = [f"{state.name} runs dry, load at least {state.required:.0f} ul "
+                    f"({state.loaded:g} ul loaded)"
+                    for state in self.wells.values() if state.runs_dry]
+        overflowing: dict[str, list[WellVolume]] = {}
+        for state in self.wells.values():
+            if state.overflows:
+                overflowing.setdefault(state.name.split("/")[0], []).append(state)
+        for states in overflowing.values():
+            names = ", ".join(state.name for state in states[:4]) + (", ..." if len(states) > 4 else "")
+            problems.append(f"{len(states)} wells overflow ({names}), up to "
+                            f"{max(state.highest for state in states):.1f} ul in "
+                            f"{states[0].capacity:g} ul wells")
+        return problems
+
+    def minimum_fill(self) -> dict[str, float]:
+        """Volume every source needs, by well."""
+        return {state.name: state.required for state in self.wells.values()
+                if state.source}
+
+    def report(self, protocol) -> None:
+        for state in self.wells.values():
+            if state.source:
+                protocol.comment(f"{state.name}: {state.loaded - state.lowest:.0f} ul used, "
+                                 f"load at least {state.required:.0f} ul "
+                                 f"({state.loaded:g} ul loaded)")
+        for problem in self.problems():
+            protocol.comment(f"WARNING: {problem}")
@@ -0,0 +1,60 @@
+"""Custom labware for simulating the protocols.
+
+The lab's definitions are read from the directory in APX_LABWARE_DIR.
+Without it, the 384-well plate is taken from the Protocol Designer height
+tests and the other custom labware is stood in for by the Opentrons
+labware with the same wells and capacity, which is enough to check that
+a protocol runs but not to time it.
+"""
+import copy
+import json
+import os
+from pathlib import Path
+
+import pytest
+
+REPOSITORY_ROOT = Path(__file__).resolve().parent.parent
+
+# custom load name -> (Opentrons load name, capacity per well in ul)
+STAND_IN_LABWARE = {
+    "greinermasterblock_96_wellplate_2000ul": ("nest_96_wellplate_2ml_deep", 2000),
+    "integra300ml_1_reservoir_300000ul": ("agilent_1_reservoir_290ml", 300000),
+    "integr3000ml_1_reservoir_300000ul": ("agilent_1_reservoir_290ml", 300000),
+    "integra150ml_1_reservoir_150000ul": ("agilent_1_reservoir_290ml", 150000),
+}
+
+
+def _designer_definitions() -> dict:
+    definitions = {}
+    for path in sorted(REPOSITORY_ROOT.glob("*/height_tests/*.json")):
+        for definition in json.loads(path.read_text())["labwareDefinitions"].values():
+            if definition["namespace"] != "opentrons":
+                definitions[definition["parameters"]["loadName"]] = definition
+    return definitions
+
+
+def _stand_in(load_name: str, opentrons_name: str, capacity: float) -> dict:
+    from opentrons_shared_data.labware import load_definition
+
+    definition = copy.deepcopy(load_definition(opentrons_name, 1))
+    definition["namespace"] = "custom_beta"
+    definition["parameters"]["loadName"] = load_name
+    definition["metadata"]["displayName"] = f"{load_name} (stand-in)"
+    for well in definition["wells"].values():
+        well["totalLiquidVolume"] = capacity
+    return definition
+
+
+@pytest.fixture(scope="session")
+def labware_dirs(tmp_path_factory) -> list:
+    pytest.importorskip("opentrons")
+    if os.environ.get("APX_LABWARE_DIR"):
+        return [Path(os.environ["APX_LABWARE_DIR"])]
+
+    directory = tmp_path_factory.mktemp("labware")
+    definitions = _designer_definitions()
+    for load_name, (opentrons_name, capacity) in STAND_IN_LABWARE.items():
+        definitions.setdefault(load_name, _stand_in(load_name, opentrons_name, capacity))
+    for load_name, definition in definitions.items():
+        (directory / f"{load_name}.json").write_text(json.dumps(definition))
+    return [directory]
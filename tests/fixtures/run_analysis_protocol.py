@@ -0,0 +1,36 @@
+from opentrons import protocol_api
+
+# metadata
+metadata = {
+    "protocolName": "Run analysis test",
+    "description": """Two aspirations and dispenses with one tip, the
+     protocol of the run log next to it.""",
+    "author": "Adrian Tschan"
+    }
+
+# requirements
+requirements = {"robotType": "OT-2", "apiLevel": "2.18"}
+
+def add_parameters(parameters: protocol_api.Parameters):
+
+    parameters.add_int(
+    variable_name="n_wells",
+    display_name="Number of wells",
+    description="How many wells get 50 ul from A12?",
+    minimum=1,
+    maximum=11,
+    default=1,
+    )
+
+# protocol run function
+def run(protocol: protocol_api.ProtocolContext):
+
+    tips = protocol.load_labware("opentrons_96_filtertiprack_200ul", 1)
+    plate = protocol.load_labware("corning_96_wellplate_360ul_flat", 2)
+    pipette = protocol.load_instrument("p300_single_gen2", "right", tip_racks=[tips])
+
+    pipette.pick_up_tip()
+    for well in plate.rows()[0][:protocol.params.n_wells]:
+        pipette.aspirate(50, plate["A12"])
+        pipette.dispense(50, well)
+    pipette.drop_tip()
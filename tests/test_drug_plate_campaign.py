@@ -0,0 +1,31 @@
+from apx_opentrons.drug_plate_campaign import (DRUG_VOLUME, MANUAL_COLUMNS, RESIDUAL_VOLUME,
+                                               plan_campaign, summarize_campaign)
+from apx_opentrons.liquid_handling import PipetteLimits
+from apx_opentrons.metadata_resolver import load_plate_metadata
+
+P20 = PipetteLimits(max_volume=20, min_volume=1)
+
+
+def test_plates_are_split_into_full_aspirations():
+    # one 20 ul aspiration serves 6 plates of 3 ul with 2 ul residual
+    loads = plan_campaign(12, 9, DRUG_VOLUME, P20, RESIDUAL_VOLUME)
+    assert [load.plates for load in loads] == [list(range(1, 7)), list(range(7, 13))]
+    assert [len(load.aspirations(DRUG_VOLUME, P20, RESIDUAL_VOLUME)) for load in loads] == [1, 1]
+
+    # 7 + 7 plates would take 4 aspirations per column
+    loads = plan_campaign(14, 9, DRUG_VOLUME, P20, RESIDUAL_VOLUME)
+    assert len(loads) == 2
+    assert sum(len(load.aspirations(DRUG_VOLUME, P20, RESIDUAL_VOLUME)) for load in loads) == 3
+    assert loads[1].plates[-1] == 14
+
+
+def test_summary_adds_up_the_drug_per_master_plate_well():
+    layout = load_plate_metadata("OVP", "drug_plate_metadata", "2.0")
+    layout = layout.exclude("col", *MANUAL_COLUMNS["2.0"])
+    summary = summarize_campaign(layout, 12, 6, P20, DRUG_VOLUME, RESIDUAL_VOLUME,
+                                 dead_volume=20)
+    assert (summary.loads, summary.tips) == (2, 2 * summary.columns)
+    assert summary.dispensed == 36
+    assert summary.residual == 4
+    assert summary.required == 60
+    assert summary.lost_fraction == 24 / 60
@@ -0,0 +1,207 @@
+from collections import Counter
+
+import pytest
+
+from apx_opentrons.drug_transfer import (COMBINATION_TIERS, SINGLE_TIERS, Transfer,
+                                         drug_transfers, plan_multi_channel, plan_premixes,
+                                         schedule_drug_transfers, spare_wells)
+from apx_opentrons.liquid_handling import PipetteLimits
+from apx_opentrons.plate_geometry import head_wells
+from apx_opentrons.metadata_resolver import load_plate_metadata
+
+from conftest import REPOSITORY_ROOT
+
+DRUG_TRANSFER_PROTOCOLS = ("OVP/sample_processing_protocols/04_OVP_drug_transfer.py",
+                           "Frankfurt_Melanoma/sample_processing_protocols/04_OVP_drug_transfer.py")
+
+
+def ovp_transfers() -> list[Transfer]:
+    drug_plate = load_plate_metadata("OVP", "drug_plate_metadata", "2.0")
+    cell_plate = load_plate_metadata("OVP", "plate_metadata", "2.0")
+    return drug_transfers(cell_plate.exclude("experimental_unit", "elution_control"),
+                          {"drug_plate": drug_plate})
+
+
+def melanoma_transfers() -> list[Transfer]:
+    return drug_transfers(
+        load_plate_metadata("Frankfurt_Melanoma", "plate_metadata", "1.0"),
+        {"melanoma": load_plate_metadata("Frankfurt_Melanoma", "drug_plate_metadata", "1.0"),
+         "ovarian": load_plate_metadata("Frankfurt_Melanoma", "drug_plate_metadata_ovarian",
+                                        "1.3")},
+        panel_column="drug_panel")
+
+
+def test_drug_transfers_take_singles_from_1000x_and_partners_from_2000x():
+    drug_plate = load_plate_metadata("OVP", "drug_plate_metadata", "2.0")
+    transfers = ovp_transfers()
+    for transfer in transfers:
+        well = transfer.source[1]
+        if transfer.drug == transfer.condition:
+            assert transfer.volume == 5
+            assert well == drug_plate.source_well(transfer.drug, SINGLE_TIERS)
+        else:
+            assert transfer.volume == 2.5
+            assert well == drug_plate.source_well(transfer.drug, COMBINATION_TIERS)
+
+    per_well = Counter(transfer.dest for transfer in transfers)
+    for transfer in transfers:
+        assert per_well[transfer.dest] == (1 if transfer.drug == transfer.condition else 2)
+
+
+@pytest.mark.parametrize("transfers", [ovp_transfers, melanoma_transfers])
+def test_schedule_delivers_every_transfer_once(transfers):
+    transfers = transfers()
+    groups = schedule_drug_transfers(transfers)
+
+    delivered = Counter((dest, group.drug, group.source, group.volume)
+                        for group in groups for dest in group.dest)
+    planned = Counter((transfer.dest, transfer.drug, transfer.source, transfer.volume)
+                      for transfer in transfers)
+    assert delivered == planned
+
+    # a second drug is only added after the first one
+    position = {(dest, group.drug): i for i, group in enumerate(groups) for dest in group.dest}
+    for transfer in transfers:
+        for prior in transfer.prior:
+            assert position[(transfer.dest, prior)] < position[(transfer.dest, transfer.drug)]
+
+
+def test_groups_only_reuse_tips_into_drug_free_wells():
+    transfers = {(transfer.dest, transfer.drug): transfer for transfer in ovp_transfers()}
+    for group in schedule_drug_transfers(list(transfers.values())):
+        assert group.reuse_tip == (group.prior == ())
+        for dest in group.dest:
+            assert transfers[(dest, group.drug)].prior == group.prior
+
+
+def column_transfers(source_column: int, head: str, volume: float = 5) -> list[Transfer]:
+    return [Transfer(f"drug {source}", f"drug {source}", ("drug_plate", source), dest, volume)
+            for source, dest in zip(head_wells(f"A{source_column}", plate_size=96),
+                                    head_wells(head))]
+
+
+def test_multi_channel_only_moves_columns_all_channels_need():
+    full = column_transfers(1, "A3") + column_transfers(1, "A5")
+    # one channel would dispense into a well without its drug
+    partial = column_transfers(2, "B3")[:7]
+    # one channel would dispense another volume
+    mixed = column_transfers(3, "B5")
+    mixed[-1] = mixed[-1]._replace(volume=2.5)
+    # a combination partner has to wait for the first drug
+    combined = [transfer._replace(prior=("drug A1",)) for transfer in column_transfers(1, "B7")]
+
+    transfers = full + partial + mixed + combined
+    moves, single = plan_multi_channel(transfers)
+
+    assert len(moves) == 1
+    assert (moves[0].source, moves[0].dest, moves[0].volume) == ("A1", ["A3", "A5"], 5)
+    assert moves[0].transfers == full
+    assert single == partial + mixed + combined
+
+
+@pytest.mark.parametrize("transfers", [ovp_transfers, melanoma_transfers])
+def test_multi_channel_and_single_channel_share_the_transfers(transfers):
+    transfers = transfers()
+    moves, single = plan_multi_channel(transfers)
+
+    moved = [transfer for move in moves for transfer in move.transfers]
+    assert Counter(moved + single) == Counter(transfers)
+    for move in moves:
+        assert len(move.transfers) == 8 * len(move.columns)
+
+
+def test_premixes_replace_both_partners_of_every_combination_well():
+    drug_plate = load_plate_metadata("OVP", "drug_plate_metadata", "2.0")
+    transfers = ovp_transfers()
+    premixes, premixed = plan_premixes(transfers, {"drug_plate": drug_plate},
+                                       PipetteLimits(max_volume=20, min_volume=1),
+                                       residual_volume=5, reuse_tips=True, dead_volume=20)
+
+    singles = [transfer for transfer in transfers if transfer.drug == transfer.condition]
+    combinations = {transfer.dest: transfer.condition for transfer in transfers
+                    if transfer.drug != transfer.condition}
+    assert premixed[:len(singles)] == singles
+    assert {transfer.dest: transfer.condition for transfer in premixed[len(singles):]} \
+        == combinations
+    assert len(premixed) == len(singles) + len(combinations)
+
+    assert [premix.well for premix in premixes] == spare_wells(drug_plate)[:len(premixes)]
+    for premix in premixes:
+        assert len(premix.partners) == 2
+        # one kept tip: every dispense, the residual once and the dead volume
+        assert premix.volume == 5 * len(premix.dest) + 5 + 20
+        assert all(transfer.source == ("drug_plate", premix.well) and transfer.volume == 5
+                   for transfer in premixed if transfer.condition == premix.condition)
+
+
+def test_premixes_that_do_not_fit_raise_before_any_pipetting():
+    metadata = {"drug_plate": load_plate_metadata("OVP", "drug_plate_metadata", "2.0")}
+    limits = PipetteLimits(max_volume=20, min_volume=1)
+    with pytest.raises(ValueError, match="exceeds the well capacity of 50 ul"):
+        plan_premixes(ovp_transfers(), metadata, limits, capacity=50)
+    with pytest.raises(ValueError, match="premixes take 65 ul from well A2"):
+        plan_premixes(ovp_transfers(), metadata, limits, dead_volume=20, source_volume=80)
+
+
+@pytest.mark.parametrize("path", DRUG_TRANSFER_PROTOCOLS)
+@pytest.mark.parametrize("process_full_plate", [False, True])
+def test_drug_transfer_protocols_simulate(path, process_full_plate, labware_dirs):
+    from apx_opentrons.simulation import simulate_protocol
+
+    result = simulate_protocol(REPOSITORY_ROOT / path,
+                               params={"process_full_plate": process_full_plate},
+                               labware_dirs=labware_dirs)
+    assert result.ok, result.error
+
+
+def test_reused_tips_halve_the_tips_of_the_full_ovp_plate(labware_dirs):
+    from apx_opentrons.simulation import simulate_protocol
+
+    path = REPOSITORY_ROOT / DRUG_TRANSFER_PROTOCOLS[0]
+    tips = {reuse_tips: simulate_protocol(path, params={"reuse_tips": reuse_tips,
+                                                         "process_full_plate": True},
+                                          labware_dirs=labware_dirs).n_tips
+            for reuse_tips in (False, True)}
+    assert tips == {False: 80, True: 40}
+
+
+@pytest.mark.parametrize("path", DRUG_TRANSFER_PROTOCOLS)
+def test_drug_transfer_protocols_simulate_with_premixed_combinations(path, labware_dirs):
+    from apx_opentrons.simulation import simulate_protocol
+
+    result = simulate_protocol(REPOSITORY_ROOT / path, params={"premix_combinations": True},
+                               labware_dirs=labware_dirs)
+    assert result.ok, result.error
+    assert any(command.text.startswith("Premixing") for command in result.commands)
+
+
+@pytest.mark.parametrize("path", DRUG_TRANSFER_PROTOCOLS)
+def test_drug_transfer_protocols_simulate_with_multi_channel(path, labware_dirs):
+    from apx_opentrons.simulation import simulate_protocol
+
+    result = simulate_protocol(REPOSITORY_ROOT / path, params={"use_multi_channel": True},
+                               labware_dirs=labware_dirs)
+    assert result.ok, result.error
+
+
+def test_reused_tips_only_go_back_to_the_source_from_above_the_medium(labware_dirs):
+    from apx_opentrons.simulation import simulate_protocol
+
+    result = simulate_protocol(REPOSITORY_ROOT / DRUG_TRANSFER_PROTOCOLS[0],
+                               params={"reuse_tips": True, "process_full_plate": True},
+                               labware_dirs=labware_dirs)
+    commands = [command for command in result.commands if command.is_leaf]
+    # the cell plate is on slot 6
+    dispenses = [command for command in commands
+                 if command.action == "dispense" and "on slot 6" in command.text]
+    top = max(command.point[2] for command in dispenses)
+    assert min(command.point[2] for command in dispenses) < top
+
+    in_medium = False
+    for command in commands:
+        if command.action == "pick_up_tip":
+            in_medium = False
+        elif command in dispenses:
+            in_medium = in_medium or command.point[2] < top
+        elif command.action == "aspirate":
+            assert not in_medium, command.text
@@ -0,0 +1,154 @@
+from collections import Counter
+from itertools import product
+
+import pytest
+
+from apx_opentrons.liquid_handling import (PipetteLimits, chunk_destinations,
+                                           max_dispenses_per_aspiration, plan_distribute,
+                                           plan_wash)
+
+P20 = PipetteLimits(max_volume=20, min_volume=1)
+P300 = PipetteLimits(max_volume=200, min_volume=20)
+WELLS = [f"{row}{column}" for column in range(1, 25) for row in "ABCDEFGHIJKLMNOP"]
+
+
+def replay(plan) -> tuple[Counter, float, float]:
+    """Volume dispensed into every location (residual returns included),
+    total aspirated, and volume dropped with tips, without pre-wetting."""
+    received = Counter()
+    aspirated = dropped = tip = 0.0
+    for step in plan.steps:
+        if step.pre_wet:
+            continue
+        if step.action == "aspirate":
+            aspirated += step.volume
+            tip += step.volume
+        elif step.action == "dispense":
+            volume = tip if step.volume is None else step.volume
+            received[step.location] += volume
+            tip -= volume
+        elif step.action == "drop_tip":
+            dropped += tip
+            tip = 0.0
+    return received, aspirated, dropped
+
+
+@pytest.mark.parametrize("n_items", [1, 5, 6, 7, 13, 48])
+@pytest.mark.parametrize("chunking", ["balanced", "min-trips"])
+def test_chunks_fit_one_aspiration_and_keep_the_order(n_items, chunking):
+    items = WELLS[:n_items]
+    chunks = chunk_destinations(items, 5, P20, residual_volume=5, chunking=chunking)
+
+    assert [item for chunk in chunks for item in chunk] == items
+    assert all(len(chunk) * 5 + 5 <= 20 for chunk in chunks)
+    assert len(chunks) == -(-n_items // 3)
+
+
+def test_balanced_chunks_differ_by_at_most_one():
+    chunks = chunk_destinations(WELLS[:7], 5, P20, residual_volume=5)
+    assert [len(chunk) for chunk in chunks] == [3, 2, 2]
+    chunks = chunk_destinations(WELLS[:7], 5, P20, residual_volume=5, chunking="min-trips")
+    assert [len(chunk) for chunk in chunks] == [3, 3, 1]
+
+
+def test_chunking_rejects_unknown_strategies_and_volumes_that_do_not_fit():
+    with pytest.raises(ValueError, match="unknown chunking"):
+        chunk_destinations(WELLS[:3], 5, P20, chunking="max-fill")
+    with pytest.raises(ValueError, match="do not fit"):
+        max_dispenses_per_aspiration(16, P20, residual_volume=5)
+    with pytest.raises(ValueError, match="below the pipette minimum"):
+        max_dispenses_per_aspiration(10, P300)
+
+
+@pytest.mark.parametrize("chunking, reuse_tips, residual_location, pre_wet_tips",
+                         list(product(["balanced", "min-trips"], [False, True],
+                                      [None, "source", "waste"], [False, True])))
+def test_distribute_delivers_the_volume_once_to_every_well(chunking, reuse_tips,
+                                                           residual_location, pre_wet_tips):
+    dest = WELLS[:13]
+    plan = plan_distribute(5, "source", dest, P20, residual_volume=5,
+                           residual_dispense_location=residual_location,
+                           reuse_tips=reuse_tips, pre_wet_tips=pre_wet_tips,
+                           chunking=chunking)
+    received, aspirated, dropped = replay(plan)
+
+    assert all(received[well] == 5 for well in dest)
+    returned = sum(received[location] for location in ("source", "waste"))
+    assert aspirated == pytest.approx(5 * len(dest) + returned + dropped)
+    # a kept tip carries the residual along unless it can return it after
+    # every chunk
+    keep_residual = reuse_tips and (chunking == "min-trips" or residual_location is None)
+    assert returned + dropped == 5 * (1 if keep_residual else plan.n_aspirations)
+    assert plan.n_aspirations == 5
+    assert plan.n_tips == (1 if reuse_tips else plan.n_aspirations)
+
+
+def test_pre_wetting_is_not_counted_as_an_aspiration():
+    plan = plan_distribute(5, "source", WELLS[:6], P20, residual_volume=5,
+                           pre_wet_tips=True)
+    assert plan.n_aspirations == 2
+    assert sum(1 for step in plan.steps if step.action == "aspirate") == 4
+
+
+@pytest.mark.parametrize("residual_location", [None, "S1"])
+def test_distribute_moves_to_the_next_source_before_one_runs_low(residual_location):
+    sources = ["S1", "S2", "S3"]
+    dest = WELLS[:13]
+    plan = plan_distribute(5, sources, dest, P20, residual_volume=5,
+                           residual_dispense_location=residual_location,
+                           source_volumes=[30, 20, 10])
+    received, _, dropped = replay(plan)
+    assert all(received[well] == 5 for well in dest)
+
+    used = Counter()
+    order = []
+    tip = 0.0
+    for step in plan.steps:
+        if step.action == "aspirate":
+            used[step.location] += step.volume
+            order.append(step.location)
+            tip += step.volume
+        elif step.action == "dispense":
+            volume = tip if step.volume is None else step.volume
+            tip -= volume
+            if step.location in sources:
+                used[step.location] -= volume
+        elif step.action == "drop_tip":
+            tip = 0.0
+    assert order == sorted(order)
+    # the residual goes back to the source it came from, the last source
+    # takes the rest
+    assert used["S1"] <= 30 and used["S2"] <= 20 and used["S3"] > 10
+    assert sum(used.values()) == pytest.approx(5 * len(dest) + dropped)
+
+
+def test_distribute_needs_a_volume_for_every_source():
+    with pytest.raises(ValueError, match="2 source volumes given for 3 sources"):
+        plan_distribute(5, ["S1", "S2", "S3"], WELLS[:3], P20, source_volumes=[50, 30])
+
+
+def test_wash_fills_and_empties_every_well_once_per_cycle():
+    wells = WELLS[:24]
+    plan = plan_wash(40, "reservoir", wells, "waste", P300, n_cycles=3,
+                     final_remove_volume=50, residual_volume=20)
+
+    events = {well: [] for well in wells}
+    tip = waste = 0.0
+    for step in plan.steps:
+        if step.action == "aspirate":
+            tip += step.volume
+            if step.location in events:
+                events[step.location].append(-step.volume)
+        elif step.action == "dispense":
+            volume = tip if step.volume is None else step.volume
+            tip -= volume
+            if step.location in events:
+                events[step.location].append(volume)
+            elif step.location == "waste":
+                waste += volume
+
+    for well in wells:
+        assert events[well] == [40, -40, 40, -40, 40, -50]
+    removed = len(wells) * (40 + 40 + 50)
+    assert removed <= waste <= removed + 20 * plan.n_aspirations
+
@@ -0,0 +1,20 @@
+from apx_opentrons.metadata_compiler import accept_differences, main
+
+from conftest import REPOSITORY_ROOT
+
+CELL_PLATE = REPOSITORY_ROOT / "OVP/metadata/plate_metadata_v2.0.csv"
+
+
+def test_committed_metadata_matches_the_workbooks_and_compiled_files():
+    assert main([]) == 0
+
+
+def test_only_the_recorded_workbook_values_are_accepted():
+    rows = [{"well": "C02", "experimental_unit": "elution_ctrl"},
+            {"well": "E02", "experimental_unit": "elution_controls"},
+            {"well": "C03", "experimental_unit": "elution_ctrl"}]
+    accepted, n_accepted = accept_differences(CELL_PLATE, rows)
+    assert [row["experimental_unit"] for row in accepted] == [
+        "elution_control", "elution_controls", "elution_ctrl"]
+    assert n_accepted == 1
+    assert accept_differences(REPOSITORY_ROOT / "OVP/metadata/other.csv", rows) == (rows, 0)
@@ -0,0 +1,38 @@
+import pytest
+
+from apx_opentrons.batch_simulate import find_protocols, position_conflict, simulate_all
+
+from conftest import REPOSITORY_ROOT
+
+PROTOCOLS = find_protocols() + [REPOSITORY_ROOT / "example_protocol.py"]
+
+
+def test_position_conflicts_are_pipettes_or_plates_in_the_same_place():
+    assert position_conflict({"pipette_position": "left",
+                              "pipette_position_20ul": "left"}) is not None
+    assert position_conflict({"pipette_position": "left",
+                              "pipette_position_20ul": "right"}) is None
+    assert position_conflict({"ovarian_plate_position": 3,
+                              "melanoma_plate_position": 3,
+                              "pipette_position": "left"}) is not None
+    assert position_conflict({"pipette_position": "left", "use_multi_channel": True}) is None
+
+
+@pytest.mark.parametrize("path", PROTOCOLS,
+                         ids=[str(path.relative_to(REPOSITORY_ROOT)) for path in PROTOCOLS])
+def test_protocol_simulates_with_default_parameters(path, labware_dirs):
+    from apx_opentrons.simulation import simulate_protocol
+
+    result = simulate_protocol(path, labware_dirs=labware_dirs)
+    assert result.ok, result.error
+    assert result.n_tips > 0
+
+
+def test_batch_skips_pipettes_on_the_same_mount(labware_dirs):
+    path = REPOSITORY_ROOT / "Frankfurt_Melanoma/sample_processing_protocols/02_OVP_cell_seeding.py"
+    results = simulate_all([path], numeric_values="default", labware_dirs=labware_dirs, jobs=1)
+
+    assert len(results) == 4
+    assert [result.params["pipette_position"] for result in results if result.skipped] == \
+        ["left", "right"]
+    assert all(result.ok for result in results if not result.skipped)
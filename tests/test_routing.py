@@ -0,0 +1,69 @@
+import random
+from types import SimpleNamespace
+
+from apx_opentrons.liquid_handling import PipetteLimits, chunk_destinations, plan_distribute
+from apx_opentrons.routing import route_length, shortest_route
+
+P300 = PipetteLimits(max_volume=200, min_volume=20)
+
+
+class Spot:
+    """A location with deck coordinates, like a Well of a loaded plate."""
+
+    def __init__(self, x: float, y: float):
+        self.point = SimpleNamespace(x=x, y=y, z=0.0)
+
+    def __repr__(self):
+        return f"Spot({self.point.x:g}, {self.point.y:g})"
+
+
+def plate(n_rows: int = 16, n_columns: int = 24, pitch: float = 4.5) -> list[Spot]:
+    return [Spot(column * pitch, -row * pitch)
+            for column in range(n_columns) for row in range(n_rows)]
+
+
+def dispensed(plan) -> list:
+    return [step.location for step in plan.steps if step.action == "dispense"]
+
+
+def length(spots: list[Spot], hub: Spot, chunk) -> float:
+    return route_length([(spot.point.x, spot.point.y) for spot in spots],
+                        (hub.point.x, hub.point.y), chunk)
+
+
+def test_shortest_route_is_a_shorter_order_of_the_same_wells():
+    random.seed(0)
+    wells = random.sample(plate(), 40)
+    source = Spot(-100, 50)
+
+    def chunk(items):
+        return chunk_destinations(items, 20, P300, residual_volume=20)
+
+    route = shortest_route(wells, source, chunk)
+    assert sorted(map(id, route)) == sorted(map(id, wells))
+    assert length(route, source, chunk) < length(wells, source, chunk)
+
+
+def test_shortest_route_keeps_an_order_that_is_already_short():
+    wells = plate(n_rows=1, n_columns=12)
+    assert shortest_route(wells, Spot(-10, 0), lambda items: [items]) == wells
+
+
+def test_wells_without_coordinates_keep_their_order():
+    wells = ["C3", "A1", "B2", "A12"]
+    assert shortest_route(wells, "reservoir", lambda items: [items]) == wells
+
+
+def test_distribute_plans_keep_the_given_order_unless_asked():
+    random.seed(1)
+    wells = random.sample(plate(), 30)
+    source = Spot(-100, 50)
+    kwargs = dict(residual_volume=20)
+
+    plan = plan_distribute(20, source, wells, P300, **kwargs)
+    assert dispensed(plan) == wells
+
+    routed = plan_distribute(20, source, wells, P300, optimize_route=True, **kwargs)
+    assert sorted(map(id, dispensed(routed))) == sorted(map(id, wells))
+    assert routed.travel_distance < plan.travel_distance
+    assert routed.n_aspirations == plan.n_aspirations
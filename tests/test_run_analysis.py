@@ -0,0 +1,39 @@
+import pytest
+
+from apx_opentrons.run_analysis import Comparison, Expected, main, read_run_log
+
+from conftest import REPOSITORY_ROOT
+
+FIXTURES = REPOSITORY_ROOT / "tests" / "fixtures"
+RUN_LOG = FIXTURES / "run_log.jsonl"
+
+
+def test_comparison_aligns_the_log_with_the_simulated_commands():
+    # lines of tests/fixtures/run_analysis_protocol.py
+    expected = [Expected("pick_up_tip", 32, 10.0),
+                Expected("aspirate", 34, 5.0), Expected("dispense", 35, 5.0),
+                Expected("aspirate", 34, 5.0), Expected("dispense", 35, 5.0),
+                Expected("drop_tip", 36, 10.0)]
+    comparison = Comparison()
+    comparison.add_run(RUN_LOG.name, read_run_log(RUN_LOG), expected)
+
+    aspirate = comparison.by_action["aspirate"]
+    assert (aspirate.count, aspirate.estimated, aspirate.actual) == (2, 10.0, 15.0)
+    assert comparison.by_line[35].actual == 12.0
+    # the home is not in the simulation, the robot homed after an error
+    assert comparison.unmatched_log == {"home": 1}
+    assert comparison.by_action["home"].actual == 15.0
+    assert comparison.unmatched_plan == {}
+    assert comparison.gap_seconds == 30.0
+    assert comparison.gaps == [(30.0, RUN_LOG.name, "aspirate")]
+
+
+def test_run_analysis_reports_the_fixture_log(capsys):
+    pytest.importorskip("opentrons")
+
+    assert main([str(RUN_LOG), "--protocol", str(FIXTURES / "run_analysis_protocol.py")]) == 0
+    report = capsys.readouterr().out
+    assert "1 runs" in report
+    assert "30.0s after aspirate in run_log.jsonl" in report
+    assert "logged but not simulated: {'home': 1}" in report
+    assert "simulated but not logged: {}" in report
@@ -0,0 +1,41 @@
+import pytest
+
+from apx_opentrons.run_analysis import read_run_log
+from apx_opentrons.run_log import _Instrumented, close_run_log, instrument
+
+
+class Protocol:
+    """Stands in for a ProtocolContext on the robot."""
+
+    def __init__(self):
+        self.comments = []
+
+    def is_simulating(self) -> bool:
+        return False
+
+    def comment(self, msg: str) -> None:
+        self.comments.append(msg)
+
+
+def test_instrumented_commands_are_logged_until_the_log_is_closed(tmp_path):
+    protocol = instrument(Protocol(), "Run log test", log_dir=tmp_path)
+    protocol.comment("hello")
+    close_run_log(protocol)
+
+    (path,) = tmp_path.iterdir()
+    records = list(read_run_log(path))
+    assert [record["command"] for record in records] == ["start", "comment", "end"]
+    assert records[1]["note"] == "hello"
+    assert protocol._log._file.closed
+
+
+def test_unwrapped_protocols_have_no_log_to_close():
+    protocol = Protocol()
+    protocol.is_simulating = lambda: True
+    assert instrument(protocol, "Run log test") is protocol
+    close_run_log(protocol)
+
+
+def test_instrumented_objects_must_record_their_commands():
+    with pytest.raises(TypeError, match="abstract"):
+        _Instrumented(Protocol(), None)
@@ -0,0 +1,86 @@
+import pytest
+
+from apx_opentrons.liquid_handling import PipetteLimits, plan_distribute, plan_wash
+from apx_opentrons.volume_tracking import VolumeTracker, channel_wells
+
+P20 = PipetteLimits(max_volume=20, min_volume=1)
+P300 = PipetteLimits(max_volume=200, min_volume=20)
+
+
+@pytest.fixture
+def deck():
+    from opentrons import simulate
+
+    protocol = simulate.get_protocol_api("2.18")
+    reservoir = protocol.load_labware("nest_12_reservoir_15ml", 1)
+    plate = protocol.load_labware("corning_384_wellplate_112ul_flat", 2)
+    liquid = protocol.define_liquid(name="PBS", display_color="#1c03fc", description="PBS")
+    return reservoir, plate, liquid
+
+
+def test_distribution_moves_the_volume_from_the_source_to_every_well(deck):
+    reservoir, plate, liquid = deck
+    volumes = VolumeTracker()
+    volumes.load_liquid(reservoir["A1"], liquid, 1000)
+    dest = plate.wells()[:24]
+
+    plan = plan_distribute(5, reservoir["A1"], dest, P20, residual_volume=5,
+                           residual_dispense_location=reservoir["A1"])
+    volumes.apply(plan, sources=(reservoir["A1"],))
+
+    source = volumes.wells["1/A1"]
+    assert source.volume == pytest.approx(1000 - 5 * 24)
+    assert all(volumes.wells[f"2/{well.well_name}"].volume == 5 for well in dest)
+    assert volumes.problems() == []
+    # the residual goes back, but is in the tip when the source is lowest
+    assert volumes.minimum_fill() == {"1/A1": pytest.approx(5 * 24 + 5 + 400)}
+
+
+def test_sources_running_dry_are_problems_and_fail_strict_tracking(deck):
+    reservoir, plate, liquid = deck
+    plan = plan_distribute(5, reservoir["A1"], plate.wells()[:48], P20, residual_volume=5)
+
+    volumes = VolumeTracker()
+    volumes.load_liquid(reservoir["A1"], liquid, 500)
+    volumes.apply(plan, sources=(reservoir["A1"],))
+    assert [problem.split(",")[0] for problem in volumes.problems()] == ["1/A1 runs dry"]
+
+    strict = VolumeTracker(strict=True)
+    strict.load_liquid(reservoir["A1"], liquid, 500)
+    with pytest.raises(ValueError, match="runs dry"):
+        strict.apply(plan, sources=(reservoir["A1"],))
+
+
+def test_all_channels_share_a_reservoir_well_and_spread_over_the_plate(deck):
+    reservoir, plate, liquid = deck
+    volumes = VolumeTracker()
+    volumes.load_liquid(reservoir["A2"], liquid, 2000)
+    assert volumes.available(reservoir["A2"], n_channels=8) == pytest.approx((2000 - 400) / 8)
+
+    plan = plan_distribute(10, reservoir["A2"], [plate["A1"], plate["B1"]], P20)
+    volumes.apply(plan, n_channels=8, sources=(reservoir["A2"],))
+
+    assert volumes.wells["1/A2"].volume == pytest.approx(2000 - 8 * 20)
+    filled = {name: state.volume for name, state in volumes.wells.items()
+              if name.startswith("2/")}
+    assert filled == {f"2/{row}1": 10 for row in "ABCDEFGHIJKLMNOP"}
+    assert channel_wells(plate["B1"], 8)[-1] is plate["P1"]
+
+
+def test_removing_more_than_a_well_holds_takes_up_air_and_overflows_are_problems(deck):
+    reservoir, plate, liquid = deck
+    volumes = VolumeTracker()
+    volumes.load_liquid(reservoir["A1"], liquid, 5000)
+    wells = plate.wells()[:8]
+
+    plan = plan_wash(40, reservoir["A1"], wells, reservoir["A12"], P300, n_cycles=2,
+                     final_remove_volume=50, residual_volume=20)
+    volumes.apply(plan, sources=(reservoir["A1"],))
+
+    assert all(volumes.wells[f"2/{well.well_name}"].volume == 0 for well in wells)
+    assert volumes.wells["1/A12"].volume == pytest.approx(8 * 80)
+    assert volumes.problems() == []
+
+    plan = plan_distribute(60, reservoir["A1"], [plate["A1"], plate["A1"]], P300)
+    volumes.apply(plan, sources=(reservoir["A1"],))
+    assert volumes.problems() == ["1 wells overflow (2/A1), up to 120.0 ul in 112 ul wells"]